@@ -0,0 +1,148 @@
+import numpy as np
+
+from irm import adaptive_curve_rates_scalar
+from jit import njit, NUMBA
+
+SECONDS_PER_YEAR = 365 * 24 * 3600
+
+# Event type codes used by the array kernels
+TYPE_CODES = {
+    "MarketSupply": 1,
+    "MarketWithdraw": 2,
+    "MarketBorrow": 3,
+    "MarketRepay": 4,
+    "MarketLiquidation": 5,
+    "MarketSupplyCollateral": 6,
+    "MarketWithdrawCollateral": 7,
+}
+
+
+def encode_types(types):
+    """Map event type names to TYPE_CODES (0 for anything else)."""
+    codes = np.zeros(len(types), dtype=np.int64)
+    types = np.asarray(types)
+    for name, code in TYPE_CODES.items():
+        codes[types == name] = code
+    return codes
+
+
+def tx_starts(hashes):
+    """Indexes of the first row of every run of equal consecutive hashes."""
+    hashes = np.asarray(hashes)
+    if len(hashes) == 0:
+        return np.zeros(0, dtype=np.int64)
+    new_tx = np.ones(len(hashes), dtype=bool)
+    new_tx[1:] = hashes[1:] != hashes[:-1]
+    return np.flatnonzero(new_tx)
+
+
+@njit(cache=True)
+def _searchsorted_right(a, x):
+    lo = 0
+    hi = len(a)
+    while lo < hi:
+        mid = (lo + hi) // 2
+        if a[mid] <= x:
+            lo = mid + 1
+        else:
+            hi = mid
+    return lo
+
+
+@njit(cache=True)
+def accrue_market_totals(timestamps, starts, type_codes, amounts, hist_ts, hist_rates, fee,
+                         supply0=0.0, borrow0=0.0, last_timestamp0=-1):
+    """
+    Walk the events once, compounding interest between consecutive events
+    with the AdaptiveCurveIRM rates (rate_at_target active at the event
+    timestamp, evaluated in closed form), and apply every
+    supply / withdraw / borrow / repay / liquidation amount.
+
+    Returns total supply / borrow before and after every transaction
+    (`starts` are the first row indexes of the transactions). supply0,
+    borrow0 and last_timestamp0 continue from a previous run, by default
+    the market starts empty at its first event.
+    """
+    n = len(timestamps)
+    n_tx = len(starts)
+    supply_before = np.zeros(n_tx)
+    borrow_before = np.zeros(n_tx)
+    supply_after = np.zeros(n_tx)
+    borrow_after = np.zeros(n_tx)
+
+    total_supply = supply0
+    total_borrow = borrow0
+    if last_timestamp0 >= 0:
+        last_timestamp = last_timestamp0
+    else:
+        last_timestamp = timestamps[0] if n > 0 else 0
+    n_hist = len(hist_ts)
+
+    for t in range(n_tx):
+        start = starts[t]
+        end = starts[t + 1] if t + 1 < n_tx else n
+        supply_before[t] = total_supply
+        borrow_before[t] = total_borrow
+
+        for i in range(start, end):
+            current_timestamp = timestamps[i]
+            time_diff = (current_timestamp - last_timestamp) / SECONDS_PER_YEAR
+
+            if n_hist > 0:
+                util = total_borrow / total_supply if total_supply > 0 else 0.0
+                util = min(max(util, 0.0), 1.0)
+                k = _searchsorted_right(hist_ts, current_timestamp) - 1
+                if k < 0:
+                    k = 0
+                borrow_rate, supply_rate = adaptive_curve_rates_scalar(hist_rates[k], util, fee)
+                total_borrow += total_borrow * (borrow_rate * time_diff)
+                total_supply += total_supply * (supply_rate * time_diff)
+
+            last_timestamp = current_timestamp
+
+            code = type_codes[i]
+            amount = amounts[i]
+            if code == 1:
+                total_supply += amount
+            elif code == 2:
+                total_supply -= amount
+            if code == 3:
+                total_borrow += amount
+            elif code == 4:
+                total_borrow -= amount
+            elif code == 5:
+                total_borrow -= amount
+
+        supply_after[t] = total_supply
+        borrow_after[t] = total_borrow
+
+    return supply_before, borrow_before, supply_after, borrow_after
+
+
+def compute_market_totals(timestamps, hashes, types, amounts, irm_history, initial=None):
+    """
+    Array entry point for calculate_metrics, events must already be sorted
+    by (timestamp, hash), irm_history comes from irm.rate_at_target_history. Returns (starts, supply_before, borrow_before,
+    supply_after, borrow_after). initial is the (total_supply, total_borrow,
+    last_timestamp) the market ended with in a previous run.
+    """
+    starts = tx_starts(hashes)
+    hist_ts, hist_rates, fee = irm_history
+    timestamps = np.asarray(timestamps, dtype=np.int64)
+    type_codes = encode_types(types)
+    amounts = np.asarray(amounts, dtype=np.float64)
+    supply0, borrow0, last_timestamp0 = (0.0, 0.0, -1) if initial is None else initial
+
+    if NUMBA:
+        res = accrue_market_totals(
+            timestamps, starts, type_codes, amounts, hist_ts, hist_rates, float(fee),
+            float(supply0), float(borrow0), int(last_timestamp0),
+        )
+    else:
+        # plain python loop over lists, indexing numpy arrays element by element is much slower
+        res = accrue_market_totals(
+            timestamps.tolist(), starts.tolist(), type_codes.tolist(), amounts.tolist(),
+            hist_ts.tolist(), hist_rates.tolist(), float(fee),
+            float(supply0), float(borrow0), int(last_timestamp0),
+        )
+    return (starts,) + tuple(res)
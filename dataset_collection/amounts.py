@@ -0,0 +1,132 @@
+import pandas as pd
+import numpy as np
+
+COLLATERAL_TYPES = ["MarketSupplyCollateral", "MarketWithdrawCollateral"]
+# raw wei-scale amounts, kept as exact integers until add_amount_units
+AMOUNT_COLUMNS = ["assets", "liquidated_assets", "shares"]
+# read_csv dtypes of the raw amounts, so they never go through float64
+RAW_DTYPES = {column: str for column in AMOUNT_COLUMNS}
+INT64_DIGITS = 18
+
+
+def raw_amounts(values):
+    """
+    Exact integer amounts: an Int64 series when every value fits in int64,
+    an object series of python ints otherwise. Missing values are NA / None.
+    Values that were written as floats ("1.5e+21") are rounded, the digits
+    they lost are not recovered.
+    """
+    values = pd.Series(values)
+    if pd.api.types.is_integer_dtype(values):
+        return values.astype("Int64")
+
+    s = values.astype(str).str.strip()
+    missing = values.isna().to_numpy() | s.isin(["", "nan", "None", "<NA>"]).to_numpy()
+    is_int = s.str.fullmatch(r"-?\d+").fillna(False).to_numpy(dtype=bool) & ~missing
+    n_digits = s.str.lstrip("-").str.len().to_numpy()
+    floats = ~is_int & ~missing
+    as_float = pd.to_numeric(s[floats], errors="coerce").to_numpy(dtype=np.float64)
+    missing[np.flatnonzero(floats)[np.isnan(as_float)]] = True
+    floats &= ~missing
+
+    fits = (~is_int | (n_digits <= INT64_DIGITS)).all() and (np.abs(as_float[~np.isnan(as_float)]) < 2**63).all()
+    if fits:
+        res = pd.Series(pd.NA, index=values.index, dtype="Int64")
+        if is_int.any():
+            res[is_int] = s[is_int].astype(np.int64).to_numpy()
+        if floats.any():
+            res[floats] = np.round(pd.to_numeric(s[floats]).to_numpy(dtype=np.float64)).astype(np.int64)
+        return res
+
+    res = np.full(len(s), None, dtype=object)
+    res[is_int] = [int(x) for x in s[is_int]]
+    res[floats] = [int(round(float(x))) for x in s[floats]]
+    return pd.Series(res, index=values.index, dtype=object)
+
+
+def scale_amount(values, decimals):
+    """
+    Convert raw wei-scale amounts to token units in one vectorized pass.
+
+    Raw `assets` columns come either as numeric columns or as object
+    columns of huge python ints / digit strings (values above the int64
+    range). Integer strings are split into whole and fractional digits so
+    the division by 10**decimals never goes through an overflowing integer.
+    """
+    values = pd.Series(values)
+    decimals = int(decimals)
+    if pd.api.types.is_numeric_dtype(values):
+        return values.to_numpy(dtype=np.float64, na_value=np.nan) / 10**decimals
+
+    s = values.astype(str).str.strip()
+    is_int = s.str.fullmatch(r"-?\d+").fillna(False).to_numpy(dtype=bool)
+    res = np.full(len(s), np.nan)
+
+    # Non integer strings ("1.5e+21", "nan", "None") are parsed as floats
+    if (~is_int).any():
+        res[~is_int] = pd.to_numeric(s[~is_int], errors="coerce").to_numpy(dtype=np.float64) / 10**decimals
+
+    if is_int.any():
+        ints = s[is_int]
+        sign = np.where(ints.str.startswith("-").to_numpy(dtype=bool), -1.0, 1.0)
+        digits = ints.str.lstrip("-").str.zfill(decimals + 1)
+        if decimals > 0:
+            whole = digits.str[:-decimals].astype(np.float64).to_numpy()
+            frac = digits.str[-decimals:].astype(np.float64).to_numpy()
+            res[is_int] = sign * (whole + frac / 10**decimals)
+        else:
+            res[is_int] = sign * digits.astype(np.float64).to_numpy()
+
+    return res
+
+
+def get_market_decimals(market_meta, asset_data=None, loan_asset_data=None):
+    """(collateral_decimals, loan_decimals), market metadata takes precedence over assets metadata."""
+    collateral_decimals = market_meta.get("collateral_asset_decimals")
+    if collateral_decimals is None and asset_data is not None:
+        collateral_decimals = asset_data["decimals"]
+    loan_decimals = market_meta.get("loan_asset_decimals")
+    if loan_decimals is None and loan_asset_data is not None:
+        loan_decimals = loan_asset_data["decimals"]
+    if collateral_decimals is None or loan_decimals is None:
+        raise ValueError(f"No decimals for market {market_meta.get('address')}")
+    return int(collateral_decimals), int(loan_decimals)
+
+
+def add_amount_units(df, market_meta, asset_data=None, loan_asset_data=None):
+    """
+    Add `assets_units` and `liquidated_assets_units` columns (token units),
+    and `shares_units` when the raw events have shares.
+
+    The raw amount columns are replaced by their exact integers (see
+    raw_amounts), the float64 token units are only what the position,
+    totals and feature code computes with.
+
+    Collateral transfers are scaled with the collateral asset decimals, every
+    other event type with the loan asset decimals. For liquidations `assets`
+    holds the repaid (loan) amount and `liquidated_assets` the seized
+    collateral.
+    """
+    collateral_decimals, loan_decimals = get_market_decimals(market_meta, asset_data, loan_asset_data)
+    df = df.copy()
+    for column in AMOUNT_COLUMNS:
+        if column in df.columns:
+            df[column] = raw_amounts(df[column])
+
+    is_collateral = df["type"].isin(COLLATERAL_TYPES).to_numpy()
+    units = np.zeros(len(df))
+    if is_collateral.any():
+        units[is_collateral] = scale_amount(df["assets"][is_collateral], collateral_decimals)
+    if (~is_collateral).any():
+        units[~is_collateral] = scale_amount(df["assets"][~is_collateral], loan_decimals)
+    df["assets_units"] = units
+
+    if "liquidated_assets" in df.columns:
+        df["liquidated_assets_units"] = scale_amount(df["liquidated_assets"], collateral_decimals)
+
+    if "shares" in df.columns:
+        # only loan side events have shares, their scale does not matter as
+        # long as it is the same for every event of the market
+        df["shares_units"] = scale_amount(df["shares"], loan_decimals)
+
+    return df
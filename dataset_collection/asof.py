@@ -0,0 +1,109 @@
+"""
+As-of / nearest joins over sorted numpy arrays.
+
+    df = attach_asof(df, {
+        "collateral_price": asset_meta["historical_price"],      # [[ts, price], ...]
+        "loan_asset_price": loan_asset_meta["historical_price"],
+        "implied_apy": (yield_ts, yield_values),                  # or (timestamps, values)
+    }, direction="nearest", tolerance=2 * 3600)
+
+direction:
+    "backward" - last right value with timestamp <= left timestamp
+    "forward"  - first right value with timestamp >= left timestamp
+    "nearest"  - closest of the two, ties go to the earlier one
+Rows without a match (or further than `tolerance` from it) get NaN.
+
+Columns of a sorted frame at many timestamps, one search for all of them:
+
+    borrow, supply = asof_columns(hourly_df, open_ts, ["total_borrow", "total_supply"], direction="backward")
+"""
+import numpy as np
+
+
+def asof_indexes(left_ts, right_ts, direction="nearest", tolerance=None):
+    """Positions into right_ts for every left timestamp, -1 where there is no match."""
+    left_ts = np.asarray(left_ts)
+    right_ts = np.asarray(right_ts)
+    n = len(right_ts)
+    if n == 0:
+        return np.full(len(left_ts), -1, dtype=np.int64)
+
+    if direction == "backward":
+        idx = np.searchsorted(right_ts, left_ts, side="right") - 1
+    elif direction == "forward":
+        idx = np.searchsorted(right_ts, left_ts, side="left")
+        idx[idx == n] = -1
+    elif direction == "nearest":
+        right = np.searchsorted(right_ts, left_ts, side="left")
+        left = np.clip(right - 1, 0, n - 1)
+        right = np.clip(right, 0, n - 1)
+        left_diff = np.abs(left_ts - right_ts[left])
+        right_diff = np.abs(right_ts[right] - left_ts)
+        idx = np.where(left_diff <= right_diff, left, right)
+    else:
+        raise ValueError(f"Unknown direction {direction}")
+
+    if tolerance is not None:
+        matched = idx >= 0
+        too_far = np.zeros(len(idx), dtype=bool)
+        too_far[matched] = np.abs(left_ts[matched] - right_ts[idx[matched]]) > tolerance
+        idx[too_far] = -1
+
+    return idx
+
+
+def asof_values(left_ts, right_ts, right_values, direction="nearest", tolerance=None, fill=np.nan):
+    """right_values (1-D or (n_right, k)) gathered at the as-of match of every left timestamp."""
+    idx = asof_indexes(left_ts, right_ts, direction, tolerance)
+    right_values = np.asarray(right_values, dtype=np.float64)
+    if len(right_values) == 0:
+        return np.full((len(idx),) + right_values.shape[1:], fill)
+    res = right_values[np.maximum(idx, 0)]
+    res[idx < 0] = fill
+    return res
+
+
+def asof_columns(df, left_ts, columns, on="timestamp", direction="nearest", tolerance=None, fill=np.nan):
+    """
+    Values of df[columns] (df sorted by `on`) at the as-of match of every left
+    timestamp, one float array per column (a single array for a column name).
+    """
+    single = isinstance(columns, str)
+    names = [columns] if single else list(columns)
+    values = asof_values(left_ts, df[on].to_numpy(), df[names].to_numpy(dtype=np.float64), direction, tolerance, fill)
+    return values[:, 0] if single else [values[:, i] for i in range(len(names))]
+
+
+def to_series(data):
+    """[[ts, value], ...] or (timestamps, values) -> sorted float arrays."""
+    if isinstance(data, tuple) and len(data) == 2:
+        ts, values = data
+    else:
+        arr = np.asarray(data, dtype=np.float64).reshape(-1, 2)
+        ts, values = arr[:, 0], arr[:, 1]
+    ts = np.asarray(ts, dtype=np.float64)
+    values = np.asarray(values, dtype=np.float64)
+    order = np.argsort(ts, kind="stable")
+    return ts[order], values[order]
+
+
+def attach_asof(df, series, on="timestamp", direction="nearest", tolerance=None):
+    """
+    Attach one column per entry of `series` ({column: [[ts, value], ...] or (ts, values)}).
+    Series sharing the same time grid (e.g. hourly prices) are matched with a single search.
+    """
+    df = df.copy()
+    left_ts = df[on].to_numpy(dtype=np.float64)
+    grids = []
+    for col, data in series.items():
+        ts, values = to_series(data)
+        for grid_ts, idx in grids:
+            if len(grid_ts) == len(ts) and np.array_equal(grid_ts, ts):
+                break
+        else:
+            idx = asof_indexes(left_ts, ts, direction, tolerance)
+            grids.append((ts, idx))
+        col_values = values[np.maximum(idx, 0)] if len(values) > 0 else np.full(len(idx), np.nan)
+        col_values[idx < 0] = np.nan
+        df[col] = col_values
+    return df
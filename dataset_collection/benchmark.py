@@ -0,0 +1,148 @@
+"""
+Enrichment benchmark on synthetic markets (synthetic_markets.py).
+
+    python benchmark.py --sizes 10k 100k                      # compare with the baselines
+    python benchmark.py --sizes 10k 100k 1m --update-baselines
+
+Every size runs in a fresh process: read the raw csv, build_enriched_df and
+create_market_hourly_dataset, timed with a StageProfiler. Throughput
+(events / s) of every stage and the peak RSS of the process are compared
+with data/benchmarks/baselines.json; a stage slower or a peak higher than
+the baseline by more than --tolerance counts as a regression and the run
+exits with 1. Baselines are machine specific, refresh them with
+--update-baselines after changing machines.
+"""
+import os
+import sys
+import json
+import time
+import platform
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
+
+import pandas as pd
+
+from synthetic_markets import SIZES, SIZE_LOAN_ASSETS, write_market
+from amounts import RAW_DTYPES
+from profiling import StageProfiler
+from metadata import MetadataStore
+from config import DATA_PATH
+
+BENCH_PATH = DATA_PATH + "/benchmarks"
+BASELINES_FILE = BENCH_PATH + "/baselines.json"
+
+STAGES = ["read_raw", "build_enriched_df", "create_market_hourly_dataset"]
+
+
+def ensure_dataset(size, seed=0):
+    """Generate synthetic_{size} under BENCH_PATH unless it is already there."""
+    name = f"synthetic_{size}"
+    if not os.path.exists(f"{BENCH_PATH}/markets_raw/{name}.csv"):
+        print(f"generating {name}...")
+        write_market(name, SIZES[size], BENCH_PATH, seed, SIZE_LOAN_ASSETS.get(size, "USDC"))
+    return name
+
+
+def run_benchmark(size):
+    """Runs in its own process so that peak RSS belongs to this size only."""
+    from compute_market_metrics_changes_df import build_enriched_df, create_market_hourly_dataset
+    from irm import rate_at_target_history
+
+    name = f"synthetic_{size}"
+    store = MetadataStore(f"{BENCH_PATH}/common")
+    markets_meta, assets_meta = store.markets, store.assets
+    os.makedirs(f"{BENCH_PATH}/markets_enriched", exist_ok=True)
+
+    profiler = StageProfiler(name, reports_path=f"{BENCH_PATH}/reports")
+    with profiler.stage("read_raw") as st:
+        raw_df = pd.read_csv(f"{BENCH_PATH}/markets_raw/{name}.csv", dtype=RAW_DTYPES)
+        st["rows_out"] = len(raw_df)
+    market_meta = markets_meta[raw_df["market_address"].iloc[0]]
+    asset_meta = assets_meta[market_meta["collateral_asset_address"]]
+    loan_asset_meta = assets_meta[market_meta["loan_asset_address"]]
+
+    with profiler.stage("build_enriched_df", rows_in=len(raw_df)) as st:
+        enriched = build_enriched_df(
+            name, raw_df, market_meta, asset_meta, loan_asset_meta, rate_at_target_history(market_meta),
+            profiler=profiler, output_path=f"{BENCH_PATH}/markets_enriched",
+        )
+        st["rows_out"] = len(enriched)
+    with profiler.stage("create_market_hourly_dataset", rows_in=len(enriched)) as st:
+        hourly = create_market_hourly_dataset(enriched, asset_meta)
+        st["rows_out"] = len(hourly)
+    profiler.save()
+
+    report = profiler.report()
+    n_events = len(raw_df)
+    return {
+        "events": n_events,
+        "peak_rss_mb": report["peak_rss_mb"],
+        "stages": {
+            r["stage"]: {"wall_s": r["wall_s"], "events_per_s": n_events / r["wall_s"] if r["wall_s"] > 0 else None}
+            for r in report["stages"]
+        },
+    }
+
+
+def compare(result, baseline, tolerance):
+    """Regression messages of a result against its baseline."""
+    regressions = []
+    for stage in STAGES:
+        now = result["stages"].get(stage, {}).get("events_per_s")
+        before = baseline["stages"].get(stage, {}).get("events_per_s")
+        if now and before and now < before * (1 - tolerance):
+            regressions.append(f"{stage}: {now:,.0f} events/s, baseline {before:,.0f}")
+    if result["peak_rss_mb"] and baseline.get("peak_rss_mb") and result["peak_rss_mb"] > baseline["peak_rss_mb"] * (1 + tolerance):
+        regressions.append(f"peak rss {result['peak_rss_mb']:.0f} MB, baseline {baseline['peak_rss_mb']:.0f} MB")
+    return regressions
+
+
+def load_baselines(path=BASELINES_FILE):
+    if not os.path.exists(path):
+        return {}
+    with open(path, "r") as f:
+        return json.load(f)
+
+
+def save_baselines(baselines, path=BASELINES_FILE):
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    with open(path, "w") as f:
+        json.dump(baselines, f, indent=2)
+
+
+if __name__ == "__main__":
+    import argparse
+
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--sizes', nargs='+', default=["10k", "100k"], choices=list(SIZES), help='Synthetic market sizes to run')
+    parser.add_argument('--update-baselines', action='store_true', help='Store the results as the new baselines')
+    parser.add_argument('--tolerance', type=float, default=0.25, help='Allowed relative slowdown / memory growth')
+    parser.add_argument('--seed', type=int, default=0, help='Seed of newly generated markets')
+    args = parser.parse_args()
+
+    baselines = load_baselines()
+    failed = False
+    for size in args.sizes:
+        ensure_dataset(size, args.seed)
+        with ProcessPoolExecutor(max_workers=1, mp_context=multiprocessing.get_context("spawn")) as executor:
+            result = executor.submit(run_benchmark, size).result()
+
+        print(f"\nsynthetic_{size}: {result['events']} events, peak rss {result['peak_rss_mb']:.0f} MB")
+        for stage in STAGES:
+            st = result["stages"][stage]
+            print(f"  {stage:30s} {st['wall_s']:9.2f}s {st['events_per_s']:>14,.0f} events/s")
+
+        if args.update_baselines:
+            baselines[size] = dict(result, machine=platform.platform(), python=platform.python_version(), recorded_at=int(time.time()))
+        elif size in baselines:
+            regressions = compare(result, baselines[size], args.tolerance)
+            for message in regressions:
+                print(f"  REGRESSION {message}")
+            failed = failed or bool(regressions)
+        else:
+            print("  no baseline, run with --update-baselines to store one")
+
+    if args.update_baselines:
+        save_baselines(baselines)
+        print(f"baselines written to {BASELINES_FILE}")
+    sys.exit(1 if failed else 0)
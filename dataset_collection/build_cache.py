@@ -0,0 +1,155 @@
+"""
+Content-hashed cache for derived artifacts.
+
+An artifact is fingerprinted by the content hash of its input files, the
+source of the code that builds it and its parameters, and rebuilt only if
+one of its outputs is missing or the fingerprint changed. Since a rebuild
+changes the hash of the files it writes, artifacts built from them become
+stale automatically.
+
+    cache = BuildCache()
+    fingerprint = cache.fingerprint([raw_file], local_imports(__file__), params)
+    if cache.is_stale(outputs, fingerprint):
+        build()
+        cache.record(outputs, fingerprint, [raw_file], params)
+        cache.save()
+
+Artifacts built this way, each tier an input of the next one:
+
+    raw events -> enriched events and rollups -> spikes -> all_spikes_dataset.csv
+
+Enriched events and rollups: market_job in compute_market_metrics_changes_df.py,
+the params being the sequence window and rules, price lookbacks and the
+market / asset metadata. Spikes: spikes_job and build_spikes_dataset in
+spikes_dataset.py, the params being the detect_market_spikes thresholds.
+The pipeline's spikes stage runs after the enrichment of each market.
+"""
+import os
+import json
+import ast
+import time
+import hashlib
+import inspect
+
+from manifest import fresh_entry
+from config import DATA_PATH
+
+CACHE_PATH = DATA_PATH + "/.build_cache.json"
+
+
+def sha256_file(path, chunk_size=1 << 20):
+    h = hashlib.sha256()
+    with open(path, "rb") as f:
+        while True:
+            chunk = f.read(chunk_size)
+            if not chunk:
+                break
+            h.update(chunk)
+    return h.hexdigest()
+
+
+def code_version(*objs):
+    """Hash of the source of functions / modules / files the artifact is built with."""
+    h = hashlib.sha256()
+    for obj in objs:
+        if isinstance(obj, str):
+            with open(obj, "rb") as f:
+                h.update(f.read())
+        else:
+            h.update(inspect.getsource(obj).encode())
+    return h.hexdigest()
+
+
+def local_imports(path):
+    """
+    path and the files of the modules next to it that it imports,
+    transitively. It does not depend on what else the running process
+    happened to import.
+    """
+    directory = os.path.dirname(os.path.abspath(path))
+    files = set()
+    stack = [os.path.abspath(path)]
+    while stack:
+        file = stack.pop()
+        if file in files:
+            continue
+        files.add(file)
+        with open(file, "r") as f:
+            tree = ast.parse(f.read())
+        for node in ast.walk(tree):
+            if isinstance(node, ast.Import):
+                names = [alias.name for alias in node.names]
+            elif isinstance(node, ast.ImportFrom) and node.module and node.level == 0:
+                names = [node.module]
+            else:
+                continue
+            for name in names:
+                candidate = os.path.join(directory, name.split(".")[0] + ".py")
+                if os.path.exists(candidate):
+                    stack.append(candidate)
+    return sorted(files)
+
+
+def params_hash(params):
+    return hashlib.sha256(json.dumps(params, sort_keys=True, default=str).encode()).hexdigest()
+
+
+class BuildCache:
+    def __init__(self, path=CACHE_PATH):
+        self.path = path
+        self.artifacts = {}
+        self.files = {}
+        if os.path.exists(path):
+            with open(path, "r") as f:
+                data = json.load(f)
+            self.artifacts = data.get("artifacts", {})
+            self.files = data.get("files", {})
+
+    def file_hash(self, path):
+        # Files are only re-hashed when their size or mtime changed
+        stat = os.stat(path)
+        key = os.path.abspath(path)
+        cached = self.files.get(key)
+        if cached is not None and cached["size"] == stat.st_size and cached["mtime_ns"] == stat.st_mtime_ns:
+            return cached["sha256"]
+        # raw and enriched files usually were hashed by their writer already
+        indexed = fresh_entry(path)
+        digest = indexed["sha256"] if indexed is not None else sha256_file(path)
+        self.files[key] = {"size": stat.st_size, "mtime_ns": stat.st_mtime_ns, "sha256": digest}
+        return digest
+
+    def fingerprint(self, inputs=(), code=(), params=None):
+        missing = [p for p in inputs if not os.path.exists(p)]
+        if missing:
+            raise FileNotFoundError(f"Missing inputs: {missing}")
+        return params_hash({
+            "inputs": {os.path.abspath(p): self.file_hash(p) for p in sorted(inputs)},
+            "code": code_version(*code) if code else None,
+            "params": params,
+        })
+
+    def is_stale(self, outputs, fingerprint):
+        for output in outputs:
+            if not os.path.exists(output):
+                return True
+            if self.artifacts.get(os.path.abspath(output), {}).get("fingerprint") != fingerprint:
+                return True
+        return False
+
+    def record(self, outputs, fingerprint, inputs=(), params=None):
+        for output in outputs:
+            self.artifacts[os.path.abspath(output)] = {
+                "fingerprint": fingerprint,
+                "inputs": [os.path.abspath(p) for p in inputs],
+                "params": params,
+                "built_at": int(time.time()),
+            }
+            # hash the fresh output now, downstream tasks need it anyway
+            self.file_hash(output)
+
+    def save(self):
+        os.makedirs(os.path.dirname(os.path.abspath(self.path)), exist_ok=True)
+        tmp_path = self.path + ".tmp"
+        with open(tmp_path, "w") as f:
+            json.dump({"artifacts": self.artifacts, "files": self.files}, f, indent=4, default=str)
+        os.replace(tmp_path, self.path)
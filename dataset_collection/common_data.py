@@ -89,23 +89,24 @@ query {
 
 import pandas as pd
 import os
-markets_list = []
-raw_path = "/Users/yegortrussov/Documents/ml/lending_protocols/dataset_collection/data/markets_raw"
-with open("/Users/yegortrussov/Documents/ml/lending_protocols/dataset_collection/data/common/markets_meta.json", 'r') as f:
-    markets_meta = json.load(f)
-for file in os.listdir(raw_path):
-    md = pd.read_csv(raw_path + "/" + file)["market_address"].unique()[0]
-    print(file.split("/")[-1], md in markets_meta.keys(), md)
-    if md not in markets_meta.keys():
-      markets_list.append(
-          md
-      )
-
-print("MARKETS_TO_PARSE", markets_list)
-
-if len(markets_list) == 0:
-    print("all markets exists")
-    exit(0)
+from manifest import files as manifest_files
+from config import DATA_PATH, COMMON_PATH
+raw_path = f"{DATA_PATH}/markets_raw"
+markets_meta_path = f"{COMMON_PATH}/markets_meta.json"
+
+
+def missing_markets(markets_meta):
+    """Market addresses of the raw files that are not in markets_meta yet."""
+    markets_list = []
+    for file, entry in manifest_files(raw_path).items():
+        md = entry["market_address"]
+        print(file.split("/")[-1], md in markets_meta.keys(), md)
+        if md not in markets_meta.keys():
+          markets_list.append(
+              md
+          )
+    return markets_list
+
 
 MARKETS_QUERY = """
 query {
@@ -150,22 +151,59 @@ query {
     }
   }
 }
-""".replace("$market_ids$", str(markets_list)).replace("'", '"')
+"""
 
-import json
 
-def get_data_as_json(query, dest):
+def markets_query(market_ids):
+    return MARKETS_QUERY.replace("$market_ids$", str(list(market_ids))).replace("'", '"')
+
 
+def parse_market(item):
+    current_market = {}
+    current_market["address"] = (item["uniqueKey"])
+    current_market["lltv"] = (item["lltv"])
+    current_market["oracle_address"] = (item["oracle"]["address"])
+    current_market["creation_datetime"] = (item["creationTimestamp"])
+    current_market["network"] = ("eth" if item["loanAsset"]["chain"]["id"] == 1 else "base")
+
+    current_market["loan_asset_address"] = (item["loanAsset"]["address"])
+    current_market["loan_asset_symbol"] = (item["loanAsset"]["symbol"])
+    current_market["loan_asset_decimals"] = (item["loanAsset"]["decimals"])
     
-    skip=0
-    with open("/Users/yegortrussov/Documents/ml/lending_protocols/dataset_collection/data/common/markets_meta.json", 'r') as f:
-      markets_meta = json.load(f)
-    all_markets_data = markets_meta
+    current_market["collateral_asset_address"] = (item["collateralAsset"]["address"])
+    current_market["collateral_asset_symbol"] = (item["collateralAsset"]["symbol"])
+    current_market["collateral_asset_decimals"] = (item["collateralAsset"]["decimals"])
+
+    current_market["rate_at_target"] = {
+      x["x"]: x["y"] for x in item["historicalState"]["rateAtTarget"]
+    }
+
     
+    irm_curve_data = []
+    for i in item["currentIrmCurve"]:
+        irm_curve_data.append([
+            i["utilization"],
+            i["borrowApy"],
+            i["supplyApy"],
+        ])
+    current_market["irm_curve"] = irm_curve_data
+    return current_market
+
+
+def fetch_markets_meta(market_ids, markets_meta=None):
+    """
+    {address: market meta} of market_ids, markets already in markets_meta
+    are taken from it. Markets without collateral or oracle are left out.
+    """
+    markets_meta = {} if markets_meta is None else markets_meta
+    all_markets_data = {m: markets_meta[m] for m in market_ids if m in markets_meta}
+    to_fetch = [m for m in market_ids if m not in markets_meta]
+    if len(to_fetch) == 0:
+        return all_markets_data
+    query = markets_query(to_fetch)
 
+    skip=0
     while 1:
-        print(query.replace("$skip$", str(skip)))
-
         res = query_aave_graphql(query.replace("$skip$", str(skip)))["data"]["markets"]["items"]
         if len(res) == 0:
             break
@@ -175,46 +213,32 @@ def get_data_as_json(query, dest):
         for item in res:
             if item["collateralAsset"] is None or item["oracle"] is None:
                 continue
-            current_market = {}
-            if item["uniqueKey"] in markets_meta.keys():
-                all_markets_data[item["uniqueKey"]] = markets_meta[item["uniqueKey"]]
-                print(f"Market {item['uniqueKey']} from cache")
-                continue
-            current_market["address"] = (item["uniqueKey"])
-            current_market["lltv"] = (item["lltv"])
-            current_market["oracle_address"] = (item["oracle"]["address"])
-            current_market["creation_datetime"] = (item["creationTimestamp"])
-            current_market["network"] = ("eth" if item["loanAsset"]["chain"]["id"] == 1 else "base")
-
-            current_market["loan_asset_address"] = (item["loanAsset"]["address"])
-            current_market["loan_asset_symbol"] = (item["loanAsset"]["symbol"])
-            current_market["loan_asset_decimals"] = (item["loanAsset"]["decimals"])
-            
-            current_market["collateral_asset_address"] = (item["collateralAsset"]["address"])
-            current_market["collateral_asset_symbol"] = (item["collateralAsset"]["symbol"])
-            current_market["collateral_asset_decimals"] = (item["collateralAsset"]["decimals"])
-
-            current_market["rate_at_target"] = {
-              x["x"]: x["y"] for x in item["historicalState"]["rateAtTarget"]
-            }
+            all_markets_data[item["uniqueKey"]] = parse_market(item)
+    return all_markets_data
 
-            
-            irm_curve_data = []
-            for i in item["currentIrmCurve"]:
-                irm_curve_data.append([
-                    i["utilization"],
-                    i["borrowApy"],
-                    i["supplyApy"],
-                ])
-            current_market["irm_curve"] = irm_curve_data
 
-            all_markets_data[current_market["address"]] = current_market
+def get_data_as_json(market_ids, dest):
+    with open(markets_meta_path, 'r') as f:
+      markets_meta = json.load(f)
+    all_markets_data = markets_meta
+    all_markets_data.update(fetch_markets_meta(market_ids, markets_meta))
 
     with open(dest, 'w') as f:
         json.dump(all_markets_data, f, indent=4)
 
 
-get_data_as_json(MARKETS_QUERY, dest="./data/common/markets_meta.json")
+if __name__ == "__main__":
+    with open(markets_meta_path, 'r') as f:
+        markets_meta = json.load(f)
+    markets_list = missing_markets(markets_meta)
+
+    print("MARKETS_TO_PARSE", markets_list)
+
+    if len(markets_list) == 0:
+        print("all markets exists")
+        exit(0)
+
+    get_data_as_json(markets_list, dest="./data/common/markets_meta.json")
 
 # get_data_as_json(MARKETS_QUERY, dest="./data/common/markets_meta.json")
 
@@ -1,152 +1,79 @@
+import os
+import sys
+import traceback
+import hashlib
+from contextlib import nullcontext
 import pandas as pd
-import json
 from tqdm import tqdm
 import numpy as np
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
+from amounts import add_amount_units, RAW_DTYPES
+from accrual import compute_market_totals
+from share_accounting import compute_share_totals
+from irm import rate_at_target_history, rates_at
+from asof import attach_asof
+from rolling import rolling_time_stats
+from price_features import price_features
+from user_positions import partitioned_position_states, final_states
+from event_classification import classify_events, event_type_names
+from market_rollups import create_market_rollups, append_market_rollups, ROLLUP_RESOLUTIONS
+from build_cache import BuildCache, code_version, local_imports, params_hash
+from profiling import StageProfiler
+import manifest
+from metadata import MetadataStore
+from config import DATA_PATH, COMMON_PATH
+from incremental import (
+    load_state, save_state, read_csv_from, write_rows, context_start, raw_prefix_hash, sha256_update,
+    chunk_ends,
+)
 
 pd.set_option('display.max_columns', 500)
 
-# df = pd.read_csv("/Users/yegortrussov/Documents/ml/lending_protocols/dataset_collection/data/markets_raw/eth_cbbtc_usdt.csv")
-df = pd.read_csv("/Users/yegortrussov/Documents/ml/lending_protocols/dataset_collection/data/markets_raw/eth_wsteth_usdc.csv")
-# df = pd.read_csv("/Users/yegortrussov/Documents/ml/lending_protocols/dataset_collection/data/markets_raw/base_cbbtc_usdc_full.csv")
-# df = df[df["datetime"] < "2026-01-01"]
-with open("/Users/yegortrussov/Documents/ml/lending_protocols/dataset_collection/data/common/markets_meta.json", 'r') as f:
-    markets_meta = json.load(f)
-with open("/Users/yegortrussov/Documents/ml/lending_protocols/dataset_collection/data/common/assets_meta.json", 'r') as f:
-    assets_meta = json.load(f)
-with open("/Users/yegortrussov/Documents/ml/lending_protocols/dataset_collection/data/common/vaults_meta.json", 'r') as f:
-    vaults_meta = json.load(f)
-market_addr = df["market_address"].unique()[0]
-market_meta = markets_meta[market_addr]
-asset_meta = assets_meta[market_meta["collateral_asset_address"]]
-loan_asset_meta = assets_meta[market_meta["loan_asset_address"]]
-loan_asset_meta["decimals"] = 6
-all_vaults_addresses = vaults_meta.keys()
-asset_price_df = pd.DataFrame(asset_meta["historical_price"], columns=["timestamp", "price"]).dropna()
+SEQUENCE_TIME_THRESHOLD = 60*10
+# consecutive event pairs of a user relabelled by label_transaction_sequences
+SEQUENCE_RULES = [
+    {"first": "collateral_add", "second": "borrow_more", "label": "borrow_more_w_collateral", "min_inx": 2},
+    {"first": "repay_full", "second": "position_close", "label": "position_close"},
+    {"first": "collateral_add", "second": "borrow_more", "label": "position_open", "max_inx": 1},
+]
+PRICE_LOOKBACK_HOURS = [6, 24]
+# enriched rows re-read when new events are appended: sequence pairs and the longest rollup bucket
+CONTEXT_WINDOW = max(SEQUENCE_TIME_THRESHOLD, max(ROLLUP_RESOLUTIONS.values()))
 
 
-import numpy as np
-
-def compute_market_rates(market_params, fee=0.0):
-    rate_dict = market_params.get('rate_at_target', {})
-    if not rate_dict:
-        return {}
-
-    SECONDS_PER_YEAR = 365 * 86400
-    TARGET = 0.9
-    KD = 4.0
-
-    utils = np.arange(0, 1.01, 0.01)
-    util_percent = utils * 100
-
-    result = {}
-    for ts, rate_wad in rate_dict.items():
-        if rate_wad is None:
-            continue
-        rate_per_sec = rate_wad / 1e18
-
-        # Compute error e and curve for all utilizations
-        e = np.where(
-            utils <= TARGET,
-            (utils - TARGET) / TARGET,
-            (utils - TARGET) / (1 - TARGET)
-        )
-        curve = np.where(
-            utils <= TARGET,
-            (1 - 1/KD) * e + 1,
-            (KD - 1) * e + 1
-        )
-
-        # Borrow rate per second
-        borrow_rate_ps = rate_per_sec * curve
-
-        # Supply rate per second
-        supply_rate_ps = borrow_rate_ps * utils * (1 - fee)
-
-        # Convert to APR percent
-        borrow_apr = borrow_rate_ps * SECONDS_PER_YEAR
-        supply_apr = supply_rate_ps * SECONDS_PER_YEAR
+def load_metadata():
+    """Markets, assets and vaults metadata as lazy per key mappings (metadata.py)."""
+    store = MetadataStore(COMMON_PATH)
+    return store.markets, store.assets, store.vaults
 
-        # Build list of [util%, borrow%, supply%]
-        result[int(ts)] = [
-            [util_percent[i], borrow_apr[i], supply_apr[i]]
-            for i in range(len(utils))
-        ]
-
-    return result
-market_irm_rates = compute_market_rates(market_meta)
 
 
 def add_interest_rates(df, irm_history):
     """
-    Add borrow and supply rates using historical IRM curves.
-    For each row, uses the closest IRM curve with timestamp <= row['timestamp'].
+    Add borrow and supply rates using the AdaptiveCurveIRM evaluated in closed form.
+    For each row, uses the closest rate_at_target with timestamp <= row['timestamp'].
     """
-    # Preprocess history
-    hist_items = []
-    for ts, curve_list in irm_history.items():
-        curve_arr = np.array(curve_list)
-        u_arr = curve_arr[:, 0] / 100.0  # convert percent to decimal utilization
-        b_arr = curve_arr[:, 1]           # borrow rate in percent (not divided by 100 yet)
-        s_arr = curve_arr[:, 2]           # supply rate in percent
-        hist_items.append((ts, (u_arr, b_arr, s_arr)))
-    hist_items.sort(key=lambda x: x[0])
-    hist_timestamps = np.array([item[0] for item in hist_items])
-    hist_curves = [item[1] for item in hist_items]
-
     df = df.copy()
 
-    # Initialize columns
-    df['borrow_rate_before'] = 0.0
-    df['supply_rate_before'] = 0.0
-    df['borrow_rate_after'] = 0.0
-    df['supply_rate_after'] = 0.0
-
-    for idx, row in df.iterrows():
-        ts = row['timestamp']
-        # Find closest historical timestamp <= ts
-        pos = np.searchsorted(hist_timestamps, ts, side='right') - 1
-        if pos < 0:
-            pos = 0  # fallback to earliest
-        u_arr, b_arr, s_arr = hist_curves[pos]
-
-        # Interpolate for before utilization
-        util_before = max(0, min(row['utilization_before'], 1))
-        df.at[idx, 'borrow_rate_before'] = np.interp(util_before, u_arr, b_arr)
-        df.at[idx, 'supply_rate_before'] = np.interp(util_before, u_arr, s_arr)
-
-        # Determine utilization after (may be 'new_utilization' if present)
-        if 'new_utilization' in df.columns and pd.notna(row['new_utilization']):
-            util_after = max(0, min(row['new_utilization'], 1))
-        else:
-            util_after = max(0, min(row['utilization_after'], 1))
+    # Determine utilization after (may be 'new_utilization' if present)
+    util_after = df['utilization_after'].values.astype(float)
+    if 'new_utilization' in df.columns:
+        override = df['new_utilization'].notna().values
+        util_after = np.where(override, df['new_utilization'].values.astype(float), util_after)
 
-        df.at[idx, 'borrow_rate_after'] = np.interp(util_after, u_arr, b_arr)
-        df.at[idx, 'supply_rate_after'] = np.interp(util_after, u_arr, s_arr)
+    df['borrow_rate_before'], df['supply_rate_before'] = rates_at(
+        df['timestamp'].values, df['utilization_before'].values, irm_history
+    )
+    df['borrow_rate_after'], df['supply_rate_after'] = rates_at(
+        df['timestamp'].values, util_after, irm_history
+    )
 
     return df
 
 def add_collateral_prices(df, price_data, col="collateral_price"):
-    timestamps, prices = np.array(price_data).T
-    
-    df = df.copy()
-    
-    def find_closest_price(tx_timestamp):
-        idx = np.searchsorted(timestamps, tx_timestamp)
-        
-        if idx == 0:
-            return prices[0]
-        elif idx == len(timestamps):
-            return prices[-1]
-        else:
-            left_diff = tx_timestamp - timestamps[idx-1]
-            right_diff = timestamps[idx] - tx_timestamp
-            
-            if left_diff <= right_diff:
-                return prices[idx-1]
-            else:
-                return prices[idx]
-    
-    df[col] = df['timestamp'].apply(find_closest_price)
+    # nearest hourly price, ties go to the earlier one
+    df = attach_asof(df, {col: price_data}, on="timestamp", direction="nearest")
     
     if 'assets' in df.columns and col == "collateral_price":
         df['collateral_value'] = df['assets'] * df['collateral_price']
@@ -157,600 +84,603 @@ def add_rolling_mean_metric(df, metric, hours=6):
     df = df.sort_values('timestamp').copy()
     df_sorted = df.reset_index(drop=True)
     
-    result = []
-    for i in range(len(df_sorted)):
-        current_time = df_sorted.at[i, 'timestamp']
-        cutoff = current_time - (hours * 3600)
-        mask = (df_sorted['timestamp'] >= cutoff) & (df_sorted['timestamp'] < current_time)
-        rolling_mean = df_sorted.loc[mask, metric].mean()
-        result.append(rolling_mean)
-    
-    df_sorted[f'{metric}_rolling'] = result
+    # mean over [t - hours, t)
+    window = hours * 3600
+    stats = rolling_time_stats(df_sorted['timestamp'].values, df_sorted[metric].values, [window], stats=["mean"])
+    df_sorted[f'{metric}_rolling'] = stats[("mean", window)]
     return df_sorted
 
-def calculate_metrics(df, irm_history, asset_data, loan_asset_data, use_collateral=False, use_usd_assets=False):
+def calculate_metrics(df, irm_history, asset_data, loan_asset_data, use_collateral=False, use_usd_assets=False, initial=None, accounting="accrual", return_state=False):
+    """
+    accounting="accrual" compounds the IRM rates between events, initial is
+    (total_supply, total_borrow, last_timestamp). accounting="shares" tracks
+    total shares and the events' share prices (share_accounting.py), initial
+    is the share state and needs the shares_units column. With return_state
+    the share state after the last event is returned too (None for accrual).
+    """
     df = df.fillna(0).sort_values(['timestamp', 'hash'])
     df = df.reset_index(drop=True)
-    
-    metrics_rows = []
-    last_timestamp = df.iloc[0]['timestamp'] if len(df) > 0 else 0
-    borrow_rate = 0.0
-    supply_rate = 0.0
-    total_supply = 0.0
-    total_borrow = 0.0
-    
-    i = 0
-    n = len(df)
-    
-    # Prepare historical IRM data for fast lookup
-    hist_items = []
-    for ts, curve_list in irm_history.items():
-        curve_arr = np.array(curve_list)
-        u_arr = curve_arr[:, 0] / 100.0  # convert percent to decimal
-        b_arr = curve_arr[:, 1]           # borrow percent
-        s_arr = curve_arr[:, 2]           # supply percent
-        hist_items.append((ts, (u_arr, b_arr, s_arr)))
-    hist_items.sort(key=lambda x: x[0])
-    hist_timestamps = np.array([item[0] for item in hist_items])
-    hist_curves = [item[1] for item in hist_items]
-
-    
-    def get_rates_at_time(ts, util):
-        # Find closest historical timestamp <= ts
-        idx = np.searchsorted(hist_timestamps, ts, side='right') - 1
-        if idx < 0:
-            idx = 0  # fallback to earliest available
-        
-        u_arr, b_arr, s_arr = hist_curves[idx]
-        
-        # Ensure util is within bounds (0-1)
-        util_clipped = np.clip(util, 0, 1)
-        
-        # Interpolate borrow and supply percentages
-        borrow_pct = np.interp(util_clipped, u_arr, b_arr)
-        supply_pct = np.interp(util_clipped, u_arr, s_arr)
-        
-        return borrow_pct, supply_pct
 
-    
-    while i < n:
-        current_hash = df.iloc[i]['hash']
-        tx_start_idx = i
-        
-        before_supply = total_supply
-        before_borrow = total_borrow
-        
-        while i < n and df.iloc[i]['hash'] == current_hash:
-            row = df.iloc[i]
-            current_timestamp = row['timestamp']
-            time_diff = (current_timestamp - last_timestamp) / (365 * 24 * 3600)  # in years
-
-            current_util = total_borrow / total_supply if total_supply > 0 else 0
-            borrow_rate, supply_rate = get_rates_at_time(current_timestamp, current_util)
-
-            total_borrow += total_borrow * (borrow_rate * time_diff)   # Borrowers owe more
-            total_supply += total_supply * (supply_rate * time_diff)   # Lenders earn more
-
-            
-            last_timestamp = current_timestamp
-            
-            amount = abs(0 if row['assets'] is None else float(row['assets']) / (10**loan_asset_data["decimals"]))
-            if use_usd_assets:
-                amount = float(row['assets']) / (10**loan_asset_data["decimals"]) if row['assets_usd'] is None else float(row["assets_usd"])
-            
-            if row['type'] in ['MarketSupply']:
-                total_supply += amount
-            elif row['type'] in ['MarketWithdraw']:
-                total_supply -= amount
-            if row['type'] == 'MarketBorrow':
-                total_borrow += amount
-            elif row['type'] == 'MarketRepay':
-                total_borrow -= amount
-            elif row['type'] == 'MarketLiquidation':
-                total_borrow -= amount
-                # total_supply += amount
-            
-            i += 1
-        
-        after_supply = total_supply
-        after_borrow = total_borrow
-        
-        before_util = before_borrow / before_supply if before_supply > 0 else 0
-        after_util = after_borrow / after_supply if after_supply > 0 else 0
-        
-        metrics_rows.append({
-            'hash': current_hash,
-            'timestamp': df.iloc[tx_start_idx]['timestamp'],
-            'datetime': df.iloc[tx_start_idx]['datetime'],
-            'total_supply_before': before_supply,
-            'total_borrow_before': before_borrow,
-            'total_supply_after': after_supply,
-            'total_borrow_after': after_borrow,
-            'utilization_before': before_util,
-            'utilization_after': after_util,
-            'tx_actions': i - tx_start_idx
-        })
-    
-    # The rest of the function remains unchanged
-    res = add_interest_rates(pd.DataFrame(metrics_rows), irm_history) 
+    if use_usd_assets:
+        amounts = df['assets_usd'].astype(float).values
+    else:
+        amounts = df['assets_units'].astype(float).abs().values
+
+    share_state = None
+    if accounting == "shares":
+        if 'shares_units' not in df.columns:
+            raise ValueError("Share accounting needs raw events with shares, collect the market again")
+        starts, before_supply, before_borrow, after_supply, after_borrow, share_state = compute_share_totals(
+            df['hash'].values,
+            df['type'].values,
+            amounts,
+            df['shares_units'].astype(float).values,
+            initial,
+        )
+    elif accounting == "accrual":
+        # Interest accrual runs over plain arrays, one row per transaction comes back
+        starts, before_supply, before_borrow, after_supply, after_borrow = compute_market_totals(
+            df['timestamp'].values,
+            df['hash'].values,
+            df['type'].values,
+            amounts,
+            irm_history,
+            initial,
+        )
+    else:
+        raise ValueError(f"Unknown accounting {accounting!r}")
+
+    before_util = np.divide(before_borrow, before_supply, out=np.zeros(len(starts)), where=before_supply > 0)
+    after_util = np.divide(after_borrow, after_supply, out=np.zeros(len(starts)), where=after_supply > 0)
+
+    metrics = pd.DataFrame({
+        'hash': df['hash'].values[starts],
+        'timestamp': df['timestamp'].values[starts],
+        'datetime': df['datetime'].values[starts],
+        'total_supply_before': before_supply,
+        'total_borrow_before': before_borrow,
+        'total_supply_after': after_supply,
+        'total_borrow_after': after_borrow,
+        'utilization_before': before_util,
+        'utilization_after': after_util,
+        'tx_actions': np.diff(np.append(starts, len(df))),
+    })
+    
+    res = add_interest_rates(metrics, irm_history) 
     
     print("Added interest rates")
-    res = add_collateral_prices(res, asset_data["historical_price"])
-    print("Added coll price")
-    res = add_collateral_prices(res, loan_asset_data["historical_price"], col="loan_asset_price")
-    print("Added loan asset price")
-    
+    res = attach_asof(res, {
+        "collateral_price": asset_data["historical_price"],
+        "loan_asset_price": loan_asset_data["historical_price"],
+    }, on="timestamp", direction="nearest")
+    print("Added collateral and loan asset prices")
+    
+    if return_state:
+        return res, share_state
     return res
 
-from tqdm import tqdm
-
-def classify_event(start_coll, start_debt, end_coll, end_debt, types_in_tx):
-    # Epsilon for zero detection (use same as in your code)
-    epsilon = 1e-6
-    
-    # Extract event types in this transaction
-    tx_types = list(set(types_in_tx))
-    
-    # Liquidation events
-    if 'MarketLiquidation' in tx_types:
-        return 'liquidation'
-    
-    # Calculate changes
-    delta_coll = end_coll - start_coll
-    delta_debt = end_debt - start_debt
-    
-    # Check for opening position (from near-zero to positive)
-    if start_coll < epsilon and start_debt < epsilon and end_coll > epsilon and end_debt > epsilon:
-        return 'position_open'
-    
-    # Check for closing position (to near-zero)
-    if end_coll < epsilon and end_debt < epsilon and (start_coll > epsilon or start_debt > epsilon):
-        return 'position_close'
-    
-    # Full repay (debt goes to zero, collateral may or may not change)
-    if end_debt < epsilon and abs(start_debt) > epsilon:
-        return 'repay_full'
-    
-    # Partial repay (debt decreases but not to zero)
-    if delta_debt < -epsilon and end_debt > epsilon:
-        return 'repay_partial'
-    
-    # Add collateral only
-    if delta_coll > epsilon and abs(delta_debt) < epsilon:
-        return 'collateral_add'
-    
-    # Borrow more only
-    if delta_debt > epsilon and abs(delta_coll) < epsilon:
-        return 'borrow_more'
-    
-    # Withdraw collateral only
-    if delta_coll < -epsilon and abs(delta_debt) < epsilon:
-        return 'collateral_withdraw'
-    
-    if delta_coll > epsilon and delta_debt > epsilon:
-        return 'borrow_more_w_collateral'
-    
-    # Both collateral and debt change significantly
-    if abs(delta_coll) > epsilon and abs(delta_debt) > epsilon:
-        return 'position_adjust'
-    
-    if start_coll < epsilon and start_debt < epsilon and end_coll < epsilon and end_debt < epsilon and 'MarketSupply' in tx_types:
-        return 'loan_position_supply'
-    if start_coll < epsilon and start_debt < epsilon and end_coll < epsilon and end_debt < epsilon and 'MarketWithdraw' in tx_types:
-        return 'loan_position_withdraw'
-    
-    
-    return 'other'
-
 
-def add_user_ltv(df, market_data):
+def add_user_ltv(df, market_data, vault_addresses=(), n_jobs=1, initial_states=None, return_states=False):
     df = df.sort_values(['user_address', 'timestamp', 'hash'])
+    df = df[df['user_address'].notna()].reset_index(drop=True)
+    
+    # already scaled to token units by add_amount_units
+    (
+        starts, new_user,
+        coll_before, debt_before, supply_before,
+        coll_after, debt_after, supply_after, type_mask,
+    ) = partitioned_position_states(
+        df['user_address'].values, df['hash'].values, df['type'].values,
+        np.abs(df['assets_units'].values.astype(float)), n_jobs=n_jobs, initial_states=initial_states,
+    )
+    event_types = event_type_names(classify_events(coll_before, debt_before, coll_after, debt_after, type_mask))
+    
+    # prices of the first row of the transaction
+    if 'collateral_price' in df.columns:
+        price = df['collateral_price'].values[starts].astype(float)
+    else:
+        price = np.ones(len(starts))
+    loan_asset_price = df['loan_asset_price'].values[starts]
+    if loan_asset_price.dtype == object:
+        loan_asset_price = np.array([1 if v is None else v for v in loan_asset_price], dtype=float)
+    loan_asset_price = loan_asset_price.astype(float)
+    lltv = float(market_data["lltv"]) / 10**18
+    
+    with np.errstate(divide='ignore', invalid='ignore'):
+        coll_value_before = coll_before * price
+        coll_value_after = coll_after * price
+        debt_value_before = debt_before * loan_asset_price
+        debt_value_after = debt_after * loan_asset_price
+        # every value depends only on its own row, so the output does not
+        # depend on where a run or a chunk ended
+        ltv_before = np.where(coll_value_before > 0, debt_value_before / coll_value_before, 0)
+        ltv_after = np.where(coll_value_after > 0, debt_value_after / coll_value_after, 0)
+        health_factor_before = np.where(debt_value_before == 0, 0, coll_value_before * lltv / debt_value_before)
+        health_factor_after = np.where(debt_value_after == 0, 0, coll_value_after * lltv / debt_value_after)
+    
+    # transaction values -> rows
+    tx_index = np.repeat(np.arange(len(starts)), np.diff(np.append(starts, len(df))))
+    result_df = df.copy()
+    result_df['collateral_before'] = coll_before[tx_index]
+    result_df['collateral_value_before'] = coll_value_before[tx_index]
+    result_df['debt_before'] = debt_value_before[tx_index]
+    result_df['supply_before'] = (supply_before * loan_asset_price)[tx_index]
+    result_df['ltv_before'] = ltv_before[tx_index]
+    result_df['collateral_after'] = coll_after[tx_index]
+    result_df['collateral_value_after'] = coll_value_after[tx_index]
+    result_df['debt_after'] = debt_value_after[tx_index]
+    result_df['supply_after'] = (supply_after * loan_asset_price)[tx_index]
+    result_df['ltv_after'] = ltv_after[tx_index]
+    result_df['health_factor_before'] = health_factor_before[tx_index]
+    result_df['health_factor_after'] = health_factor_after[tx_index]
+    result_df['event_type'] = event_types[tx_index]
     
-    result_rows = []
-    
-    for address in tqdm(df['user_address'].unique()):
-        user_df = df[df['user_address'] == address].copy()
-        
-        collateral = 0.0
-        debt = 0.0
-        supply = 0.0
-        
-        current_hash = None
-        hash_data = []
-        
-        for idx, row in user_df.iterrows():
-            if row['hash'] != current_hash:
-                if current_hash is not None and hash_data:
-                    first_row = hash_data[0]
-                    last_row = hash_data[-1]
-                    types_in_tx = [row_dict['type'] for row_dict in hash_data]
-                    event_type = classify_event(
-                        start_collateral, start_debt, collateral, debt, types_in_tx
-                    )
-                    
-                    price = first_row['collateral_price'] if 'collateral_price' in df.columns else 1.0
-                    loan_asset_price = first_row['loan_asset_price']
-                    if loan_asset_price is None:
-                        loan_asset_price = 1
-                    
-                    before_ltv = start_debt / (start_collateral * price) if start_collateral * price > 0 else 0
-                    after_ltv = debt / (collateral * price) if collateral * price > 0 else 0
-                    
-                    if (start_debt * loan_asset_price) == 0:
-                        health_factor_before = 0
-                    else:
-                        health_factor_before = (start_collateral * price / loan_asset_price) * (float(market_data["lltv"]) / 10**18) / (start_debt * loan_asset_price)
-                    
-                    if (debt * loan_asset_price) == 0:
-                        health_factor_after = 0
-                    else:
-                        health_factor_after = (collateral * price / loan_asset_price) * (float(market_data["lltv"]) / 10**18) / (debt * loan_asset_price)
-
-                    for h_row in hash_data:
-                        h_row['collateral_before'] = start_collateral
-                        h_row['collateral_value_before'] = start_collateral * price
-                        h_row['debt_before'] = start_debt  * loan_asset_price
-                        h_row['supply_before'] = start_supply  * loan_asset_price
-                        h_row['ltv_before'] = before_ltv
-                        h_row['collateral_after'] = collateral
-                        h_row['collateral_value_after'] = collateral * price
-                        h_row['debt_after'] = debt * loan_asset_price
-                        h_row['supply_after'] = supply  * loan_asset_price
-                        h_row['ltv_after'] = after_ltv
-                        h_row['health_factor_before'] = health_factor_before
-                        h_row['health_factor_after'] = health_factor_after
-                        h_row['event_type'] = event_type
-                        
-                        result_rows.append(h_row)
-                
-                current_hash = row['hash']
-                hash_data = []
-                start_collateral = collateral
-                start_debt = debt
-                start_supply = supply
-            
-            row_dict = row.to_dict()
-            
-            amount = abs(float(row['assets']))
-            
-            if row['type'] in ['MarketSupplyCollateral']:
-                collateral += amount / (10**asset_meta["decimals"])
-            elif row['type'] in ['MarketWithdrawCollateral']:
-                collateral -= amount / (10**asset_meta["decimals"])
-            elif row['type'] == 'MarketBorrow':
-                debt += amount / (10**loan_asset_meta["decimals"])
-            elif row['type'] == 'MarketRepay':
-                debt -= amount / (10**loan_asset_meta["decimals"])
-            elif row['type'] == 'MarketSupply':
-                supply += amount / (10**loan_asset_meta["decimals"])
-            elif row['type'] == 'MarketWithdraw':
-                supply -= amount / (10**loan_asset_meta["decimals"])
-
-            if abs(debt) < 1e-6:
-                debt = 0 
-            if abs(collateral) < 1e-11:
-                collateral = 0 
-            
-            
-            hash_data.append(row_dict)
-        
-        if current_hash is not None and hash_data:
-            first_row = hash_data[0]
-            last_row = hash_data[-1]
-
-            types_in_tx = [row_dict['type'] for row_dict in hash_data]
-            event_type = classify_event(
-                start_collateral, start_debt, collateral, debt, types_in_tx
-            )
-            
-            price = first_row['collateral_price']
-            loan_asset_price = first_row['loan_asset_price']
-            if loan_asset_price is None:
-                loan_asset_price = 1
-            
-            before_ltv = (start_debt * loan_asset_price) / (start_collateral * price) if start_collateral * price > 0 else 0
-            after_ltv = (debt * loan_asset_price) / (collateral * price) if collateral * price > 0 else 0
-            
-            if (start_debt) == 0:
-                health_factor_before = 0
-            else:
-                health_factor_before = (start_collateral * price) * (float(market_data["lltv"]) / 10**18) / (start_debt)
-            
-            if (debt) == 0:
-                health_factor_after = 0
-            else:
-                health_factor_after = (collateral * price) * (float(market_data["lltv"]) / 10**18) / (debt)
-
-            for h_row in hash_data:
-                h_row['collateral_before'] = start_collateral
-                h_row['collateral_value_before'] = start_collateral * price
-                h_row['debt_before'] = start_debt * loan_asset_price
-                h_row['supply_before'] = start_supply  * loan_asset_price
-                h_row['ltv_before'] = before_ltv
-                h_row['collateral_after'] = collateral
-                h_row['collateral_value_after'] = collateral * price
-                h_row['debt_after'] = debt * loan_asset_price
-                h_row['supply_after'] = supply  * loan_asset_price
-                h_row['ltv_after'] = after_ltv
-                h_row['health_factor_before'] = health_factor_before
-                h_row['health_factor_after'] = health_factor_after
-                h_row["event_type"] = event_type
-                
-                result_rows.append(h_row)
-    
-    result_df = pd.DataFrame(result_rows)
     result_df["health_factor_before"] = result_df["health_factor_before"].fillna(0)
     result_df["health_factor_after"] = result_df["health_factor_after"].fillna(0)
     result_df["health_factor_before"] = result_df["health_factor_before"].clip(0,1000)
     result_df["health_factor_after"] = result_df["health_factor_after"].clip(0,1000)
     
-    result_df["vault_flg"] = result_df["user_address"].isin(all_vaults_addresses)
+    result_df["vault_flg"] = result_df["user_address"].isin(list(vault_addresses))
 
+    if return_states:
+        states = final_states(df['user_address'].values[starts], new_user, coll_after, debt_after, supply_after)
+        return result_df.sort_values(["timestamp", "hash"]), states
     return result_df.sort_values(["timestamp", "hash"])
 
 
 def add_price_features(df, price_df, lookback_hours=[6, 24]):
-    df = df.sort_values('timestamp').copy()
+    df = df.sort_values('timestamp', kind='stable').copy()
     price_df = price_df.sort_values('timestamp').copy()
     
-    results = []
-    price_values = price_df['price'].values
-    price_times = price_df['timestamp'].values
-    
-    for _, row in df.iterrows():
-        action_time = row['timestamp']
-        features = {}
-
-        zero = 0
-        
-        for hours in lookback_hours:
-            lookback_seconds = hours * 3600
-            start_time = action_time - lookback_seconds
-            
-            # Find indices in price data within window
-            mask = (price_times >= start_time) & (price_times < action_time)
-            window_prices = price_values[mask]
-            
-            if len(window_prices) >= 2:
-                # Calculate returns
-                returns = np.diff(window_prices) / window_prices[:-1]
-                
-                features[f'volatility_{hours}h'] = returns.std() if len(returns) > 0 else 0
-                features[f'drawdown_{hours}h'] = (window_prices.min() - window_prices[-1]) / window_prices[-1]
-                features[f'trend_{hours}h'] = (window_prices[-1] - window_prices[0]) / window_prices[0] if window_prices[0] != 0 else 0
-            else:
-                features[f'volatility_{hours}h'] = 0
-                features[f'drawdown_{hours}h'] = 0
-                features[f'trend_{hours}h'] = 0
-        
-        results.append(features)
-    
-    price_features_df = pd.DataFrame(results, index=df.index)
+    features = price_features(
+        df['timestamp'].values, price_df['timestamp'].values, price_df['price'].values, lookback_hours
+    )
+    price_features_df = pd.DataFrame(features, index=df.index)
     return pd.concat([df, price_features_df], axis=1)
 
-import os 
-
-def compute_market_rates(market_params, fee=0.0):
-    rate_dict = market_params.get('rate_at_target', {})
-    if not rate_dict:
-        return {}
-
-    SECONDS_PER_YEAR = 365 * 86400
-    TARGET = 0.9
-    KD = 4.0
-
-    utils = np.arange(0, 1.01, 0.01)
-    util_percent = utils * 100
-
-    result = {}
-    for ts, rate_wad in rate_dict.items():
-        if rate_wad is None:
-            continue
-        rate_per_sec = rate_wad / 1e18
-        e = np.where(
-            utils <= TARGET,
-            (utils - TARGET) / TARGET,
-            (utils - TARGET) / (1 - TARGET)
-        )
-        curve = np.where(
-            utils <= TARGET,
-            (1 - 1/KD) * e + 1,
-            (KD - 1) * e + 1
-        )
-        borrow_rate_ps = rate_per_sec * curve
-        supply_rate_ps = borrow_rate_ps * utils * (1 - fee)
-        borrow_apr = borrow_rate_ps * SECONDS_PER_YEAR
-        supply_apr = supply_rate_ps * SECONDS_PER_YEAR
-        result[int(ts)] = [
-            [util_percent[i], borrow_apr[i], supply_apr[i]]
-            for i in range(len(utils))
-        ]
-
-    return result
-
 
-def label_transaction_sequences(df, time_threshold_seconds=300):
+def label_transaction_sequences(df, time_threshold_seconds=300, rules=None, start_inx=None):
+    """
+    Label pairs of consecutive events of the same user at most
+    time_threshold_seconds apart. For a pair (prev, cur) matching a rule
+    both events get its label; inx is the position of `cur` among the
+    user's events (1 for the second one). Later rules and later pairs win.
+
+    When continuing earlier output, start_inx ({user: number of events
+    before df}) offsets inx, and rows that already have an
+    event_sequence_type keep it unless a pair in df relabels them.
+    """
+    rules = SEQUENCE_RULES if rules is None else rules
     df = df.sort_values(['user_address', 'timestamp']).copy()
-    df['event_sequence_type'] = df['event_type'].copy()
-    inx = 0
-    
-    for i in tqdm(range(1, len(df))):
-        # Check if same user
-        if df.iloc[i]['user_address'] != df.iloc[i-1]['user_address']:
-            inx = 0
-            continue
-        inx += 1
-        addr = df.iloc[i]['user_address']
-            
-        # Check time difference
-        time_diff = df.iloc[i]['timestamp'] - df.iloc[i-1]['timestamp']
-        if time_diff > time_threshold_seconds:
-            continue
-        
-        
-        # Check for collateral + borrow sequence
-        if (df.iloc[i-1]['event_type'] == 'collateral_add' and 
-            df.iloc[i]['event_type'] == 'borrow_more' and inx > 1):
-            df.at[df.index[i-1], 'event_sequence_type'] = 'borrow_more_w_collateral'
-            df.at[df.index[i], 'event_sequence_type'] = 'borrow_more_w_collateral'
-        if (df.iloc[i-1]['event_type'] == 'repay_full' and 
-            df.iloc[i]['event_type'] == 'position_close'):
-            df.at[df.index[i-1], 'event_sequence_type'] = 'position_close'
-            df.at[df.index[i], 'event_sequence_type'] = 'position_close'
-        if (df.iloc[i-1]['event_type'] == 'collateral_add' and 
-            df.iloc[i]['event_type'] == 'borrow_more' and inx == 1):
-            df.at[df.index[i-1], 'event_sequence_type'] = 'position_open'
-            df.at[df.index[i], 'event_sequence_type'] = 'position_open'
-    
+    event_type = df['event_type'].to_numpy(dtype=object)
+    labels = event_type.copy()
+    if 'event_sequence_type' in df.columns:
+        existing = df['event_sequence_type'].to_numpy(dtype=object)
+        labels = np.where(pd.notna(existing), existing, labels)
+    if len(df) < 2:
+        df['event_sequence_type'] = labels
+        return df
+    
+    users = df['user_address'].to_numpy()
+    inx = df.groupby('user_address', sort=False).cumcount().to_numpy()
+    if start_inx:
+        inx = inx + df['user_address'].map(start_inx).fillna(0).to_numpy(dtype=np.int64)
+    timestamps = df['timestamp'].to_numpy()
+    prev_type = event_type[:-1]
+    cur_type = event_type[1:]
+    # pair k is (row k, row k + 1)
+    is_pair = (users[1:] == users[:-1]) & (timestamps[1:] - timestamps[:-1] <= time_threshold_seconds)
+    
+    pair_label = np.full(len(df) - 1, None, dtype=object)
+    for rule in rules:
+        mask = is_pair & (prev_type == rule['first']) & (cur_type == rule['second'])
+        if 'min_inx' in rule:
+            mask &= inx[1:] >= rule['min_inx']
+        if 'max_inx' in rule:
+            mask &= inx[1:] <= rule['max_inx']
+        pair_label[mask] = rule['label']
+    
+    has_label = pair_label != None
+    # a row is the second event of pair k - 1 and the first of pair k, the later pair wins
+    second = np.flatnonzero(has_label) + 1
+    labels[second] = pair_label[second - 1]
+    first = np.flatnonzero(has_label)
+    labels[first] = pair_label[first]
+    
+    df['event_sequence_type'] = labels
     return df
 
-def build_enriched_df(name, raw_df, market_meta, asset_data, loan_asset_data, market_irm_rates):
-    metrics = calculate_metrics(
-        raw_df[raw_df["datetime"].astype(str) < "2027-01-01"],
-        use_collateral=False,
-        # irm_data=market_meta["irm_curve"],
-        irm_history=market_irm_rates,
-        asset_data=asset_data,
-        loan_asset_data=loan_asset_data
-    )
+def enrich_events(raw_df, market_meta, asset_data, loan_asset_data, market_irm_rates, vault_addresses=(), state=None, context=None, accounting="accrual", profiler=None, n_jobs=1):
+    """
+    Enriched events and the state to continue from (see incremental.py).
+    With the state of a previous run only the new raw events are passed;
+    context are the last enriched rows of that run, they are returned
+    again with possibly updated sequence labels.
+    accounting selects how market totals are computed, see calculate_metrics.
+    Stage timings go to profiler (a StageProfiler) when one is passed.
+    n_jobs processes compute the user positions (see partitioned_position_states).
+    """
+    if profiler is None:
+        profiler = StageProfiler("enrich_events")
+    # One vectorized wei -> token units conversion, decimals come from the market metadata
+    with profiler.stage("add_amount_units", rows_in=len(raw_df)) as st:
+        raw_df = add_amount_units(raw_df, market_meta, asset_data, loan_asset_data)
+        st["rows_out"] = len(raw_df)
+    if state is None:
+        initial = None
+    elif accounting == "shares":
+        initial = state["shares"]
+    else:
+        initial = (state["total_supply"], state["total_borrow"], state["last_timestamp"])
+    with profiler.stage("calculate_metrics", rows_in=len(raw_df)) as st:
+        metrics, share_state = calculate_metrics(
+            raw_df[raw_df["datetime"].astype(str) < "2027-01-01"],
+            use_collateral=False,
+            # irm_data=market_meta["irm_curve"],
+            irm_history=market_irm_rates,
+            asset_data=asset_data,
+            loan_asset_data=loan_asset_data,
+            initial=initial,
+            accounting=accounting,
+            return_state=True,
+        )
+        st["rows_out"] = len(metrics)
 
-    enriched = raw_df.merge(metrics.drop(columns=["timestamp", "datetime"]))
+    with profiler.stage("merge_metrics", rows_in=len(raw_df)) as st:
+        enriched = raw_df.merge(metrics.drop(columns=["timestamp", "datetime"]))
+        st["rows_out"] = len(enriched)
     print("Min date", raw_df["datetime"].min())
-    asset_price_df = pd.DataFrame(asset_meta["historical_price"], columns=["timestamp", "price"]).dropna()
-    enriched = add_user_ltv(enriched, market_data=market_meta)
-    enriched = add_price_features(enriched, asset_price_df)
-    enriched = label_transaction_sequences(enriched, 60*10)
+    asset_price_df = pd.DataFrame(asset_data["historical_price"], columns=["timestamp", "price"]).dropna()
+    with profiler.stage("add_user_ltv", rows_in=len(enriched)) as st:
+        enriched, user_states = add_user_ltv(
+            enriched, market_data=market_meta, vault_addresses=vault_addresses, n_jobs=n_jobs,
+            initial_states=None if state is None else state["users"], return_states=True,
+        )
+        st["rows_out"] = len(enriched)
+    with profiler.stage("add_price_features", rows_in=len(enriched)) as st:
+        enriched = add_price_features(enriched, asset_price_df, lookback_hours=PRICE_LOOKBACK_HOURS)
+        st["rows_out"] = len(enriched)
     enriched["collateral_asset_symbol"] = asset_data["symbol"]
     enriched["loan_asset_symbol"] = loan_asset_data["symbol"]
-    enriched = enriched.sort_values("timestamp")
-
 
-    enriched.to_csv(f"/Users/yegortrussov/Documents/ml/lending_protocols/dataset_collection/data/markets_enriched/{name}.csv", index=False)
+    users = {} if state is None else {user: list(values) for user, values in state["users"].items()}
+    for user, n_events in enriched['user_address'].value_counts().items():
+        previous = users.get(user, [0.0, 0.0, 0.0, 0])
+        users[user] = user_states[user] + [int(previous[3]) + int(n_events)]
+
+    start_inx = None
+    if context is not None and len(context):
+        # events of every user before the context rows
+        in_context = context['user_address'].value_counts()
+        start_inx = {user: state["users"][user][3] - int(n) for user, n in in_context.items() if user in state["users"]}
+        columns = list(context.columns)
+        enriched = pd.concat([context, enriched], ignore_index=True)
+        enriched = enriched[columns + [c for c in enriched.columns if c not in columns]]
+    with profiler.stage("label_transaction_sequences", rows_in=len(enriched)) as st:
+        enriched = label_transaction_sequences(enriched, SEQUENCE_TIME_THRESHOLD, SEQUENCE_RULES, start_inx)
+        enriched = enriched.sort_values(["timestamp", "hash"], kind="stable")
+        st["rows_out"] = len(enriched)
+
+    last_tx = metrics.iloc[-1]
+    next_state = {
+        "last_timestamp": int(metrics["timestamp"].max()),
+        "total_supply": float(last_tx["total_supply_after"]),
+        "total_borrow": float(last_tx["total_borrow_after"]),
+        "users": users,
+    }
+    if share_state is not None:
+        next_state["shares"] = share_state
+    return enriched, next_state
+
+
+def build_enriched_df(name, raw_df, market_meta, asset_data, loan_asset_data, market_irm_rates, vault_addresses=(), accounting="accrual", profiler=None, output_path=None, n_jobs=1):
+    enriched, _ = enrich_events(
+        raw_df, market_meta, asset_data, loan_asset_data, market_irm_rates, vault_addresses,
+        accounting=accounting, profiler=profiler, n_jobs=n_jobs,
+    )
+    output_path = output_path or enriched_path
+    enriched.to_csv(f"{output_path}/{name}.csv", index=False)
+    # indexed in the manifest of the data directory output_path is in
+    manifest.record_file(
+        f"{output_path}/{name}.csv", enriched, market_address=market_meta["address"],
+        manifest_path=f"{os.path.dirname(os.path.abspath(output_path))}/manifest.json",
+    )
 
     return enriched
 
 
 def create_market_hourly_dataset(df, asset_meta):
-    # Generate hourly timestamps
-    min_time = df['timestamp'].min()
-    max_time = df['timestamp'].max()
-    
-    start_hour = (min_time // 3600) * 3600
-    end_hour = ((max_time // 3600) + 1) * 3600
-    
-    hourly_ts = np.arange(start_hour, end_hour + 3600, 3600)
-    
-    # Sort events
-    df_sorted = df.sort_values('timestamp')
-    events_ts = df_sorted['timestamp'].values
-    
-    # Find last event index for each hour using searchsorted
-    idx = np.searchsorted(events_ts, hourly_ts, side='right') - 1
-    
-    # Extract values
-    result_data = []
-    for i, hour_ts in tqdm(enumerate(hourly_ts)):
-        if idx[i] >= 0:
-            last_row = df_sorted.iloc[idx[i]]
-            row_data = {
-                'timestamp': hour_ts,
-                'datetime': pd.to_datetime(hour_ts, unit='s'),
-                'total_supply': last_row['total_supply_after'],
-                'total_borrow': last_row['total_borrow_after'],
-                'utilization': last_row['utilization_after'],
-                'borrow_rate': last_row['borrow_rate_after'],
-                'supply_rate': last_row['supply_rate_after'],
-                'volatility_1h': last_row.get('volatility_1h', 0),
-                'drawdown_1h': last_row.get('drawdown_1h', 0),
-                'volatility_6h': last_row.get('volatility_6h', 0),
-                'drawdown_6h': last_row.get('drawdown_6h', 0),
-                'collateral_price': last_row.get('collateral_price', 0),
-                'loan_asset_price': last_row.get('loan_asset_price', 0),
-                'avg_health_factor': last_row.get('health_factor_after', 0)
-            }
-        else:
-            row_data = {
-                'timestamp': hour_ts,
-                'datetime': pd.to_datetime(hour_ts, unit='s'),
-                'total_supply': 0,
-                'total_borrow': 0,
-                'utilization': 0,
-                'borrow_rate': 0,
-                'supply_rate': 0,
-                'volatility_1h': 0,
-                'drawdown_1h': 0,
-                'volatility_6h': 0,
-                'drawdown_6h': 0,
-                'collateral_price': 0,
-                'loan_asset_price': 0,
-                'avg_health_factor': 0
-            }
-        result_data.append(row_data)
-    
-    result_df = pd.DataFrame(result_data)
-    
-    result_df = result_df.ffill().fillna(0)
-    
-    result_df['borrow_rate_rolling'] = result_df['borrow_rate'].rolling(6, min_periods=1).mean()
-    result_df['supply_rate_rolling'] = result_df['supply_rate'].rolling(6, min_periods=1).mean()
-    
-    # Add asset price
-    if 'historical_price' in asset_meta and asset_meta['historical_price']:
-        price_df = pd.DataFrame(asset_meta['historical_price'], columns=['timestamp', 'price'])
-        price_df = price_df.dropna()
-        if not price_df.empty:
-            result_df = result_df.merge(price_df, on='timestamp', how='left')
-            result_df['asset_price'] = result_df['price'].ffill().fillna(0)
-            result_df = result_df.drop(columns=['price'])
-    
-    return result_df
-
-
-
-raw_path = "/Users/yegortrussov/Documents/ml/lending_protocols/dataset_collection/data/markets_raw"
+    return create_market_rollups(df, asset_meta, {"hourly": 3600})["hourly"]
 
-import argparse
 
-parser = argparse.ArgumentParser()
-parser.add_argument('--markets', nargs='+', help='List of items')
-args = parser.parse_args()
 
-print(args.markets)  # List of strings
+raw_path = f"{DATA_PATH}/markets_raw"
+enriched_path = f"{DATA_PATH}/markets_enriched"
+hourly_path = f"{DATA_PATH}/markets_hourly_data"
+rollup_paths = {
+    "5min": f"{DATA_PATH}/markets_5min_data",
+    "hourly": hourly_path,
+    "daily": f"{DATA_PATH}/markets_daily_data",
+}
 
-
-# exit(0)
-
-for file in tqdm(args.markets[0].split(' ')):
-    print("processing file", file)
-    # if "base" in file:
-    #     continue
-    raw_df = pd.read_csv(raw_path + "/" + file + ".csv")
-    print(raw_df.shape)
-    address = raw_df["market_address"].unique()[0]
+def enrich_raw_range(file, market_meta, asset_meta, loan_asset_meta, vault_addresses, state, raw_end, accounting="accrual", profiler=None, n_jobs=1):
+    """
+    Enrich the raw events up to byte raw_end that are not in state yet
+    (all of them for state=None), write them and their rollups, and
+    return (next_state, number of raw events). next_state is None if there
+    were no new events.
+    """
+    raw_file = f"{raw_path}/{file}.csv"
+    enriched_file = f"{enriched_path}/{file}.csv"
+    if profiler is None:
+        profiler = StageProfiler(file)
+
+    context = None
+    with profiler.stage("read_raw") as st:
+        if state is not None:
+            raw_df = read_csv_from(raw_file, state["raw_bytes"], raw_end, dtype=RAW_DTYPES)
+            if raw_df.empty:
+                return None, 0
+            if raw_df["timestamp"].min() <= state["last_timestamp"]:
+                print(f"{file}: new raw events are not after the last enriched one, rebuilding")
+                state = None
+            else:
+                context = read_csv_from(enriched_file, state["enriched_offset"], dtype=RAW_DTYPES)
+        if state is None:
+            raw_df = read_csv_from(raw_file, 0, raw_end, dtype=RAW_DTYPES)
+        st["rows_out"] = len(raw_df)
+    print(file, raw_df.shape, "new events" if state is not None else "events")
+
+    with profiler.stage("enrich_events", rows_in=len(raw_df)) as st:
+        res, next_state = enrich_events(
+            raw_df,
+            market_meta,
+            asset_meta,
+            loan_asset_meta,
+            rate_at_target_history(market_meta),
+            vault_addresses,
+            state=state,
+            context=context,
+            accounting=accounting,
+            profiler=profiler,
+            n_jobs=n_jobs,
+        )
+        st["rows_out"] = len(res)
+    with profiler.stage("write_enriched", rows_in=len(res)):
+        offsets = write_rows(enriched_file, res, None if state is None else state["enriched_offset"])
+        manifest.record_file(enriched_file, res, market_address=market_meta["address"], append=state is not None)
+    k = context_start(res["timestamp"].values, next_state["last_timestamp"], CONTEXT_WINDOW)
+    next_state["enriched_offset"] = int(offsets[k])
+
+    print(f"{file}: creating time series df...")
+    with profiler.stage("market_rollups", rows_in=len(res)) as st:
+        if state is None:
+            rollups = create_market_rollups(res, asset_meta, ROLLUP_RESOLUTIONS)
+        else:
+            contexts = {
+                resolution: read_csv_from(
+                    f"{rollup_paths[resolution]}/{file}.csv", offsets_state["context_offset"], offsets_state["cut_offset"]
+                )
+                for resolution, offsets_state in state["rollups"].items()
+            }
+            rollups = append_market_rollups(res, asset_meta, state["last_timestamp"], contexts, ROLLUP_RESOLUTIONS)
+        st["rows_out"] = sum(len(rollup_df) for rollup_df in rollups.values())
+
+    next_state["rollups"] = {}
+    for resolution, rollup_df in rollups.items():
+        rollup_file = f"{rollup_paths[resolution]}/{file}.csv"
+        with profiler.stage(f"write_{resolution}", rows_in=len(rollup_df)):
+            if state is not None:
+                # the context rows are rewritten too, so the offsets of all written rows are known
+                rollup_df = pd.concat([contexts[resolution], rollup_df], ignore_index=True)
+                rollup_df["datetime"] = pd.to_datetime(rollup_df["datetime"])
+            offsets = write_rows(rollup_file, rollup_df, None if state is None else state["rollups"][resolution]["context_offset"])
+        cut = int(np.searchsorted(rollup_df["timestamp"].values, next_state["last_timestamp"], side="right"))
+        next_state["rollups"][resolution] = {
+            "context_offset": int(offsets[max(cut - 5, 0)]),
+            "cut_offset": int(offsets[cut]) if cut < len(offsets) else os.path.getsize(rollup_file),
+        }
+    return next_state, len(raw_df)
+
+
+def enrich_market(file, market_meta, asset_meta, loan_asset_meta, vault_addresses, state_fingerprint=None, force=False, accounting="accrual", sample=False, chunk_bytes=None, n_jobs=1):
+    """
+    Enriched events and rollups of one market, everything it needs is passed explicitly.
+    If the outputs were built from a prefix of the current raw file with the
+    same parameters and code, only the appended raw events are processed.
+    With chunk_bytes the raw file is streamed in time ordered chunks of about
+    that size, each continued from the state of the previous one, so memory
+    is bounded by the chunk size instead of the market history. n_jobs
+    processes compute the user positions, the output does not depend on it.
+    Stage timings and memory are written to run_reports/{market}.json, with
+    sample the build also runs under a sampling profiler.
+    """
+    name = file.split(".")[0]
+    profiler = StageProfiler(name, sample=sample)
+    try:
+        raw_file = f"{raw_path}/{file}.csv"
+        raw_bytes = os.path.getsize(raw_file)
+
+        state = None if force else load_state(name)
+        raw_hash = None if state is None else raw_prefix_hash(raw_file, state)
+        if state is not None and (
+            state.get("fingerprint") != state_fingerprint
+            or raw_hash is None
+            or not all(os.path.exists(p) for p in market_outputs(file))
+        ):
+            print(f"{file}: stored state does not match the outputs, rebuilding")
+            state = None
+        if state is None:
+            raw_hash = hashlib.sha256()
+        hashed = 0 if state is None else state["raw_bytes"]
+
+        ends = chunk_ends(raw_file, 0 if state is None else state["raw_bytes"], raw_bytes, chunk_bytes)
+        n_events = 0
+        for i, raw_end in enumerate(ends):
+            with profiler.stage(f"chunk_{i}") if len(ends) > 1 else nullcontext():
+                next_state, n = enrich_raw_range(
+                    file, market_meta, asset_meta, loan_asset_meta, vault_addresses, state, raw_end,
+                    accounting=accounting, profiler=profiler, n_jobs=n_jobs,
+                )
+            if next_state is None:
+                continue
+            sha256_update(raw_hash, raw_file, hashed, raw_end)
+            hashed = raw_end
+            next_state["raw_bytes"] = raw_end
+            next_state["raw_sha256"] = raw_hash.hexdigest()
+            next_state["fingerprint"] = state_fingerprint
+            # saved after every chunk, an interrupted stream continues from the last one
+            save_state(name, next_state)
+            state = next_state
+            n_events += n
+        if n_events == 0:
+            print(f"{file}: no new raw events")
+            return 0
+
+        report_file = profiler.save()
+        print(profiler.summary())
+        print(f"{file}: run report written to {report_file}")
+        return n_events
+    finally:
+        # a failed or empty build still stops the sampler
+        profiler.close()
+
+
+def market_outputs(file):
+    return [f"{enriched_path}/{file}.csv"] + [f"{path}/{file}.csv" for path in rollup_paths.values()]
+
+
+def market_inputs(file, markets_meta, assets_meta):
+    """(raw file, market_meta, asset_meta, loan_asset_meta) of a market."""
+    raw_file = f"{raw_path}/{file}.csv"
+    address = manifest.entry(raw_file)["market_address"]
     market_meta = markets_meta[address]
-    market_irm_rates = compute_market_rates(market_meta)
-    print(address)
     asset_meta = assets_meta[market_meta["collateral_asset_address"]]
     loan_asset_meta = assets_meta[market_meta["loan_asset_address"]]
-    # loan_asset_meta["decimals"] = 6
-    res = build_enriched_df(
-        file.split(".")[0],
-        raw_df,
-        market_meta,
-        asset_meta,
-        loan_asset_meta,
-        market_irm_rates,
-    )
-
-    print("creating time series df...")
+    return raw_file, market_meta, asset_meta, loan_asset_meta
 
-    hourly_df = create_market_hourly_dataset(
-        res,
-        asset_meta,
-    )
-
-    hourly_df.to_csv(f"/Users/yegortrussov/Documents/ml/lending_protocols/dataset_collection/data/markets_hourly_data/{file}.csv",index=False)
 
+def market_build_params(market_meta, asset_meta, loan_asset_meta, accounting="accrual"):
+    return {
+        "market_meta": params_hash(market_meta),
+        "asset_meta": params_hash(asset_meta),
+        "loan_asset_meta": params_hash(loan_asset_meta),
+        "time_threshold_seconds": SEQUENCE_TIME_THRESHOLD,
+        "sequence_rules": SEQUENCE_RULES,
+        "lookback_hours": PRICE_LOOKBACK_HOURS,
+        "accounting": accounting,
+    }
 
 
+def market_job(file, market_meta, asset_meta, loan_asset_meta, vault_addresses, code, cache, force=False, accounting="accrual", sample=False, chunk_bytes=None, n_jobs=1):
+    """
+    enrich_market args and BuildCache record of a market, None if its
+    outputs are up to date with its raw events, metadata, parameters and code.
+    """
+    raw_file = f"{raw_path}/{file}.csv"
+    build_params = market_build_params(market_meta, asset_meta, loan_asset_meta, accounting)
+    fingerprint = cache.fingerprint([raw_file], code, build_params)
+    if not force and not cache.is_stale(market_outputs(file), fingerprint):
+        return None
+    state_fingerprint = params_hash({"params": build_params, "code": code_version(*code)})
+    return {
+        "args": (file, market_meta, asset_meta, loan_asset_meta, vault_addresses, state_fingerprint, force, accounting, sample, chunk_bytes, n_jobs),
+        "record": (market_outputs(file), fingerprint, [raw_file], build_params),
+    }
+
+
+def run_markets(files, workers=1, force=False, accounting="accrual", sample=False, chunk_bytes=None, n_jobs=1):
+    """
+    Enrich markets, in `workers` processes when workers > 1. The metadata is
+    loaded once here and every worker only gets the entries of its market.
+    A failing market is reported and does not stop the others. Markets
+    whose raw file only got new events are continued from their stored
+    state unless force is set. accounting is passed to calculate_metrics,
+    sample runs every build under a sampling profiler, chunk_bytes
+    streams the raw files in chunks and n_jobs splits the user positions
+    of a market between processes (see enrich_market).
+    Returns {file: "built" | "fresh" | "failed"}.
+    """
+    markets_meta, assets_meta, vaults_meta = load_metadata()
+    vault_addresses = sorted(vaults_meta.keys())
+    code = local_imports(os.path.abspath(__file__))
+    cache = BuildCache()
+    status = {}
+
+    # Skip markets whose raw events, metadata, parameters and code did not change
+    jobs = {}
+    for file in files:
+        try:
+            _, market_meta, asset_meta, loan_asset_meta = market_inputs(file, markets_meta, assets_meta)
+            job = market_job(
+                file, market_meta, asset_meta, loan_asset_meta, vault_addresses, code, cache,
+                force=force, accounting=accounting, sample=sample, chunk_bytes=chunk_bytes, n_jobs=n_jobs,
+            )
+        except Exception as e:
+            print(f"{file}: failed to prepare inputs: {e!r}")
+            status[file] = "failed"
+            continue
+        if job is None:
+            print(f"{file} is up to date, skipping")
+            status[file] = "fresh"
+            continue
+        jobs[file] = job
 
+    def on_done(file, error):
+        if error is None:
+            cache.record(*jobs[file]["record"])
+            cache.save()
+            status[file] = "built"
+        else:
+            print(f"{file}: failed: {error!r}")
+            status[file] = "failed"
+
+    if workers <= 1:
+        for file in tqdm(jobs):
+            print("processing file", file)
+            try:
+                enrich_market(*jobs[file]["args"])
+                on_done(file, None)
+            except Exception as e:
+                traceback.print_exc()
+                on_done(file, e)
+    else:
+        with ProcessPoolExecutor(max_workers=workers) as executor:
+            futures = {executor.submit(enrich_market, *job["args"]): file for file, job in jobs.items()}
+            for future in tqdm(as_completed(futures), total=len(futures)):
+                file = futures[future]
+                try:
+                    future.result()
+                    on_done(file, None)
+                except Exception as e:
+                    on_done(file, e)
+
+    failed = [file for file, st in status.items() if st == "failed"]
+    print(f"built {sum(st == 'built' for st in status.values())}, up to date {sum(st == 'fresh' for st in status.values())}, failed {len(failed)}")
+    if failed:
+        print("failed markets:", " ".join(failed))
+    return status
+
+
+if __name__ == "__main__":
+    import argparse
+
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--markets', nargs='+', help='List of items')
+    parser.add_argument('--force', action='store_true', help='Rebuild markets even if their outputs are up to date')
+    parser.add_argument('--workers', type=int, default=1, help='Number of markets enriched in parallel processes')
+    parser.add_argument('--accounting', choices=['accrual', 'shares'], default='accrual', help='How market totals are computed')
+    parser.add_argument('--profile', action='store_true', help='Run every market under a sampling profiler, written next to its run report')
+    parser.add_argument('--chunk-mb', type=float, default=None, help='Stream raw events in chunks of about this many MB to bound memory')
+    parser.add_argument('--position-jobs', type=int, default=1, help='Processes computing the user positions of a market, pays off for markets with millions of events')
+    args = parser.parse_args()
+
+    print(args.markets)  # List of strings
+
+    status = run_markets(
+        args.markets[0].split(' '), workers=args.workers, force=args.force, accounting=args.accounting,
+        sample=args.profile, chunk_bytes=None if args.chunk_mb is None else int(args.chunk_mb * 2**20),
+        n_jobs=args.position_jobs,
+    )
+    if any(st == "failed" for st in status.values()):
+        sys.exit(1)
@@ -0,0 +1,3 @@
+"""Location of the data directory shared by the collection and build scripts."""
+DATA_PATH = "/Users/yegortrussov/Documents/ml/lending_protocols/dataset_collection/data"
+COMMON_PATH = DATA_PATH + "/common"
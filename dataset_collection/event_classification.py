@@ -0,0 +1,190 @@
+"""
+Position event classification of a user transaction from its collateral /
+debt before and after it and the event types it contains.
+
+classify_event is the per-transaction reference, classify_events the
+vectorized version over arrays of transactions (type_mask as returned by
+user_positions, bit TYPE_CODES[type] set for every type in the tx). Both
+use the same precedence and epsilon.
+
+    python event_classification.py eth_wbtc_usdc eth_cbbtc_usdc
+
+checks they agree on real market files.
+"""
+import numpy as np
+
+from accrual import TYPE_CODES
+
+EPSILON = 1e-6
+
+# codes returned by classify_events are positions in this list
+EVENT_TYPES = [
+    'other',
+    'liquidation',
+    'position_open',
+    'position_close',
+    'repay_full',
+    'repay_partial',
+    'collateral_add',
+    'borrow_more',
+    'collateral_withdraw',
+    'borrow_more_w_collateral',
+    'position_adjust',
+    'loan_position_supply',
+    'loan_position_withdraw',
+]
+EVENT_TYPE_CODES = {name: code for code, name in enumerate(EVENT_TYPES)}
+
+
+def classify_event(start_coll, start_debt, end_coll, end_debt, types_in_tx):
+    # Epsilon for zero detection (use same as in your code)
+    epsilon = EPSILON
+
+    # Extract event types in this transaction
+    tx_types = list(set(types_in_tx))
+
+    # Liquidation events
+    if 'MarketLiquidation' in tx_types:
+        return 'liquidation'
+
+    # Calculate changes
+    delta_coll = end_coll - start_coll
+    delta_debt = end_debt - start_debt
+
+    # Check for opening position (from near-zero to positive)
+    if start_coll < epsilon and start_debt < epsilon and end_coll > epsilon and end_debt > epsilon:
+        return 'position_open'
+
+    # Check for closing position (to near-zero)
+    if end_coll < epsilon and end_debt < epsilon and (start_coll > epsilon or start_debt > epsilon):
+        return 'position_close'
+
+    # Full repay (debt goes to zero, collateral may or may not change)
+    if end_debt < epsilon and abs(start_debt) > epsilon:
+        return 'repay_full'
+
+    # Partial repay (debt decreases but not to zero)
+    if delta_debt < -epsilon and end_debt > epsilon:
+        return 'repay_partial'
+
+    # Add collateral only
+    if delta_coll > epsilon and abs(delta_debt) < epsilon:
+        return 'collateral_add'
+
+    # Borrow more only
+    if delta_debt > epsilon and abs(delta_coll) < epsilon:
+        return 'borrow_more'
+
+    # Withdraw collateral only
+    if delta_coll < -epsilon and abs(delta_debt) < epsilon:
+        return 'collateral_withdraw'
+
+    if delta_coll > epsilon and delta_debt > epsilon:
+        return 'borrow_more_w_collateral'
+
+    # Both collateral and debt change significantly
+    if abs(delta_coll) > epsilon and abs(delta_debt) > epsilon:
+        return 'position_adjust'
+
+    if start_coll < epsilon and start_debt < epsilon and end_coll < epsilon and end_debt < epsilon and 'MarketSupply' in tx_types:
+        return 'loan_position_supply'
+    if start_coll < epsilon and start_debt < epsilon and end_coll < epsilon and end_debt < epsilon and 'MarketWithdraw' in tx_types:
+        return 'loan_position_withdraw'
+
+
+    return 'other'
+
+
+def has_type(type_mask, name):
+    return (np.asarray(type_mask) & (1 << TYPE_CODES[name])) != 0
+
+
+def classify_events(start_coll, start_debt, end_coll, end_debt, type_mask):
+    """EVENT_TYPES codes (int8) for arrays of transactions, same rules as classify_event."""
+    eps = EPSILON
+    start_coll = np.asarray(start_coll, dtype=np.float64)
+    start_debt = np.asarray(start_debt, dtype=np.float64)
+    end_coll = np.asarray(end_coll, dtype=np.float64)
+    end_debt = np.asarray(end_debt, dtype=np.float64)
+    delta_coll = end_coll - start_coll
+    delta_debt = end_debt - start_debt
+    all_zero = (start_coll < eps) & (start_debt < eps) & (end_coll < eps) & (end_debt < eps)
+
+    # np.select picks the first matching condition, same order as the ifs above
+    rules = [
+        ('liquidation', has_type(type_mask, 'MarketLiquidation')),
+        ('position_open', (start_coll < eps) & (start_debt < eps) & (end_coll > eps) & (end_debt > eps)),
+        ('position_close', (end_coll < eps) & (end_debt < eps) & ((start_coll > eps) | (start_debt > eps))),
+        ('repay_full', (end_debt < eps) & (np.abs(start_debt) > eps)),
+        ('repay_partial', (delta_debt < -eps) & (end_debt > eps)),
+        ('collateral_add', (delta_coll > eps) & (np.abs(delta_debt) < eps)),
+        ('borrow_more', (delta_debt > eps) & (np.abs(delta_coll) < eps)),
+        ('collateral_withdraw', (delta_coll < -eps) & (np.abs(delta_debt) < eps)),
+        ('borrow_more_w_collateral', (delta_coll > eps) & (delta_debt > eps)),
+        ('position_adjust', (np.abs(delta_coll) > eps) & (np.abs(delta_debt) > eps)),
+        ('loan_position_supply', all_zero & has_type(type_mask, 'MarketSupply')),
+        ('loan_position_withdraw', all_zero & has_type(type_mask, 'MarketWithdraw')),
+    ]
+    return np.select(
+        [cond for _, cond in rules],
+        [EVENT_TYPE_CODES[name] for name, _ in rules],
+        default=EVENT_TYPE_CODES['other'],
+    ).astype(np.int8)
+
+
+def event_type_names(codes):
+    """EVENT_TYPES codes -> object array of labels."""
+    return np.array(EVENT_TYPES, dtype=object)[np.asarray(codes)]
+
+
+def check_equivalence(df):
+    """
+    Compare classify_events with classify_event on every transaction of an
+    events frame (needs user_address, timestamp, hash, type, assets_units).
+    Returns the number of mismatching transactions.
+    """
+    from user_positions import compute_position_states, type_names
+
+    df = df[df['user_address'].notna()].sort_values(['user_address', 'timestamp', 'hash'])
+    (
+        starts, _, coll_before, debt_before, _,
+        coll_after, debt_after, _, type_mask,
+    ) = compute_position_states(
+        df['user_address'].values, df['hash'].values, df['type'].values,
+        np.abs(df['assets_units'].values.astype(float)),
+    )
+    vectorized = event_type_names(classify_events(coll_before, debt_before, coll_after, debt_after, type_mask))
+    mismatches = 0
+    for t in range(len(starts)):
+        expected = classify_event(coll_before[t], debt_before[t], coll_after[t], debt_after[t], type_names(type_mask[t]))
+        if expected != vectorized[t]:
+            mismatches += 1
+            if mismatches <= 10:
+                print(f"  tx {df['hash'].values[starts[t]]}: {expected} != {vectorized[t]}")
+    return mismatches
+
+
+if __name__ == "__main__":
+    import sys
+    from metadata import MetadataStore
+    import pandas as pd
+    from amounts import add_amount_units, RAW_DTYPES
+
+    from config import DATA_PATH, COMMON_PATH
+
+    store = MetadataStore(COMMON_PATH)
+    markets_meta, assets_meta = store.markets, store.assets
+
+    failed = False
+    for name in sys.argv[1:]:
+        df = pd.read_csv(f"{DATA_PATH}/markets_raw/{name}.csv", dtype=RAW_DTYPES)
+        market_meta = markets_meta[df["market_address"].unique()[0]]
+        df = add_amount_units(
+            df, market_meta,
+            assets_meta.get(market_meta["collateral_asset_address"]),
+            assets_meta.get(market_meta["loan_asset_address"]),
+        )
+        mismatches = check_equivalence(df)
+        print(f"{name}: {mismatches} mismatching transactions")
+        failed = failed or mismatches > 0
+    sys.exit(1 if failed else 0)
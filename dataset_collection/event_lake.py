@@ -0,0 +1,181 @@
+"""
+In-process SQL over the collected datasets (duckdb).
+
+    con = connect()
+    df = query('''
+        select e.market, e.hash, e.user_address, e.debt_before
+        from events e
+        join spikes s
+          on s.market_name = e.market
+         and e.timestamp between epoch(s.spike_trigger_datetime) and epoch(s.spike_recovery_datetime)
+        where e.type = 'MarketRepay'
+          and e.debt_before > 1e6
+          and e.market like '%PT-%'
+    ''', con)
+
+Filters and aggregations are pushed down to the csv / parquet scans, only
+the result is materialized in pandas. Run `export_event_lake()` once to
+convert the csv files to market partitioned parquet, views switch to the
+parquet files automatically when they exist.
+"""
+import os
+import csv
+import glob
+
+from config import DATA_PATH
+
+LAKE_PATH = DATA_PATH + "/lake"
+
+# view name -> csv glob (relative to DATA_PATH), one file per market
+MARKET_DATASETS = {
+    "events": "markets_enriched/*.csv",
+    "raw_events": "markets_raw/*.csv",
+    "hourly": "markets_hourly_data/*.csv",
+}
+
+# view name -> csv glob, files that already contain a market column
+SHARED_DATASETS = {
+    "positions": "users_positions/*.csv",
+    "suppliers_share": "markets_suppliers_share.csv",
+    "borrowers_share": "markets_borrowers_share.csv",
+    "spikes": "all_spikes_dataset.csv",
+}
+
+
+def _import_duckdb():
+    try:
+        import duckdb
+    except ImportError:
+        raise ImportError("event_lake needs duckdb: pip install duckdb")
+    return duckdb
+
+
+def _market_from_filename(column="filename"):
+    # .../markets_enriched/eth_wbtc_usdc.csv -> eth_wbtc_usdc
+    return f"regexp_extract({column}, '([^/]+)\\.csv$', 1)"
+
+
+def _has_files(path):
+    return os.path.isdir(path) and len(os.listdir(path)) > 0
+
+
+def _is_text_column(column):
+    # 0x hex strings would be sniffed as BIGINT (0x...dead -> 57005)
+    return column in ("hash", "market") or column.endswith("address")
+
+
+def _csv_source(pattern, filename=False):
+    """
+    read_csv_auto over the files matching pattern with address / hash /
+    market columns read as text, (None, []) if no file matches.
+    """
+    files = sorted(glob.glob(pattern))
+    if not files:
+        return None, []
+    columns = []
+    for file in files:
+        with open(file, "r", newline="") as f:
+            for column in next(csv.reader(f), []):
+                if column not in columns:
+                    columns.append(column)
+    types = ", ".join(f"'{c}': 'VARCHAR'" for c in columns if _is_text_column(c))
+    options = "union_by_name = true" + (", filename = true" if filename else "") + (f", types = {{{types}}}" if types else "")
+    return f"read_csv_auto('{pattern}', {options})", columns
+
+
+def _with_market(source, columns):
+    # raw and enriched csvs already have a market column, the file name only fills the gaps
+    if "market" in columns:
+        return f"SELECT * EXCLUDE (filename) REPLACE (coalesce(market, {_market_from_filename()}) AS market) FROM {source}"
+    return f"SELECT * EXCLUDE (filename), {_market_from_filename()} AS market FROM {source}"
+
+
+def connect(data_path=DATA_PATH, lake_path=LAKE_PATH, memory_limit="4GB", threads=None, database=":memory:"):
+    """
+    Open a duckdb connection with a view per dataset. Datasets without any
+    file yet get no view (a warning is printed), the others are still usable.
+
+    memory_limit caps the RAM used by the engine, bigger joins / sorts spill
+    to `temp_directory` instead of failing (out-of-core execution).
+    """
+    duckdb = _import_duckdb()
+    con = duckdb.connect(database)
+    con.execute(f"SET memory_limit = '{memory_limit}'")
+    con.execute(f"SET temp_directory = '{os.path.join(lake_path, 'tmp')}'")
+    if threads is not None:
+        con.execute(f"SET threads = {int(threads)}")
+
+    for name, pattern in MARKET_DATASETS.items():
+        parquet_dir = os.path.join(lake_path, name)
+        if _has_files(parquet_dir):
+            source = f"read_parquet('{parquet_dir}/*/*.parquet', hive_partitioning = true)"
+            con.execute(f"CREATE OR REPLACE VIEW {name} AS SELECT * FROM {source}")
+        else:
+            source, columns = _csv_source(f"{data_path}/{pattern}", filename=True)
+            if source is None:
+                print(f"event_lake: no files for {name} ({pattern}), view not created")
+                continue
+            con.execute(f"CREATE OR REPLACE VIEW {name} AS {_with_market(source, columns)}")
+
+    for name, pattern in SHARED_DATASETS.items():
+        parquet_file = os.path.join(lake_path, f"{name}.parquet")
+        if os.path.exists(parquet_file):
+            source = f"read_parquet('{parquet_file}')"
+        else:
+            source, _ = _csv_source(f"{data_path}/{pattern}")
+            if source is None:
+                print(f"event_lake: no files for {name} ({pattern}), view not created")
+                continue
+        con.execute(f"CREATE OR REPLACE VIEW {name} AS SELECT * FROM {source}")
+
+    return con
+
+
+def query(sql, con=None, params=None):
+    """Run sql and return the result as a pandas DataFrame."""
+    con = connect() if con is None else con
+    return con.execute(sql, params or []).df()
+
+
+def export_event_lake(data_path=DATA_PATH, lake_path=LAKE_PATH, datasets=None):
+    """
+    Convert the csv datasets to zstd parquet, per market datasets are
+    partitioned by market (`lake/events/market=eth_wbtc_usdc/*.parquet`)
+    so queries filtering on market only open the matching files.
+    """
+    duckdb = _import_duckdb()
+    os.makedirs(lake_path, exist_ok=True)
+    datasets = list(MARKET_DATASETS) + list(SHARED_DATASETS) if datasets is None else datasets
+
+    # plain csv views, not the parquet ones we are about to overwrite
+    con = duckdb.connect()
+    con.execute(f"SET temp_directory = '{os.path.join(lake_path, 'tmp')}'")
+
+    for name in datasets:
+        pattern = MARKET_DATASETS.get(name) or SHARED_DATASETS[name]
+        source, columns = _csv_source(f"{data_path}/{pattern}", filename=name in MARKET_DATASETS)
+        if source is None:
+            print(f"Skipping {name}, no files match {pattern}")
+            continue
+        if name in MARKET_DATASETS:
+            dest = os.path.join(lake_path, name)
+            print(f"Exporting {name} -> {dest}")
+            con.execute(
+                f"COPY ({_with_market(source, columns)} ORDER BY market, timestamp) "
+                f"TO '{dest}' (FORMAT PARQUET, PARTITION_BY (market), COMPRESSION ZSTD, OVERWRITE_OR_IGNORE true)"
+            )
+        else:
+            dest = os.path.join(lake_path, f"{name}.parquet")
+            print(f"Exporting {name} -> {dest}")
+            con.execute(f"COPY (SELECT * FROM {source}) TO '{dest}' (FORMAT PARQUET, COMPRESSION ZSTD)")
+
+    con.close()
+
+
+if __name__ == "__main__":
+    import sys
+
+    if "-export" in sys.argv:
+        export_event_lake()
+    else:
+        print(query(sys.argv[1]))
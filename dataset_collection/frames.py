@@ -0,0 +1,154 @@
+import pandas as pd
+import numpy as np
+
+# Low-cardinality (or heavily repeated) string columns of the enriched events
+CATEGORY_COLUMNS = [
+    "hash",
+    "user_address",
+    "type",
+    "event_type",
+    "event_sequence_type",
+    "collateral_asset_symbol",
+    "loan_asset_symbol",
+    "market",
+    "market_address",
+]
+
+# Ratios, rates and price features: float32 keeps ~7 significant digits which
+# is plenty for values in [0, 1000]. Amounts, totals and prices stay float64.
+FLOAT32_COLUMNS = [
+    "utilization_before",
+    "utilization_after",
+    "borrow_rate_before",
+    "supply_rate_before",
+    "borrow_rate_after",
+    "supply_rate_after",
+    "ltv_before",
+    "ltv_after",
+    "health_factor_before",
+    "health_factor_after",
+    "volatility_6h",
+    "drawdown_6h",
+    "trend_6h",
+    "volatility_24h",
+    "drawdown_24h",
+    "trend_24h",
+    "volatility_1h",
+    "drawdown_1h",
+    "utilization",
+    "borrow_rate",
+    "supply_rate",
+    "borrow_rate_rolling",
+    "supply_rate_rolling",
+    "avg_health_factor",
+]
+
+INT_COLUMNS = {
+    "timestamp": "int64",
+    "tx_actions": "int32",
+}
+
+BOOL_COLUMNS = [
+    "vault_flg",
+]
+
+
+def memory_usage_mb(df):
+    return df.memory_usage(deep=True, index=True).sum() / 1024**2
+
+
+def memory_report(before, after, name=""):
+    """Print per column memory usage before / after dtype optimization."""
+    before_usage = before.memory_usage(deep=True, index=False) / 1024**2
+    after_usage = after.memory_usage(deep=True, index=False) / 1024**2
+    report = pd.DataFrame({
+        "dtype_before": before.dtypes.astype(str),
+        "mb_before": before_usage,
+        "dtype_after": after.dtypes.reindex(before.columns).astype(str).where(before.columns.isin(after.columns), "dropped"),
+        "mb_after": after_usage.reindex(before.columns),
+    }).sort_values("mb_before", ascending=False)
+
+    total_before = memory_usage_mb(before)
+    total_after = memory_usage_mb(after)
+    print(f"Memory report {name} ({len(before)} rows)")
+    print(report.round(2).to_string())
+    print(
+        f"Total: {total_before:.2f} MB -> {total_after:.2f} MB "
+        f"({100 * (1 - total_after / total_before) if total_before > 0 else 0:.1f}% saved)"
+    )
+    return report
+
+
+def optimize_dtypes(df, drop_datetime=True, float32_columns=None):
+    """
+    Map known enriched / hourly columns to compact dtypes:
+    categoricals for repeated strings, float32 for ratios and rates,
+    int64 timestamps. The `datetime` string column is dropped since it is
+    fully defined by `timestamp` (use `add_datetime` to restore it).
+    """
+    float32_columns = FLOAT32_COLUMNS if float32_columns is None else float32_columns
+    df = df.copy()
+
+    if drop_datetime and "datetime" in df.columns and "timestamp" in df.columns:
+        df = df.drop(columns=["datetime"])
+
+    for col, dtype in INT_COLUMNS.items():
+        if col in df.columns and not df[col].isna().any():
+            df[col] = df[col].astype(dtype)
+
+    for col in CATEGORY_COLUMNS:
+        if col in df.columns and not isinstance(df[col].dtype, pd.CategoricalDtype):
+            df[col] = df[col].astype("category")
+
+    for col in float32_columns:
+        if col in df.columns and pd.api.types.is_numeric_dtype(df[col]):
+            df[col] = df[col].astype(np.float32)
+
+    for col in BOOL_COLUMNS:
+        if col in df.columns and not df[col].isna().any():
+            df[col] = df[col].astype(bool)
+
+    return df
+
+
+def add_datetime(df):
+    df["datetime"] = pd.to_datetime(df["timestamp"], unit="s")
+    return df
+
+
+def load_enriched_df(path, drop_datetime=True, report=True, usecols=None):
+    """Load an enriched events (or hourly) csv with compact dtypes."""
+    df = pd.read_csv(path, usecols=usecols)
+    optimized = optimize_dtypes(df, drop_datetime=drop_datetime)
+    if report:
+        memory_report(df, optimized, name=str(path).split("/")[-1])
+    return optimized
+
+
+def concat_frames(frames, report=True):
+    """
+    pd.concat for frames produced by `load_enriched_df`.
+    Categories are unioned first, a plain concat would silently fall
+    back to object columns when the categories differ between markets.
+    """
+    frames = [f for f in frames if f is not None and len(f) > 0]
+    if not frames:
+        return pd.DataFrame()
+
+    columns = set().union(*[f.columns for f in frames])
+    frames = [f.copy() for f in frames]
+    for col in columns:
+        dtypes = [f[col].dtype for f in frames if col in f.columns]
+        if not all(isinstance(d, pd.CategoricalDtype) for d in dtypes):
+            continue
+        categories = pd.api.types.union_categoricals(
+            [f[col] for f in frames if col in f.columns]
+        ).categories
+        for f in frames:
+            if col in f.columns:
+                f[col] = f[col].cat.set_categories(categories)
+
+    res = pd.concat(frames, ignore_index=True)
+    if report:
+        print(f"Concatenated {len(frames)} frames: {len(res)} rows, {memory_usage_mb(res):.2f} MB")
+    return res
@@ -9,6 +9,7 @@ import time
 from tqdm import tqdm
 
 from utils import send_morpho_request
+from config import COMMON_PATH
 
 
 assets_address_list = [
@@ -1280,18 +1281,6 @@ assets_address_list = [
 
 import pandas as pd
 import os
-assets_address_list = []
-with open("/Users/yegortrussov/Documents/ml/lending_protocols/dataset_collection/data/common/markets_meta.json", 'r') as f:
-    markets_meta = json.load(f)
-
-for k,v in markets_meta.items():
-    assets_address_list.append(
-        v["loan_asset_address"]
-    )
-    assets_address_list.append(
-        v["collateral_asset_address"]
-    )
-
 
 
 assets_data = {}
@@ -1341,20 +1330,38 @@ def get_data_as_json(address):
         return asset_data
         
         
-with open("/Users/yegortrussov/Documents/ml/lending_protocols/dataset_collection/data/common/assets_meta.json", 'r') as f:
-    assets_meta = json.load(f)
+def markets_assets(markets_meta):
+    """Loan and collateral asset addresses of the markets."""
+    assets_address_list = []
+    for k,v in markets_meta.items():
+        assets_address_list.append(
+            v["loan_asset_address"]
+        )
+        assets_address_list.append(
+            v["collateral_asset_address"]
+        )
+    return assets_address_list
+
+
+if __name__ == "__main__":
+    with open(f"{COMMON_PATH}/markets_meta.json", 'r') as f:
+        markets_meta = json.load(f)
+    assets_address_list = markets_assets(markets_meta)
+
+    with open(f"{COMMON_PATH}/assets_meta.json", 'r') as f:
+        assets_meta = json.load(f)
 
-all_assets_data = {}
-for asset_address in tqdm(assets_address_list):
-    # if asset_address in assets_meta.keys():
-    #     all_assets_data[asset_address] = assets_meta[asset_address]
-    #     print(f"Skipped asset {asset_address} from cache")
-    #     continue
-    all_assets_data[asset_address] = get_data_as_json(asset_address)
-    if len(all_assets_data[asset_address].keys()) == 0:
-        no_data += 1
+    all_assets_data = {}
+    for asset_address in tqdm(assets_address_list):
+        # if asset_address in assets_meta.keys():
+        #     all_assets_data[asset_address] = assets_meta[asset_address]
+        #     print(f"Skipped asset {asset_address} from cache")
+        #     continue
+        all_assets_data[asset_address] = get_data_as_json(asset_address)
+        if len(all_assets_data[asset_address].keys()) == 0:
+            no_data += 1
 
-with open("/Users/yegortrussov/Documents/ml/lending_protocols/dataset_collection/data/common/assets_meta.json", 'w') as f:
-    json.dump(all_assets_data, f, indent=4)
+    with open(f"{COMMON_PATH}/assets_meta.json", 'w') as f:
+        json.dump(all_assets_data, f, indent=4)
 
-print("SKIPPED", no_data)
\ No newline at end of file
+    print("SKIPPED", no_data)
@@ -6,6 +6,8 @@ import pandas as pd
 from datetime import datetime, timedelta
 import time
 
+from manifest import record_file
+
 BATCH_SIZE = 100
 MORPHO_GRAPHQL_API = "https://api.morpho.org/graphql"
 MARKETS_HASHES = {
@@ -70,6 +72,7 @@ def get_result_df(result, market):
         "user_address": [],
         "assets": [],
         "assets_usd": [],
+        "shares": [],
         "liquidated_assets": [],
         "liquidated_assets_usd": [],
     })
@@ -82,6 +85,7 @@ def get_result_df(result, market):
                 "user_address": transaction["user"]["address"],
                 "assets": transaction["data"]["repaidAssets"],
                 "assets_usd": transaction["data"]["repaidAssetsUsd"],
+                "shares": transaction["data"].get("repaidShares"),
                 "liquidated_assets": transaction["data"]["seizedAssets"],
                 "liquidated_assets_usd": transaction["data"]["seizedAssetsUsd"],
                 
@@ -94,6 +98,8 @@ def get_result_df(result, market):
                 "user_address": transaction["user"]["address"],
                 "assets": transaction["data"]["assets"],
                 "assets_usd": transaction["data"]["assetsUsd"],
+                # collateral transfers have no shares
+                "shares": transaction["data"].get("shares"),
                 "liquidated_assets": 0,
                 "liquidated_assets_usd": 0,
             }
@@ -159,6 +165,7 @@ def process_date_range(start_date_str, end_date_str, market, csv_file_path):
             combined_df['datetime'] = pd.to_datetime(combined_df['timestamp'], unit='s').dt.strftime('%Y-%m-%d %H:%M:%S')
             combined_df["market_address"] = MARKETS_HASHES[market]
             combined_df.to_csv(csv_file_path, index=False)
+            record_file(csv_file_path, combined_df)
             print(f"Saved CHECKPOINT {len(combined_df)} total events to {csv_file_path}")
 
     print(f"  {current_start.strftime('%Y-%m-%d')}: {len(daily_df)} events in {pages} pages")
@@ -169,6 +176,7 @@ def process_date_range(start_date_str, end_date_str, market, csv_file_path):
         combined_df['datetime'] = pd.to_datetime(combined_df['timestamp'], unit='s').dt.strftime('%Y-%m-%d %H:%M:%S')
         combined_df["market_address"] = MARKETS_HASHES[market]
         combined_df.to_csv(csv_file_path, index=False)
+        record_file(csv_file_path, combined_df)
         print(f"Saved {len(combined_df)} total events to {csv_file_path}")
         return combined_df
     
@@ -0,0 +1,147 @@
+"""
+Dense market x hour x feature panel built from markets_hourly_data/{market}.csv.
+
+    build_hourly_panel(["eth_wbtc_usdc", "eth_cbbtc_usdc"])
+    panel = load_hourly_panel()
+    util = panel.feature("utilization")                 # (markets, hours)
+    x = panel.sel(markets=["eth_wbtc_usdc"], features=["utilization", "borrow_rate"])
+
+The array lives in a .npy file opened as a memory map, so only the slices
+that are touched are read from disk. Hours missing for a market (before its
+creation / after the last event) are NaN.
+"""
+import os
+import json
+import numpy as np
+import pandas as pd
+
+from config import DATA_PATH
+
+HOURLY_PATH = DATA_PATH + "/markets_hourly_data"
+PANEL_PATH = DATA_PATH + "/hourly_panel"
+
+PANEL_FEATURES = [
+    "utilization",
+    "borrow_rate",
+    "supply_rate",
+    "borrow_rate_rolling",
+    "supply_rate_rolling",
+    "total_supply",
+    "total_borrow",
+    "collateral_price",
+    "loan_asset_price",
+    "asset_price",
+    "volatility_1h",
+    "volatility_6h",
+    "drawdown_1h",
+    "drawdown_6h",
+    "avg_health_factor",
+]
+
+HOUR = 3600
+
+
+class HourlyPanel:
+    def __init__(self, values, markets, hours, features):
+        self.values = values
+        self.markets = list(markets)
+        self.hours = np.asarray(hours)
+        self.features = list(features)
+        self.market_index = {m: i for i, m in enumerate(self.markets)}
+        self.feature_index = {f: i for i, f in enumerate(self.features)}
+
+    @property
+    def shape(self):
+        return self.values.shape
+
+    def hour_slice(self, start=None, end=None):
+        """Slice of the hour axis for timestamps in [start, end)."""
+        lo = 0 if start is None else np.searchsorted(self.hours, start, side="left")
+        hi = len(self.hours) if end is None else np.searchsorted(self.hours, end, side="left")
+        return slice(lo, hi)
+
+    def market(self, name):
+        return self.values[self.market_index[name]]
+
+    def feature(self, name):
+        return self.values[:, :, self.feature_index[name]]
+
+    def sel(self, markets=None, features=None, start=None, end=None):
+        m_idx = slice(None) if markets is None else [self.market_index[m] for m in markets]
+        f_idx = slice(None) if features is None else [self.feature_index[f] for f in features]
+        h_idx = self.hour_slice(start, end)
+        # numpy does not allow two fancy indexes in one call
+        res = self.values[:, h_idx]
+        res = res[m_idx]
+        return res[:, :, f_idx]
+
+    def to_frame(self, market, features=None, dropna=True):
+        features = self.features if features is None else features
+        df = pd.DataFrame(
+            self.sel(markets=[market], features=features)[0],
+            columns=features,
+        )
+        df.insert(0, "timestamp", self.hours)
+        if dropna:
+            df = df.dropna(how="all", subset=features)
+        return df
+
+
+def build_hourly_panel(markets, hourly_path=HOURLY_PATH, panel_path=PANEL_PATH, features=PANEL_FEATURES, dtype=np.float32):
+    os.makedirs(panel_path, exist_ok=True)
+
+    # First pass only reads timestamps to get the common hour axis
+    ranges = {}
+    for market in markets:
+        file_path = f"{hourly_path}/{market}.csv"
+        if not os.path.exists(file_path):
+            print(f"No hourly data for {market}, skipping")
+            continue
+        ts = pd.read_csv(file_path, usecols=["timestamp"])["timestamp"]
+        if len(ts) == 0:
+            continue
+        ranges[market] = (int(ts.min()), int(ts.max()))
+
+    markets = list(ranges.keys())
+    if not markets:
+        raise ValueError("No hourly data found for the given markets")
+    start = min(r[0] for r in ranges.values()) // HOUR * HOUR
+    end = max(r[1] for r in ranges.values()) // HOUR * HOUR
+    hours = np.arange(start, end + HOUR, HOUR, dtype=np.int64)
+
+    values = np.lib.format.open_memmap(
+        os.path.join(panel_path, "panel.npy"),
+        mode="w+",
+        dtype=dtype,
+        shape=(len(markets), len(hours), len(features)),
+    )
+    values[:] = np.nan
+
+    for i, market in enumerate(markets):
+        df = pd.read_csv(f"{hourly_path}/{market}.csv")
+        pos = (df["timestamp"].to_numpy(dtype=np.int64) - start) // HOUR
+        for j, feature in enumerate(features):
+            if feature in df.columns:
+                values[i, pos, j] = df[feature].to_numpy(dtype=np.float64)
+        print(f"{market}: {len(df)} hours")
+
+    values.flush()
+    with open(os.path.join(panel_path, "index.json"), "w") as f:
+        json.dump({
+            "markets": markets,
+            "hours_start": int(start),
+            "hours_step": HOUR,
+            "n_hours": len(hours),
+            "features": list(features),
+        }, f, indent=4)
+
+    print(f"Panel {values.shape} saved to {panel_path}")
+    return HourlyPanel(values, markets, hours, features)
+
+
+def load_hourly_panel(panel_path=PANEL_PATH, mode="r"):
+    with open(os.path.join(panel_path, "index.json"), "r") as f:
+        index = json.load(f)
+    values = np.load(os.path.join(panel_path, "panel.npy"), mmap_mode=mode)
+    hours = index["hours_start"] + index["hours_step"] * np.arange(index["n_hours"], dtype=np.int64)
+    return HourlyPanel(values, index["markets"], hours, index["features"])
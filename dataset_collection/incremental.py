@@ -0,0 +1,163 @@
+"""
+Persisted enrichment state and append-only CSV outputs.
+
+After every build of a market the state needed to continue it is stored in
+data/enrichment_state/{market}.json:
+
+    raw_bytes, raw_sha256           how much of the raw csv was consumed
+    fingerprint                     params + code the outputs were built with
+    last_timestamp, total_supply,
+    total_borrow                    market totals after the last event
+    users                           {user: [collateral, debt, supply, n_events]}
+    enriched_offset                 byte offset of the first enriched row that is
+                                    re-read as context (and rewritten) next time
+    rollups                         {resolution: {"context_offset", "cut_offset"}}
+
+so that new raw events appended to markets_raw/{market}.csv can be
+enriched on their own and appended to the outputs. Rows from the context
+offsets on are rewritten, everything before them is left untouched.
+
+The same mechanism streams a big raw file: chunk_ends splits it into byte
+ranges that end between two timestamps and every range is enriched as if
+it had just been appended.
+"""
+import io
+import os
+import csv
+import json
+import hashlib
+import numpy as np
+import pandas as pd
+
+from config import DATA_PATH
+
+STATE_PATH = DATA_PATH + "/enrichment_state"
+
+
+def state_file(name, state_path=STATE_PATH):
+    return f"{state_path}/{name}.json"
+
+
+def load_state(name, state_path=STATE_PATH):
+    path = state_file(name, state_path)
+    if not os.path.exists(path):
+        return None
+    with open(path, "r") as f:
+        return json.load(f)
+
+
+def save_state(name, state, state_path=STATE_PATH):
+    os.makedirs(state_path, exist_ok=True)
+    path = state_file(name, state_path)
+    tmp_path = path + ".tmp"
+    with open(tmp_path, "w") as f:
+        json.dump(state, f)
+    os.replace(tmp_path, path)
+
+
+def sha256_update(h, path, start, end, chunk_size=1 << 20):
+    """Feed the bytes of a file between [start, end) to the hash object h."""
+    with open(path, "rb") as f:
+        f.seek(start)
+        while start < end:
+            chunk = f.read(min(chunk_size, end - start))
+            if not chunk:
+                break
+            h.update(chunk)
+            start += len(chunk)
+    return h
+
+
+def raw_prefix_hash(path, state):
+    """
+    sha256 object over the raw bytes consumed by state if none of them was
+    rewritten, None otherwise. It is kept updated with the bytes consumed
+    next so the whole file is hashed once per run.
+    """
+    if "raw_sha256" not in state or os.path.getsize(path) < state["raw_bytes"]:
+        return None
+    h = sha256_update(hashlib.sha256(), path, 0, state["raw_bytes"])
+    return h if h.hexdigest() == state["raw_sha256"] else None
+
+
+def read_csv_from(path, offset, end=None, **kwargs):
+    """Rows of a csv between byte offsets [offset, end), parsed with the file header."""
+    with open(path, "rb") as f:
+        header = f.readline()
+        offset = max(offset, len(header))
+        f.seek(offset)
+        data = f.read() if end is None else f.read(end - offset)
+    return pd.read_csv(io.BytesIO(header + data), **kwargs)
+
+
+def write_rows(path, df, offset=None):
+    """
+    Write df to a csv, either as a new file (offset=None) or replacing
+    everything from byte `offset` on. Returns the byte offset of every row.
+    """
+    if offset is None:
+        header = df.iloc[:0].to_csv(index=False).encode()
+        body = df.to_csv(index=False, header=False).encode()
+        mode = "wb"
+        start = len(header)
+    else:
+        header = b""
+        body = df.to_csv(index=False, header=False).encode()
+        mode = "r+b"
+        start = offset
+
+    lengths = np.fromiter((len(line) for line in body.splitlines(keepends=True)), dtype=np.int64, count=len(df))
+    offsets = start + np.concatenate([[0], np.cumsum(lengths)[:-1]]) if len(df) else np.zeros(0, dtype=np.int64)
+
+    os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+    with open(path, mode) as f:
+        if offset is None:
+            f.write(header)
+        else:
+            f.seek(offset)
+            f.truncate()
+        f.write(body)
+    return offsets
+
+
+def context_start(timestamps, last_timestamp, window):
+    """Index of the last row with timestamp <= last_timestamp - window (0 if there is none)."""
+    return max(int(np.searchsorted(timestamps, last_timestamp - window, side="right")) - 1, 0)
+
+
+def _field(line, column):
+    return next(csv.reader([line.decode()]))[column]
+
+
+def chunk_ends(path, start, end, chunk_bytes, column="timestamp"):
+    """
+    Byte offsets splitting the rows of a time ordered csv between [start, end)
+    into chunks of about chunk_bytes, each ending on a line boundary where
+    the timestamp changes (a timestamp never spans two chunks). The last
+    offset is `end`.
+    """
+    ends = []
+    with open(path, "rb") as f:
+        header = f.readline()
+        col = next(csv.reader([header.decode()])).index(column)
+        pos = max(start, len(header))
+        while chunk_bytes and pos + chunk_bytes < end:
+            f.seek(pos + chunk_bytes - 1)
+            f.readline()
+            line_start = f.tell()
+            line = f.readline()
+            if not line or line_start >= end:
+                break
+            timestamp = _field(line, col)
+            # move on to the first row of the next timestamp
+            while True:
+                boundary = f.tell()
+                line = f.readline()
+                if not line or boundary >= end or _field(line, col) != timestamp:
+                    break
+            if boundary >= end:
+                break
+            ends.append(boundary)
+            pos = boundary
+    ends.append(end)
+    return ends
@@ -0,0 +1,73 @@
+"""
+Closed form Morpho AdaptiveCurveIRM.
+
+    borrow_rate(u) = rate_at_target * curve(u)
+    supply_rate(u) = borrow_rate(u) * u * (1 - fee)
+
+with curve(u) = (1 - 1/KD) * e + 1 below the target utilization and
+(KD - 1) * e + 1 above it, e being the normalized distance to the target.
+Rates are returned as APR fractions, the same values the former 101 point
+[util%, borrow, supply] lookup tables were sampling.
+"""
+import numpy as np
+
+from jit import njit
+
+SECONDS_PER_YEAR = 365 * 86400
+TARGET_UTILIZATION = 0.9
+KD = 4.0
+
+
+def rate_at_target_history(market_meta, fee=0.0):
+    """market_meta["rate_at_target"] ({timestamp: wad per second}) -> (timestamps, rate per second, fee)."""
+    rate_dict = market_meta.get('rate_at_target', {}) or {}
+    items = sorted((int(ts), rate_wad) for ts, rate_wad in rate_dict.items() if rate_wad is not None)
+    timestamps = np.array([ts for ts, _ in items], dtype=np.int64)
+    rates = np.array([rate_wad for _, rate_wad in items], dtype=np.float64) / 1e18
+    return timestamps, rates, fee
+
+
+def curve_multiplier(utilization):
+    u = np.asarray(utilization, dtype=np.float64)
+    below = u <= TARGET_UTILIZATION
+    e = np.where(
+        below,
+        (u - TARGET_UTILIZATION) / TARGET_UTILIZATION,
+        (u - TARGET_UTILIZATION) / (1 - TARGET_UTILIZATION),
+    )
+    return np.where(below, (1 - 1 / KD) * e + 1, (KD - 1) * e + 1)
+
+
+def adaptive_curve_rates(rate_at_target, utilization, fee=0.0):
+    """Borrow / supply APR for rate_at_target (per second) and utilization arrays."""
+    u = np.clip(np.nan_to_num(np.asarray(utilization, dtype=np.float64), nan=0.0), 0, 1)
+    borrow = np.asarray(rate_at_target, dtype=np.float64) * curve_multiplier(u) * SECONDS_PER_YEAR
+    supply = borrow * u * (1 - fee)
+    return borrow, supply
+
+
+def rates_at(timestamps, utilization, irm_history):
+    """
+    Rates at arbitrary (timestamp, utilization) points, using the last
+    rate_at_target with timestamp <= the point (the earliest one before
+    the history starts). Memory is O(#timestamps).
+    """
+    hist_ts, hist_rates, fee = irm_history
+    timestamps = np.asarray(timestamps)
+    if len(hist_ts) == 0 or len(timestamps) == 0:
+        return np.zeros(len(timestamps)), np.zeros(len(timestamps))
+    pos = np.maximum(np.searchsorted(hist_ts, timestamps, side='right') - 1, 0)
+    return adaptive_curve_rates(hist_rates[pos], utilization, fee)
+
+
+@njit(cache=True)
+def adaptive_curve_rates_scalar(rate_at_target, utilization, fee):
+    # Scalar version for the accrual kernel, utilization is already clipped
+    if utilization <= TARGET_UTILIZATION:
+        e = (utilization - TARGET_UTILIZATION) / TARGET_UTILIZATION
+        curve = (1 - 1 / KD) * e + 1
+    else:
+        e = (utilization - TARGET_UTILIZATION) / (1 - TARGET_UTILIZATION)
+        curve = (KD - 1) * e + 1
+    borrow = rate_at_target * curve * SECONDS_PER_YEAR
+    return borrow, borrow * utilization * (1 - fee)
@@ -0,0 +1,16 @@
+"""
+numba.njit when numba is installed, a no-op decorator otherwise, so the
+array kernels also run (slower) as plain python.
+
+    from jit import njit, NUMBA
+"""
+try:
+    from numba import njit
+    NUMBA = True
+except ImportError:
+    NUMBA = False
+
+    def njit(*args, **kwargs):
+        if len(args) == 1 and callable(args[0]):
+            return args[0]
+        return lambda f: f
@@ -0,0 +1,200 @@
+"""
+Index of the raw and enriched market files, data/manifest.json:
+
+    {"markets_raw/eth_wbtc_usdc.csv": {
+        "market_address", "rows", "min_timestamp", "max_timestamp",
+        "bytes", "mtime_ns", "sha256", "indexed_at"}, ...}
+
+Keys are relative to the directory of the manifest: DATA_PATH for the
+default one, data/benchmarks for the synthetic benchmark markets. The
+writers of these files call record_file right after writing, with the
+frame they wrote, so only the bytes are re-read (for the row count and
+checksum) and never parsed. An entry is fresh while the size and mtime of
+its file match, readers take fresh entries as they are and index files
+without one from scratch:
+
+    entry(raw_file)["market_address"]
+    files(RAW_PATH)                     # {path: entry} of every csv in a directory
+
+BuildCache reuses the checksums of fresh entries instead of hashing the
+files again.
+
+    python manifest.py              # entries of the raw and enriched files
+    python manifest.py --rebuild    # index every file again
+"""
+import os
+import sys
+import json
+import time
+import hashlib
+from contextlib import contextmanager
+
+import pandas as pd
+
+try:
+    import fcntl
+except ImportError:
+    fcntl = None
+
+from config import DATA_PATH
+
+MANIFEST_FILE = DATA_PATH + "/manifest.json"
+RAW_PATH = DATA_PATH + "/markets_raw"
+ENRICHED_PATH = DATA_PATH + "/markets_enriched"
+
+
+def _key(path, manifest_path=MANIFEST_FILE):
+    path = os.path.abspath(path)
+    base = os.path.dirname(os.path.abspath(manifest_path))
+    if path.startswith(base + os.sep):
+        return os.path.relpath(path, base)
+    return path
+
+
+@contextmanager
+def _locked(manifest_path):
+    # market workers run in several processes and all update the same file
+    os.makedirs(os.path.dirname(manifest_path), exist_ok=True)
+    with open(manifest_path + ".lock", "w") as lock:
+        if fcntl is not None:
+            fcntl.flock(lock, fcntl.LOCK_EX)
+        try:
+            yield
+        finally:
+            if fcntl is not None:
+                fcntl.flock(lock, fcntl.LOCK_UN)
+
+
+def load_manifest(manifest_path=MANIFEST_FILE):
+    if not os.path.exists(manifest_path):
+        return {}
+    with open(manifest_path, "r") as f:
+        return json.load(f)
+
+
+def _save(manifest, manifest_path):
+    tmp_path = f"{manifest_path}.{os.getpid()}.tmp"
+    with open(tmp_path, "w") as f:
+        json.dump(manifest, f, indent=2, sort_keys=True)
+    os.replace(tmp_path, manifest_path)
+
+
+def scan_file(path, chunk_size=1 << 20):
+    """(rows, sha256) of a csv in one pass over its bytes, the header is not counted."""
+    h = hashlib.sha256()
+    lines = 0
+    last = b"\n"
+    with open(path, "rb") as f:
+        while True:
+            chunk = f.read(chunk_size)
+            if not chunk:
+                break
+            h.update(chunk)
+            lines += chunk.count(b"\n")
+            last = chunk[-1:]
+    if last != b"\n":
+        lines += 1
+    return max(lines - 1, 0), h.hexdigest()
+
+
+def _timestamp_range(df):
+    if df is None or "timestamp" not in df.columns or df.empty:
+        return None, None
+    return int(df["timestamp"].min()), int(df["timestamp"].max())
+
+
+def file_entry(path, df=None, market_address=None, previous=None):
+    """
+    Manifest entry of a csv. df is what was written to it: the whole file,
+    or the rows written after the `previous` entry's rows. Without df the
+    address and timestamp columns are read from the file.
+    """
+    stat = os.stat(path)
+    if df is None:
+        df = pd.read_csv(path, usecols=lambda c: c in ("market_address", "timestamp"))
+        previous = None
+    rows, digest = scan_file(path)
+    min_ts, max_ts = _timestamp_range(df)
+    if previous is not None:
+        mins = [x for x in (min_ts, previous["min_timestamp"]) if x is not None]
+        maxs = [x for x in (max_ts, previous["max_timestamp"]) if x is not None]
+        min_ts = min(mins) if mins else None
+        max_ts = max(maxs) if maxs else None
+        market_address = market_address or previous.get("market_address")
+    if market_address is None and "market_address" in df.columns and not df.empty:
+        market_address = df["market_address"].iloc[0]
+    return {
+        "market_address": market_address,
+        "rows": rows,
+        "min_timestamp": min_ts,
+        "max_timestamp": max_ts,
+        "bytes": stat.st_size,
+        "mtime_ns": stat.st_mtime_ns,
+        "sha256": digest,
+        "indexed_at": int(time.time()),
+    }
+
+
+def record_file(path, df=None, market_address=None, append=False, manifest_path=MANIFEST_FILE):
+    """
+    Update the entry of a csv that was just written. df is the frame that
+    was written, with append=True only the rows written after the ones the
+    stored entry describes. Returns the entry.
+    """
+    with _locked(manifest_path):
+        manifest = load_manifest(manifest_path)
+        previous = manifest.get(_key(path, manifest_path)) if append else None
+        if append and previous is None:
+            # nothing to add the new rows to, index the whole file
+            df = None
+        manifest[_key(path, manifest_path)] = entry = file_entry(path, df, market_address, previous)
+        _save(manifest, manifest_path)
+    return entry
+
+
+def is_fresh(path, entry):
+    if entry is None or not os.path.exists(path):
+        return False
+    stat = os.stat(path)
+    return entry["bytes"] == stat.st_size and entry["mtime_ns"] == stat.st_mtime_ns
+
+
+def fresh_entry(path, manifest=None, manifest_path=MANIFEST_FILE):
+    """Entry of path if it still describes the file, None otherwise."""
+    manifest = load_manifest(manifest_path) if manifest is None else manifest
+    entry = manifest.get(_key(path, manifest_path))
+    return entry if is_fresh(path, entry) else None
+
+
+def entry(path, manifest=None, manifest_path=MANIFEST_FILE):
+    """Fresh entry of path, the file is indexed if it has none."""
+    found = fresh_entry(path, manifest, manifest_path)
+    if found is not None:
+        return found
+    print(f"indexing {_key(path, manifest_path)}")
+    return record_file(path, manifest_path=manifest_path)
+
+
+def files(directory, manifest_path=MANIFEST_FILE):
+    """{path: fresh entry} of every csv in directory, files without one are indexed."""
+    manifest = load_manifest(manifest_path)
+    return {
+        f"{directory}/{file}": entry(f"{directory}/{file}", manifest, manifest_path)
+        for file in sorted(os.listdir(directory)) if file.endswith(".csv")
+    }
+
+
+if __name__ == "__main__":
+    if "--rebuild" in sys.argv:
+        for directory in [RAW_PATH, ENRICHED_PATH]:
+            for file in sorted(os.listdir(directory)):
+                if file.endswith(".csv"):
+                    print(f"indexing {file}")
+                    record_file(f"{directory}/{file}")
+
+    manifest = load_manifest()
+    print(f"{'file':60s} {'rows':>10s} {'MB':>9s} {'min_timestamp':>20s} {'max_timestamp':>20s} fresh")
+    for key, e in sorted(manifest.items()):
+        path = key if os.path.isabs(key) else f"{DATA_PATH}/{key}"
+        span = [pd.to_datetime(x, unit="s").strftime("%Y-%m-%d %H:%M") if x is not None else "" for x in (e["min_timestamp"], e["max_timestamp"])]
+        print(f"{key:60s} {e['rows']:10d} {e['bytes'] / 2**20:9.1f} {span[0]:>20s} {span[1]:>20s} {is_fresh(path, e)}")
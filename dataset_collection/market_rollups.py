@@ -0,0 +1,171 @@
+"""
+Market state time series at several resolutions built from enriched events.
+
+    rollups = create_market_rollups(enriched_df, asset_meta)
+    rollups["hourly"]   # same columns as markets_hourly_data/{market}.csv
+    rollups["5min"], rollups["daily"]
+
+Every row at grid timestamp T holds
+    - the market state after the last event with timestamp <= T (last value),
+    - utilization_mean: time-weighted mean utilization over (T - freq, T],
+    - utilization_open / high / low / close over the same bucket, open being
+      the close of the previous bucket,
+    - n_events in the bucket.
+The events are sorted once; all resolutions are gathered from the same
+arrays with searchsorted + take.
+"""
+import numpy as np
+import pandas as pd
+
+from rolling import SparseTable
+
+ROLLUP_RESOLUTIONS = {
+    "5min": 5 * 60,
+    "hourly": 3600,
+    "daily": 86400,
+}
+
+# output column -> enriched events column
+LAST_VALUE_COLUMNS = {
+    'total_supply': 'total_supply_after',
+    'total_borrow': 'total_borrow_after',
+    'utilization': 'utilization_after',
+    'borrow_rate': 'borrow_rate_after',
+    'supply_rate': 'supply_rate_after',
+    'volatility_1h': 'volatility_1h',
+    'drawdown_1h': 'drawdown_1h',
+    'volatility_6h': 'volatility_6h',
+    'drawdown_6h': 'drawdown_6h',
+    'collateral_price': 'collateral_price',
+    'loan_asset_price': 'loan_asset_price',
+    'avg_health_factor': 'health_factor_after',
+}
+
+UTILIZATION_COLUMNS = [
+    'utilization_mean',
+    'utilization_open',
+    'utilization_high',
+    'utilization_low',
+    'utilization_close',
+    'n_events',
+]
+
+
+def time_grid(events_ts, freq):
+    """Grid of multiples of freq covering the events, plus one extra step."""
+    start = (events_ts.min() // freq) * freq
+    end = ((events_ts.max() // freq) + 1) * freq
+    return np.arange(start, end + freq, freq)
+
+
+def _gather(df_sorted, events_ts, util, util_area, util_table, grid, freq):
+    # last event with timestamp <= grid point
+    idx = np.searchsorted(events_ts, grid, side='right') - 1
+    has_event = idx >= 0
+    take = np.maximum(idx, 0)
+
+    result_df = pd.DataFrame({
+        'timestamp': grid,
+        'datetime': pd.to_datetime(grid, unit='s'),
+    })
+    for col, source in LAST_VALUE_COLUMNS.items():
+        if source in df_sorted.columns:
+            values = df_sorted[source].to_numpy()[take]
+            result_df[col] = np.where(has_event, values, 0)
+        else:
+            result_df[col] = 0
+
+    # utilization is a step function of time, 0 before the first event
+    close = np.where(has_event, util[take], 0.0)
+    area = np.where(has_event, util_area[take] + util[take] * (grid - events_ts[take]), 0.0)
+    prev_idx = np.searchsorted(events_ts, grid - freq, side='right') - 1
+    prev_take = np.maximum(prev_idx, 0)
+    open_ = np.where(prev_idx >= 0, util[prev_take], 0.0)
+    prev_area = np.where(
+        prev_idx >= 0,
+        util_area[prev_take] + util[prev_take] * (grid - freq - events_ts[prev_take]),
+        0.0,
+    )
+    lo = prev_idx + 1
+    hi = idx + 1
+
+    result_df['utilization_mean'] = (area - prev_area) / freq
+    result_df['utilization_open'] = open_
+    result_df['utilization_high'] = np.fmax(open_, util_table[0].query(lo, hi))
+    result_df['utilization_low'] = np.fmin(open_, util_table[1].query(lo, hi))
+    result_df['utilization_close'] = close
+    result_df['n_events'] = hi - lo
+    return result_df
+
+
+def _finalize(result_df, asset_meta, context=None):
+    """
+    Forward fill, rolling rates and asset price. context are the previous
+    rows of an existing rollup, used for the fills and windows and dropped.
+    """
+    n_context = 0 if context is None else len(context)
+    if n_context:
+        result_df = pd.concat([context, result_df], ignore_index=True)
+    base = ['timestamp', 'datetime'] + list(LAST_VALUE_COLUMNS)
+    result_df[base] = result_df[base].ffill().fillna(0)
+
+    result_df['borrow_rate_rolling'] = result_df['borrow_rate'].rolling(6, min_periods=1).mean()
+    result_df['supply_rate_rolling'] = result_df['supply_rate'].rolling(6, min_periods=1).mean()
+
+    if 'historical_price' in asset_meta and asset_meta['historical_price']:
+        price_df = pd.DataFrame(asset_meta['historical_price'], columns=['timestamp', 'price'])
+        price_df = price_df.dropna()
+        if not price_df.empty:
+            result_df = result_df.merge(price_df, on='timestamp', how='left')
+            price = result_df['price']
+            if 'asset_price' in result_df.columns:
+                price = price.where(result_df.index >= n_context, result_df['asset_price'])
+            result_df['asset_price'] = price.ffill().fillna(0)
+            result_df = result_df.drop(columns=['price'])
+
+    # keep the columns of the former hourly dataset first
+    columns = [c for c in result_df.columns if c not in UTILIZATION_COLUMNS]
+    columns += [c for c in UTILIZATION_COLUMNS if c in result_df.columns]
+    return result_df[columns].iloc[n_context:].reset_index(drop=True)
+
+
+def _prepare_events(df):
+    df_sorted = df.sort_values('timestamp', kind='stable')
+    events_ts = df_sorted['timestamp'].to_numpy()
+    util = np.nan_to_num(df_sorted['utilization_after'].to_numpy(dtype=np.float64), nan=0.0)
+    # integral of the utilization step function up to every event
+    util_area = np.concatenate([[0.0], np.cumsum(util[:-1] * np.diff(events_ts))])
+    util_table = (SparseTable(util, np.maximum), SparseTable(util, np.minimum))
+    return df_sorted, events_ts, util, util_area, util_table
+
+
+def create_market_rollups(df, asset_meta, resolutions=None):
+    """{resolution name: frame} for resolutions ({name: seconds}, ROLLUP_RESOLUTIONS by default)."""
+    resolutions = ROLLUP_RESOLUTIONS if resolutions is None else resolutions
+    df_sorted, events_ts, util, util_area, util_table = _prepare_events(df)
+
+    rollups = {}
+    for name, freq in resolutions.items():
+        grid = time_grid(events_ts, freq)
+        result_df = _gather(df_sorted, events_ts, util, util_area, util_table, grid, freq)
+        rollups[name] = _finalize(result_df, asset_meta)
+    return rollups
+
+
+def append_market_rollups(df, asset_meta, after_timestamp, contexts, resolutions=None):
+    """
+    Rollup rows with timestamp > after_timestamp for appending to existing
+    rollups. df must hold every event after after_timestamp - max(freq)
+    and the last event before that; contexts ({name: frame}) are the last
+    existing rows of every rollup with timestamp <= after_timestamp.
+    """
+    resolutions = ROLLUP_RESOLUTIONS if resolutions is None else resolutions
+    df_sorted, events_ts, util, util_area, util_table = _prepare_events(df)
+
+    rollups = {}
+    for name, freq in resolutions.items():
+        grid = time_grid(events_ts, freq)
+        grid = grid[grid > after_timestamp]
+        result_df = _gather(df_sorted, events_ts, util, util_area, util_table, grid, freq)
+        rollups[name] = _finalize(result_df, asset_meta, contexts.get(name))
+    return rollups
@@ -0,0 +1,128 @@
+"""
+Per key access to the market, asset and vault metadata.
+
+markets_meta.json, assets_meta.json and vaults_meta.json stay the source
+of truth, but loading them takes seconds: assets carry their full price
+history. Their entries are indexed in common/metadata.sqlite, one row per
+key, and a lookup only parses that entry:
+
+    store = MetadataStore()
+    store.markets["0x3a85..."]          # one market, KeyError if unknown
+    store.assets.get(address)
+    sorted(store.vaults)                # keys only, no entry is parsed
+
+markets / assets / vaults are read-only mappings, so they can stand in for
+the loaded dicts. A table is re-indexed from its json the first time it is
+used after the json changed (size or mtime), in the process that notices;
+writers that already hold the new content call reindex instead.
+
+    python metadata.py              # index the jsons now
+"""
+import os
+import json
+import sqlite3
+import threading
+from contextlib import closing
+from collections.abc import Mapping
+
+from config import COMMON_PATH
+
+SOURCES = {
+    "markets": "markets_meta.json",
+    "assets": "assets_meta.json",
+    "vaults": "vaults_meta.json",
+}
+
+
+class MetadataTable(Mapping):
+    def __init__(self, store, kind):
+        self.store = store
+        self.kind = kind
+
+    def __getitem__(self, key):
+        with self.store.connect(self.kind) as con:
+            row = con.execute("SELECT value FROM meta WHERE kind = ? AND key = ?", (self.kind, key)).fetchone()
+        if row is None:
+            raise KeyError(key)
+        return json.loads(row[0])
+
+    def __contains__(self, key):
+        with self.store.connect(self.kind) as con:
+            return con.execute("SELECT 1 FROM meta WHERE kind = ? AND key = ?", (self.kind, key)).fetchone() is not None
+
+    def keys(self):
+        with self.store.connect(self.kind) as con:
+            return [row[0] for row in con.execute("SELECT key FROM meta WHERE kind = ? ORDER BY rowid", (self.kind,))]
+
+    def __iter__(self):
+        return iter(self.keys())
+
+    def __len__(self):
+        with self.store.connect(self.kind) as con:
+            return con.execute("SELECT COUNT(*) FROM meta WHERE kind = ?", (self.kind,)).fetchone()[0]
+
+
+class MetadataStore:
+    def __init__(self, common_path=COMMON_PATH, index_path=None):
+        self.common_path = common_path
+        self.index_path = index_path or f"{common_path}/metadata.sqlite"
+        self.markets = MetadataTable(self, "markets")
+        self.assets = MetadataTable(self, "assets")
+        self.vaults = MetadataTable(self, "vaults")
+        self._checked = {}
+        # pipeline threads share a store, only one of them re-indexes
+        self._lock = threading.Lock()
+
+    def source(self, kind):
+        return f"{self.common_path}/{SOURCES[kind]}"
+
+    def _source_stat(self, kind):
+        if not os.path.exists(self.source(kind)):
+            return [0, 0]
+        stat = os.stat(self.source(kind))
+        return [stat.st_size, stat.st_mtime_ns]
+
+    def _connect(self):
+        con = sqlite3.connect(self.index_path, timeout=60)
+        con.execute("CREATE TABLE IF NOT EXISTS meta (kind TEXT, key TEXT, value TEXT, PRIMARY KEY (kind, key))")
+        con.execute("CREATE TABLE IF NOT EXISTS sources (kind TEXT PRIMARY KEY, size INTEGER, mtime_ns INTEGER)")
+        return con
+
+    def connect(self, kind):
+        """Connection to the index, with the table of kind up to date with its json."""
+        stat = self._source_stat(kind)
+        con = self._connect()
+        if self._checked.get(kind) != stat:
+            with self._lock:
+                row = con.execute("SELECT size, mtime_ns FROM sources WHERE kind = ?", (kind,)).fetchone()
+                if row is None or list(row) != stat:
+                    print(f"indexing {SOURCES[kind]}")
+                    data = {}
+                    if os.path.exists(self.source(kind)):
+                        with open(self.source(kind), "r") as f:
+                            data = json.load(f)
+                    self._write(con, kind, data, stat)
+                self._checked[kind] = stat
+        return closing(con)
+
+    def _write(self, con, kind, data, stat):
+        with con:
+            con.execute("DELETE FROM meta WHERE kind = ?", (kind,))
+            con.executemany(
+                "INSERT INTO meta (kind, key, value) VALUES (?, ?, ?)",
+                ((kind, key, json.dumps(value)) for key, value in data.items()),
+            )
+            con.execute("INSERT OR REPLACE INTO sources (kind, size, mtime_ns) VALUES (?, ?, ?)", (kind, *stat))
+
+    def reindex(self, kind, data):
+        """Index data as the current content of kind's json, after writing it."""
+        stat = self._source_stat(kind)
+        with closing(self._connect()) as con:
+            self._write(con, kind, data, stat)
+        self._checked[kind] = stat
+
+
+if __name__ == "__main__":
+    store = MetadataStore()
+    for kind in SOURCES:
+        print(kind, len(getattr(store, kind)))
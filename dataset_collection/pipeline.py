@@ -0,0 +1,469 @@
+"""
+collect_all_data.py stages as one in-process dependency graph.
+
+Per market the graph is
+
+    raw:{m}            fetch raw events -> markets_raw/{m}.csv
+    market_meta:{m}    market metadata (the stored one unless it is missing)
+    assets:{m}         loan and collateral asset prices, after market_meta:{m}
+    metrics:{m}        enriched events and rollups, after the three above
+    spikes:{m}         utilization spikes of the enriched events, after metrics:{m}
+    spikes_dataset     all_spikes_dataset.csv, after every spikes task
+    save_metadata      markets_meta.json and assets_meta.json, after every
+                       market_meta and assets task
+
+so the asset fetch of a market runs alongside its raw fetch and different
+markets do not wait for each other. Metadata goes from task to task in
+memory, an asset shared by several markets is fetched once. Enrichment
+and spike detection run in a process pool, fetches in threads. Both are
+skipped when BuildCache finds their outputs up to date with their inputs,
+so an unchanged market's spikes are not recomputed and a rebuilt market's
+are. Raw events still go through
+markets_raw/{m}.csv: enrich_market continues from the byte offsets of its
+stored state.
+
+    python pipeline.py                                     # refresh every tracked market
+    python pipeline.py --select "class=PT,min_borrow=5M" --stages raw market-metrics
+    python collect_all_data.py -pipeline -raw -market-metrics
+
+Markets come from markets_registry.csv (see registry.py for selectors) and
+are scheduled in registry order: priority, then the largest markets first,
+so the longest fetches and builds start early.
+
+Stages that are not selected read their outputs from disk instead. Every
+run writes the start / end of each task and the critical path (the chain of
+dependencies that ended last) to run_reports/pipeline.json.
+"""
+import os
+import json
+import time
+import threading
+import traceback
+import multiprocessing
+from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor, FIRST_COMPLETED, wait
+from datetime import datetime, timezone
+
+from tqdm import tqdm
+
+from profiling import REPORTS_PATH
+from metadata import MetadataStore
+from config import COMMON_PATH
+
+STAGES = ["raw", "markets", "assets", "market-metrics", "spikes"]
+RAW_START = "2022-01-01 00:00:00"
+RAW_END = "2027-02-01 00:00:00"
+
+
+def _timed(fn, kwargs):
+    start = time.time()
+    result = fn(**kwargs)
+    return result, start, time.time()
+
+
+def task_dependencies(tasks):
+    """{task name: names of the tasks it waits for}."""
+    names = {task["name"] for task in tasks}
+    deps = {}
+    for task in tasks:
+        deps[task["name"]] = set(task.get("after", []))
+        for source in task.get("inputs", {}).values():
+            deps[task["name"]] |= {source} if isinstance(source, str) else set(source)
+        unknown = deps[task["name"]] - names
+        if unknown:
+            raise ValueError(f"{task['name']} depends on unknown tasks {sorted(unknown)}")
+    return deps
+
+
+def run_graph(tasks, max_workers=8, limits=None):
+    """
+    Run tasks as soon as the tasks they depend on are done.
+
+        {"name": "assets:eth_wbtc_usdc",
+         "fn": fetch_assets,                       # called as fn(**kwargs, **inputs)
+         "kwargs": {...},
+         "inputs": {"market_meta": "market_meta:eth_wbtc_usdc"},   # argument -> task (or list of tasks)
+         "after": [...],                           # dependencies without passing their result
+         "group": "metrics"}                       # optional, see limits
+
+    Results are passed in memory. A task whose dependency failed is skipped.
+    Tasks are started in list order when several are ready. limits
+    ({group: n}) caps the running tasks of a group, a ready task of a full
+    group waits without taking a thread, so tasks that only wait for a
+    process pool can not starve the others.
+    Returns (status {name: "done" | "failed" | "skipped"}, results, timings
+    {name: (start, end)} in seconds since the epoch).
+    """
+    by_name = {task["name"]: task for task in tasks}
+    deps = task_dependencies(tasks)
+    limits = limits or {}
+    status, results, timings = {}, {}, {}
+    running = {}
+    progress = tqdm(total=len(tasks), desc="tasks")
+
+    def finish(name, st):
+        status[name] = st
+        progress.update(1)
+        progress.set_postfix(running=len(running), failed=sum(x != "done" for x in status.values()))
+
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        while len(status) < len(tasks):
+            n_done = len(status)
+            for name, task in by_name.items():
+                if name in status or name in running.values():
+                    continue
+                if any(d not in status for d in deps[name]):
+                    continue
+                if any(status[d] != "done" for d in deps[name]):
+                    finish(name, "skipped")
+                    print(f"[{name}] skipped, upstream failed")
+                    continue
+                group = task.get("group")
+                if group in limits and sum(by_name[n].get("group") == group for n in running.values()) >= limits[group]:
+                    continue
+                kwargs = dict(task.get("kwargs", {}))
+                for arg, source in task.get("inputs", {}).items():
+                    kwargs[arg] = results[source] if isinstance(source, str) else [results[s] for s in source]
+                running[executor.submit(_timed, task["fn"], kwargs)] = name
+
+            if not running:
+                if len(status) == n_done:
+                    pending = [n for n in by_name if n not in status]
+                    progress.close()
+                    raise ValueError(f"Dependency cycle between tasks: {pending}")
+                continue
+            done, _ = wait(list(running.keys()), return_when=FIRST_COMPLETED)
+            for future in done:
+                name = running.pop(future)
+                try:
+                    results[name], start, end = future.result()
+                    timings[name] = (start, end)
+                    finish(name, "done")
+                    print(f"[{name}] done in {end - start:.1f}s")
+                except Exception as e:
+                    traceback.print_exc()
+                    finish(name, "failed")
+                    print(f"[{name}] failed: {e!r}")
+    progress.close()
+    return status, results, timings
+
+
+def critical_path(deps, timings):
+    """
+    Chain of tasks that bounds the run: the task that ended last, the
+    dependency of it that ended last, and so on.
+    """
+    if not timings:
+        return []
+    name = max(timings, key=lambda n: timings[n][1])
+    path = [name]
+    while True:
+        upstream = [d for d in deps[name] if d in timings]
+        if not upstream:
+            break
+        name = max(upstream, key=lambda n: timings[n][1])
+        path.append(name)
+    return path[::-1]
+
+
+def timing_report(tasks, status, timings, started):
+    deps = task_dependencies(tasks)
+    ended = max([end for _, end in timings.values()], default=started)
+    busy = sum(end - start for start, end in timings.values())
+    path = critical_path(deps, timings)
+    path_records = []
+    prev_end = started
+    for name in path:
+        start, end = timings[name]
+        # wait: time between the dependency ending and the task starting (queueing for a worker)
+        path_records.append({"task": name, "wait_s": round(start - prev_end, 3), "wall_s": round(end - start, 3)})
+        prev_end = end
+    return {
+        "started_at": datetime.fromtimestamp(started, timezone.utc).isoformat(),
+        "wall_s": round(ended - started, 3),
+        "busy_s": round(busy, 3),
+        "parallelism": round(busy / (ended - started), 2) if ended > started else None,
+        "critical_path": path_records,
+        "tasks": {
+            name: {
+                "status": status.get(name),
+                "start_s": round(timings[name][0] - started, 3) if name in timings else None,
+                "wall_s": round(timings[name][1] - timings[name][0], 3) if name in timings else None,
+                "after": sorted(deps[name]),
+            }
+            for name in (task["name"] for task in tasks)
+        },
+    }
+
+
+def print_report(report):
+    print(f"\npipeline: {report['wall_s']:.1f}s wall, {report['busy_s']:.1f}s of task time, parallelism {report['parallelism']}")
+    print(f"{'critical path':45s} {'wait_s':>9s} {'wall_s':>9s}")
+    for r in report["critical_path"]:
+        print(f"{r['task']:45s} {r['wait_s']:9.2f} {r['wall_s']:9.2f}")
+    failed = [name for name, t in report["tasks"].items() if t["status"] != "done"]
+    if failed:
+        print("not done:", " ".join(failed))
+
+
+def save_report(report, path=None):
+    path = path or f"{REPORTS_PATH}/pipeline.json"
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    tmp_path = path + ".tmp"
+    with open(tmp_path, "w") as f:
+        json.dump(report, f, indent=2)
+    os.replace(tmp_path, path)
+    return path
+
+
+def _load_json(path):
+    if not os.path.exists(path):
+        return {}
+    with open(path, "r") as f:
+        return json.load(f)
+
+
+def fetch_raw(market, market_hash, csv_file_path):
+    from collect_all_data import process_date_range
+
+    df = process_date_range(RAW_START, RAW_END, market, csv_file_path, market_hash=market_hash)
+    return len(df)
+
+
+def load_market_meta(market_hash, markets_meta, fetch=True):
+    if fetch:
+        from common_data import fetch_markets_meta
+
+        markets_meta = fetch_markets_meta([market_hash], markets_meta)
+    if market_hash not in markets_meta:
+        raise KeyError(f"no metadata of market {market_hash}")
+    return markets_meta[market_hash]
+
+
+class AssetFetcher:
+    """Asset metadata fetched at most once per run, whichever market asks first."""
+
+    def __init__(self, assets_meta, fetch=True):
+        self.assets_meta = assets_meta
+        self.fetch = fetch
+        self.fetched = {}
+        self._locks = {}
+        self._lock = threading.Lock()
+
+    def get(self, address):
+        with self._lock:
+            lock = self._locks.setdefault(address, threading.Lock())
+        with lock:
+            if address in self.fetched:
+                return self.fetched[address]
+            data = {}
+            if self.fetch:
+                from get_assets_data import get_data_as_json
+
+                data = get_data_as_json(address)
+            # keep the stored prices if the fetch failed
+            data = data or self.assets_meta.get(address)
+            if not data:
+                raise KeyError(f"no metadata of asset {address}")
+            self.fetched[address] = data
+            return data
+
+
+def fetch_assets(market_meta, fetcher):
+    return {
+        address: fetcher.get(address)
+        for address in [market_meta["collateral_asset_address"], market_meta["loan_asset_address"]]
+    }
+
+
+def save_metadata(markets, assets):
+    markets_meta = _load_json(f"{COMMON_PATH}/markets_meta.json")
+    markets_meta.update({meta["address"]: meta for meta in markets})
+    assets_meta = _load_json(f"{COMMON_PATH}/assets_meta.json")
+    for market_assets in assets:
+        assets_meta.update(market_assets)
+    store = MetadataStore(COMMON_PATH)
+    for kind, data in [("markets", markets_meta), ("assets", assets_meta)]:
+        tmp_path = f"{store.source(kind)}.tmp"
+        with open(tmp_path, "w") as f:
+            json.dump(data, f, indent=4)
+        os.replace(tmp_path, store.source(kind))
+        store.reindex(kind, data)
+
+
+class MetricsBuilder:
+    """
+    enrich_market (build) and build_market_spikes (build_spikes) of a market
+    in a process pool, BuildCache bookkeeping here. Both wait for the pool, its tasks are run with at most `workers` at a
+    time (the pool size) so they never hold more threads than it has processes.
+    """
+
+    def __init__(self, executor, workers, vault_addresses, force=False, accounting="accrual", chunk_bytes=None, position_jobs=1):
+        from build_cache import BuildCache, local_imports
+        import compute_market_metrics_changes_df
+
+        self.executor = executor
+        self.workers = workers
+        self.vault_addresses = vault_addresses
+        self.force = force
+        self.accounting = accounting
+        self.chunk_bytes = chunk_bytes
+        self.position_jobs = position_jobs
+        self.code = local_imports(compute_market_metrics_changes_df.__file__)
+        self.cache = BuildCache()
+        self._lock = threading.Lock()
+
+    def build(self, market, market_meta, assets, raw=None):
+        from compute_market_metrics_changes_df import enrich_market, market_job
+
+        asset_meta = assets[market_meta["collateral_asset_address"]]
+        loan_asset_meta = assets[market_meta["loan_asset_address"]]
+        with self._lock:
+            job = market_job(
+                market, market_meta, asset_meta, loan_asset_meta, self.vault_addresses, self.code, self.cache,
+                force=self.force, accounting=self.accounting, chunk_bytes=self.chunk_bytes, n_jobs=self.position_jobs,
+            )
+        if job is None:
+            print(f"{market} is up to date, skipping")
+            return 0
+        n_events = self.executor.submit(enrich_market, *job["args"]).result()
+        with self._lock:
+            self.cache.record(*job["record"])
+            self.cache.save()
+        return n_events
+
+    def build_spikes(self, market):
+        from spikes_dataset import spikes_job, build_market_spikes
+
+        with self._lock:
+            job = spikes_job(market, self.cache, force=self.force)
+        if job is None:
+            print(f"{market} spikes are up to date, skipping")
+            return 0
+        n_spikes = self.executor.submit(build_market_spikes, market).result()
+        with self._lock:
+            self.cache.record(*job)
+            self.cache.save()
+        return n_spikes
+
+    def build_spikes_dataset(self):
+        from spikes_dataset import build_spikes_dataset
+
+        with self._lock:
+            rebuilt = build_spikes_dataset(self.cache, force=self.force)
+            self.cache.save()
+        return rebuilt
+
+
+def pipeline_tasks(markets_hashes, stages, fetcher, builder, markets_meta):
+    from compute_market_metrics_changes_df import raw_path
+
+    tasks = []
+    for market, market_hash in markets_hashes.items():
+        metrics_inputs = {
+            "market_meta": f"market_meta:{market}",
+            "assets": f"assets:{market}",
+        }
+        if "raw" in stages:
+            tasks.append({
+                "name": f"raw:{market}",
+                "fn": fetch_raw,
+                "kwargs": {"market": market, "market_hash": market_hash, "csv_file_path": f"{raw_path}/{market}.csv"},
+            })
+            metrics_inputs["raw"] = f"raw:{market}"
+        tasks.append({
+            "name": f"market_meta:{market}",
+            "fn": load_market_meta,
+            "kwargs": {"market_hash": market_hash, "markets_meta": markets_meta, "fetch": "markets" in stages},
+        })
+        tasks.append({
+            "name": f"assets:{market}",
+            "fn": fetch_assets,
+            "kwargs": {"fetcher": fetcher},
+            "inputs": {"market_meta": f"market_meta:{market}"},
+        })
+        if "market-metrics" in stages:
+            tasks.append({
+                "name": f"metrics:{market}",
+                "fn": builder.build,
+                "kwargs": {"market": market},
+                "inputs": metrics_inputs,
+                "group": "metrics",
+            })
+        if "spikes" in stages:
+            tasks.append({
+                "name": f"spikes:{market}",
+                "fn": builder.build_spikes,
+                "kwargs": {"market": market},
+                "after": [f"metrics:{market}"] if "market-metrics" in stages else [],
+                "group": "metrics",
+            })
+    if "spikes" in stages:
+        tasks.append({
+            "name": "spikes_dataset",
+            "fn": builder.build_spikes_dataset,
+            "after": [f"spikes:{market}" for market in markets_hashes],
+        })
+    if "markets" in stages or "assets" in stages:
+        tasks.append({
+            "name": "save_metadata",
+            "fn": save_metadata,
+            "inputs": {
+                "markets": [f"market_meta:{market}" for market in markets_hashes],
+                "assets": [f"assets:{market}" for market in markets_hashes],
+            },
+        })
+    return tasks
+
+
+def run_pipeline(markets_hashes, stages=None, max_workers=8, metrics_workers=2, force=False, accounting="accrual", chunk_bytes=None, position_jobs=1):
+    """
+    Run the selected stages (all of STAGES by default) of the markets
+    {name: market hash} as one graph, see the module docstring. Markets
+    are scheduled in the order of markets_hashes.
+    Returns {task name: "done" | "failed" | "skipped"}.
+    """
+    stages = STAGES if stages is None else stages
+    store = MetadataStore(COMMON_PATH)
+    markets_meta = store.markets
+    fetcher = AssetFetcher(store.assets, fetch="assets" in stages)
+    vault_addresses = sorted(store.vaults.keys())
+
+    started = time.time()
+    with ProcessPoolExecutor(max_workers=metrics_workers, mp_context=multiprocessing.get_context("spawn")) as executor:
+        builder = MetricsBuilder(
+            executor, metrics_workers, vault_addresses, force=force, accounting=accounting,
+            chunk_bytes=chunk_bytes, position_jobs=position_jobs,
+        )
+        tasks = pipeline_tasks(markets_hashes, stages, fetcher, builder, markets_meta)
+        status, _, timings = run_graph(tasks, max_workers=max_workers, limits={"metrics": builder.workers})
+
+    report = timing_report(tasks, status, timings, started)
+    print_report(report)
+    print(f"report written to {save_report(report)}")
+    return status
+
+
+if __name__ == "__main__":
+    import sys
+    import argparse
+    from registry import load_registry, select, market_hashes
+
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--select', default="tracked=1", help='Registry selector, e.g. "class=PT,min_borrow=5M" (every tracked market by default)')
+    parser.add_argument('--stages', nargs='+', default=STAGES, choices=STAGES, help='Stages to run, the others read their outputs from disk')
+    parser.add_argument('--workers', type=int, default=8, help='Concurrent tasks')
+    parser.add_argument('--metrics-workers', type=int, default=2, help='Markets enriched in parallel processes')
+    parser.add_argument('--force', action='store_true', help='Rebuild markets even if their outputs are up to date')
+    parser.add_argument('--accounting', choices=['accrual', 'shares'], default='accrual', help='How market totals are computed')
+    parser.add_argument('--chunk-mb', type=float, default=None, help='Stream raw events in chunks of about this many MB')
+    parser.add_argument('--position-jobs', type=int, default=1, help='Processes computing the user positions of a market')
+    args = parser.parse_args()
+
+    markets = market_hashes(select(load_registry(), args.select))
+    print(f"{len(markets)} markets selected by {args.select!r}")
+    status = run_pipeline(
+        markets, stages=args.stages, max_workers=args.workers, metrics_workers=args.metrics_workers,
+        force=args.force, accounting=args.accounting,
+        chunk_bytes=None if args.chunk_mb is None else int(args.chunk_mb * 2**20), position_jobs=args.position_jobs,
+    )
+    sys.exit(1 if any(st != "done" for st in status.values()) else 0)
@@ -0,0 +1,188 @@
+"""
+Per-stage wall time, CPU time, memory and row counts of a market build.
+
+    profiler = StageProfiler("eth_wbtc_usdc")
+    with profiler.stage("calculate_metrics", rows_in=len(raw_df)) as st:
+        metrics = calculate_metrics(raw_df, ...)
+        st["rows_out"] = len(metrics)
+    profiler.save()        # data/run_reports/eth_wbtc_usdc.json
+    profiler.close()       # in a finally block, stops the sampler if save() was not reached
+
+Every stage records
+    wall_s, cpu_s       perf_counter / process_time of the stage
+    peak_rss_delta_mb   how much the peak RSS of the process grew during the
+                        stage (0 if it stayed under an earlier peak)
+    rss_delta_mb        current RSS after - before, needs psutil
+    rows_in, rows_out
+Stages can be nested, their names are joined with "/".
+
+StageProfiler(..., sample=True) also runs a sampling profiler over the
+whole build (pyinstrument if installed, cProfile otherwise) and writes its
+output next to the report.
+"""
+import os
+import sys
+import json
+import time
+from contextlib import contextmanager
+from datetime import datetime, timezone
+
+try:
+    import resource
+except ImportError:
+    resource = None
+
+try:
+    import psutil
+except ImportError:
+    psutil = None
+
+from config import DATA_PATH
+
+REPORTS_PATH = DATA_PATH + "/run_reports"
+
+
+def peak_rss_mb():
+    """Peak resident memory of this process so far, None where resource is unavailable."""
+    if resource is None:
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # bytes on macOS, kilobytes on linux
+    return peak / 2**20 if sys.platform == "darwin" else peak / 2**10
+
+
+def rss_mb():
+    if psutil is None:
+        return None
+    return psutil.Process().memory_info().rss / 2**20
+
+
+def _delta(after, before):
+    if after is None or before is None:
+        return None
+    return round(after - before, 3)
+
+
+class SamplingProfiler:
+    """pyinstrument when it is installed, cProfile otherwise."""
+
+    def __init__(self, path):
+        self.path = path
+        try:
+            from pyinstrument import Profiler
+            self.profiler = Profiler()
+            self.kind = "pyinstrument"
+        except ImportError:
+            import cProfile
+            self.profiler = cProfile.Profile()
+            self.kind = "cprofile"
+
+    def start(self):
+        if self.kind == "pyinstrument":
+            self.profiler.start()
+        else:
+            self.profiler.enable()
+
+    def stop(self):
+        """Stop and write the profile, returns the file written."""
+        if self.kind == "pyinstrument":
+            self.profiler.stop()
+            path = self.path + ".html"
+            with open(path, "w") as f:
+                f.write(self.profiler.output_html())
+        else:
+            self.profiler.disable()
+            path = self.path + ".prof"
+            self.profiler.dump_stats(path)
+        return path
+
+
+def stage_table(stages):
+    """Stages sorted by wall time, for printing."""
+    lines = [f"{'stage':45s} {'wall_s':>9s} {'cpu_s':>9s} {'peak_mb':>9s} {'rows_in':>10s} {'rows_out':>10s}"]
+    for r in sorted(stages, key=lambda r: -r["wall_s"]):
+        lines.append(
+            f"{r['stage']:45s} {r['wall_s']:9.3f} {r['cpu_s']:9.3f} {str(r['peak_rss_delta_mb']):>9s} "
+            f"{str(r['rows_in']):>10s} {str(r['rows_out']):>10s}"
+        )
+    return "\n".join(lines)
+
+
+class StageProfiler:
+    def __init__(self, name, reports_path=REPORTS_PATH, sample=False):
+        self.name = name
+        self.reports_path = reports_path
+        self.started_at = datetime.now(timezone.utc).isoformat()
+        self.stages = []
+        self._prefix = []
+        self._start = (time.perf_counter(), time.process_time(), peak_rss_mb(), rss_mb())
+        self.sampler = None
+        if sample:
+            os.makedirs(reports_path, exist_ok=True)
+            self.sampler = SamplingProfiler(f"{reports_path}/{name}")
+            self.sampler.start()
+
+    @contextmanager
+    def stage(self, name, rows_in=None):
+        """Yields the stage record, set record["rows_out"] (or other fields) inside the block."""
+        record = {"stage": "/".join(self._prefix + [name]), "rows_in": rows_in, "rows_out": None}
+        self._prefix.append(name)
+        wall, cpu, peak, rss = time.perf_counter(), time.process_time(), peak_rss_mb(), rss_mb()
+        try:
+            yield record
+        finally:
+            self._prefix.pop()
+            record["wall_s"] = round(time.perf_counter() - wall, 6)
+            record["cpu_s"] = round(time.process_time() - cpu, 6)
+            record["peak_rss_delta_mb"] = _delta(peak_rss_mb(), peak)
+            record["rss_delta_mb"] = _delta(rss_mb(), rss)
+            self.stages.append(record)
+
+    def report(self):
+        wall, cpu, peak, rss = self._start
+        return {
+            "name": self.name,
+            "started_at": self.started_at,
+            "wall_s": round(time.perf_counter() - wall, 6),
+            "cpu_s": round(time.process_time() - cpu, 6),
+            "peak_rss_mb": peak_rss_mb(),
+            "peak_rss_delta_mb": _delta(peak_rss_mb(), peak),
+            "rss_delta_mb": _delta(rss_mb(), rss),
+            "stages": self.stages,
+        }
+
+    def summary(self):
+        return stage_table(self.stages)
+
+    def close(self):
+        """
+        Stop the sampling profiler if it still runs (a build that failed or
+        had nothing to do), its profile is written. save() closes it too.
+        A cProfile left enabled makes the next one fail on Python 3.12+.
+        """
+        if self.sampler is not None:
+            sampler, self.sampler = self.sampler, None
+            return sampler.stop()
+        return None
+
+    def save(self, path=None):
+        """Write the JSON report (reports_path/{name}.json by default), returns its path."""
+        report = self.report()
+        if self.sampler is not None:
+            report["profile"] = self.close()
+        path = path or f"{self.reports_path}/{self.name}.json"
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        tmp_path = path + ".tmp"
+        with open(tmp_path, "w") as f:
+            json.dump(report, f, indent=2)
+        os.replace(tmp_path, path)
+        return path
+
+
+if __name__ == "__main__":
+    # python profiling.py eth_wbtc_usdc ... prints the stored reports
+    for name in sys.argv[1:]:
+        with open(f"{REPORTS_PATH}/{name}.json", "r") as f:
+            report = json.load(f)
+        print(f"{name}: {report['wall_s']:.2f}s wall, {report['cpu_s']:.2f}s cpu, peak rss {report['peak_rss_mb']} MB")
+        print(stage_table(report["stages"]))
@@ -66,6 +66,7 @@ def get_actions_query(start_timestamp, end_timestamp, market, skip):
                 }
                 ... on MarketLiquidationTransactionData {
                 repaidAssets
+                repaidShares
                 repaidAssetsUsd
                 seizedAssets
                 seizedAssetsUsd
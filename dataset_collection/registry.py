@@ -0,0 +1,108 @@
+"""
+Markets the collection pipeline knows about, markets_registry.csv next to
+this file (one row per market):
+
+    name           file name of the market's data, markets_raw/{name}.csv ...
+    address        market unique key
+    chain          eth | base
+    class          crypto | YB (yield-bearing collateral) | PT (principal token)
+    collateral     collateral symbol, loan: loan asset symbol
+    expiry         PT maturity, YYYY-MM-DD
+    max_borrow     largest total borrow of the market in USD, where known
+    priority       lower priorities are scheduled first
+    tracked        1 if the market is part of a full refresh
+
+Markets are picked with selectors, comma separated terms that must all match:
+
+    class=PT,min_borrow=5M       PT markets that borrowed at least 5M
+    chain=base,loan=usdc|usdt    a|b matches either value
+    name=eth_PT-USDe-*           names are matched as globs
+    expired=no                   PT markets before their expiry, other markets never expire
+    tracked=1                    everything a full refresh covers (the default of pipeline.py)
+
+min_<column> / max_<column> bound a numeric column, K / M / B suffixes are
+allowed, "borrow" stands for max_borrow. Markets without a value fail a bound.
+
+    python registry.py "class=PT,min_borrow=5M"
+"""
+import os
+import sys
+from fnmatch import fnmatch
+from datetime import datetime, timezone
+
+import pandas as pd
+
+REGISTRY_FILE = os.path.join(os.path.dirname(os.path.abspath(__file__)), "markets_registry.csv")
+ALIASES = {"borrow": "max_borrow"}
+SUFFIXES = {"k": 1e3, "m": 1e6, "b": 1e9}
+
+
+def load_registry(path=REGISTRY_FILE):
+    registry = pd.read_csv(path, dtype={"expiry": str})
+    for column in ["name", "address"]:
+        # a market under two names would be fetched and built twice
+        duplicated = registry[column][registry[column].str.lower().duplicated()]
+        if len(duplicated):
+            raise ValueError(f"Duplicated market {column}s in {path}: {sorted(set(duplicated))}")
+    return registry
+
+
+def parse_number(value):
+    value = value.strip().replace(",", "").replace("_", "")
+    if value[-1:].lower() in SUFFIXES:
+        return float(value[:-1]) * SUFFIXES[value[-1].lower()]
+    return float(value)
+
+
+def parse_selector(selector):
+    """[(column, op, values)] of a selector, op is "eq", "min", "max" or "expired"."""
+    terms = []
+    for term in selector.split(","):
+        if not term.strip():
+            continue
+        if "=" not in term:
+            raise ValueError(f"Selector term {term!r} is not key=value")
+        key, value = (x.strip() for x in term.split("=", 1))
+        if key == "expired":
+            terms.append(("expiry", "expired", value.lower() in ("1", "yes", "true")))
+        elif key.startswith(("min_", "max_")):
+            column = ALIASES.get(key[4:], key[4:])
+            terms.append((column, key[:3], parse_number(value)))
+        else:
+            terms.append((ALIASES.get(key, key), "eq", value.split("|")))
+    return terms
+
+
+def select(registry, selector, today=None):
+    """Markets of the registry matching the selector, by priority then largest borrow first."""
+    today = today or datetime.now(timezone.utc).strftime("%Y-%m-%d")
+    mask = pd.Series(True, index=registry.index)
+    for column, op, value in parse_selector(selector):
+        if column not in registry.columns:
+            raise ValueError(f"Unknown registry column {column!r} in selector {selector!r}")
+        values = registry[column]
+        if op == "eq":
+            as_str = values.astype(str).str.lower()
+            mask &= as_str.apply(lambda x: any(fnmatch(x, v.lower()) for v in value))
+        elif op == "min":
+            mask &= pd.to_numeric(values, errors="coerce") >= value
+        elif op == "max":
+            mask &= pd.to_numeric(values, errors="coerce") <= value
+        else:
+            expired = values.notna() & (values < today)
+            mask &= expired if value else ~expired
+    selected = registry[mask]
+    return selected.sort_values(["priority", "max_borrow"], ascending=[True, False], na_position="last", kind="stable")
+
+
+def market_hashes(markets):
+    """{name: address} of selected markets, in their schedule order."""
+    return dict(zip(markets["name"], markets["address"]))
+
+
+if __name__ == "__main__":
+    pd.set_option("display.width", 250)
+    pd.set_option("display.max_rows", 500)
+    markets = select(load_registry(), sys.argv[1] if len(sys.argv) > 1 else "")
+    print(markets.drop(columns=["address"]).to_string(index=False))
+    print(f"{len(markets)} markets")
@@ -0,0 +1,192 @@
+"""
+Time based rolling statistics over irregular event timestamps.
+
+For every event at time t the window is
+    [t - w, t)          (gap=None, the event itself and same-timestamp events excluded)
+    [t - w, t - gap]    (gap >= 0, e.g. the spike baseline that skips the last minutes)
+
+    stats = rolling_time_stats(df["timestamp"].values, df["utilization_after"].values,
+                               windows=[6 * 3600, 24 * 3600], stats=["mean", "median"])
+    stats[("median", 24 * 3600)]
+
+Window bounds come from two searchsorted calls per window, sum / mean / std
+from prefix sums, min / max from a sparse table (O(1) per window) and the
+median from two heaps with lazy deletion (O(log w) per event). All the
+windows share the same prefix sums and sparse tables. NaN values are
+skipped like in pandas; windows without values give NaN.
+"""
+import heapq
+import numpy as np
+
+STATS = ("mean", "sum", "count", "min", "max", "std", "median")
+
+
+def window_bounds(timestamps, window, gap=None):
+    """[lo, hi) row ranges of the window of every event, timestamps must be sorted."""
+    lo = np.searchsorted(timestamps, timestamps - window, side="left")
+    if gap is None:
+        hi = np.searchsorted(timestamps, timestamps, side="left")
+    else:
+        hi = np.searchsorted(timestamps, timestamps - gap, side="right")
+    return lo, np.maximum(hi, lo)
+
+
+class SparseTable:
+    """Range min / max over a static array in O(1) per query after O(n log n) build."""
+
+    def __init__(self, values, op):
+        self.op = op
+        self.levels = [np.asarray(values, dtype=np.float64)]
+        k = 1
+        while 2 * k <= len(values):
+            prev = self.levels[-1]
+            self.levels.append(op(prev[:-k], prev[k:]))
+            k *= 2
+
+    def query(self, lo, hi, empty=np.nan):
+        """op over values[lo:hi] for arrays of bounds."""
+        lo = np.asarray(lo)
+        hi = np.asarray(hi)
+        length = hi - lo
+        res = np.full(len(lo), empty)
+        ok = length > 0
+        if not ok.any():
+            return res
+        level = np.floor(np.log2(length[ok])).astype(np.int64)
+        left = lo[ok]
+        right = hi[ok] - (1 << level)
+        out = np.empty(ok.sum())
+        for k in np.unique(level):
+            m = level == k
+            table = self.levels[k]
+            out[m] = self.op(table[left[m]], table[right[m]])
+        res[ok] = out
+        return res
+
+
+def _prune(heap, sign, removed):
+    # pop the values at the top of heap that were removed from the window
+    while heap and removed.get(sign * heap[0]):
+        value = sign * heapq.heappop(heap)
+        removed[value] -= 1
+        if removed[value] == 0:
+            del removed[value]
+
+
+def _rolling_median(values, lo, hi):
+    # lo and hi only move forward for sorted timestamps. The window is split
+    # in two heaps, the smaller half (negated, max heap) and the larger half,
+    # the median is at their tops. Values leaving the window are removed
+    # lazily once they reach a top, every step is O(log w).
+    res = np.full(len(lo), np.nan)
+    low, high = [], []
+    n_low = n_high = 0
+    removed_low, removed_high = {}, {}
+
+    def rebalance():
+        nonlocal n_low, n_high
+        if n_low > n_high + 1:
+            heapq.heappush(high, -heapq.heappop(low))
+            n_low -= 1
+            n_high += 1
+            _prune(low, -1, removed_low)
+        elif n_high > n_low:
+            heapq.heappush(low, -heapq.heappop(high))
+            n_high -= 1
+            n_low += 1
+            _prune(high, 1, removed_high)
+
+    values = values.tolist()
+    lo = lo.tolist()
+    hi = hi.tolist()
+    cur_lo = 0
+    cur_hi = 0
+    for i in range(len(lo)):
+        while cur_hi < hi[i]:
+            v = values[cur_hi]
+            if v == v:
+                if n_low == 0 or v <= -low[0]:
+                    heapq.heappush(low, -v)
+                    n_low += 1
+                else:
+                    heapq.heappush(high, v)
+                    n_high += 1
+                rebalance()
+            cur_hi += 1
+        while cur_lo < lo[i]:
+            v = values[cur_lo]
+            if v == v:
+                # values above the top of low are all in high
+                if v <= -low[0]:
+                    removed_low[v] = removed_low.get(v, 0) + 1
+                    n_low -= 1
+                    _prune(low, -1, removed_low)
+                else:
+                    removed_high[v] = removed_high.get(v, 0) + 1
+                    n_high -= 1
+                    _prune(high, 1, removed_high)
+                rebalance()
+            cur_lo += 1
+        if n_low > 0:
+            res[i] = -low[0] if n_low > n_high else (-low[0] + high[0]) / 2
+    return res
+
+
+def rolling_time_stats(timestamps, values, windows, stats=("mean",), gap=None, ddof=1):
+    """{(stat, window): array} for every requested stat and window (seconds)."""
+    timestamps = np.asarray(timestamps)
+    values = np.asarray(values, dtype=np.float64)
+    for stat in stats:
+        if stat not in STATS:
+            raise ValueError(f"Unknown stat {stat}, expected one of {STATS}")
+
+    order = None
+    if len(timestamps) > 1 and (np.diff(timestamps) < 0).any():
+        order = np.argsort(timestamps, kind="stable")
+        timestamps = timestamps[order]
+        values = values[order]
+
+    valid = ~np.isnan(values)
+    clean = np.where(valid, values, 0.0)
+    csum = np.concatenate([[0.0], np.cumsum(clean)])
+    ccount = np.concatenate([[0], np.cumsum(valid)])
+    csq = np.concatenate([[0.0], np.cumsum(clean * clean)]) if "std" in stats else None
+    min_table = SparseTable(np.where(valid, values, np.inf), np.minimum) if "min" in stats else None
+    max_table = SparseTable(np.where(valid, values, -np.inf), np.maximum) if "max" in stats else None
+
+    result = {}
+    for window in windows:
+        lo, hi = window_bounds(timestamps, window, gap)
+        count = ccount[hi] - ccount[lo]
+        total = csum[hi] - csum[lo]
+        has_values = count > 0
+        for stat in stats:
+            if stat == "count":
+                res = count.astype(np.float64)
+            elif stat == "sum":
+                res = total
+            elif stat == "mean":
+                res = np.divide(total, count, out=np.full(len(count), np.nan), where=has_values)
+            elif stat == "std":
+                sq = csq[hi] - csq[lo]
+                var = np.divide(
+                    sq - total * total / np.maximum(count, 1), count - ddof,
+                    out=np.full(len(count), np.nan), where=count - ddof > 0,
+                )
+                res = np.sqrt(np.maximum(var, 0))
+            elif stat == "min":
+                res = min_table.query(lo, hi)
+                res[~has_values] = np.nan
+            elif stat == "max":
+                res = max_table.query(lo, hi)
+                res[~has_values] = np.nan
+            elif stat == "median":
+                res = _rolling_median(values, lo, hi)
+
+            if order is not None:
+                unsorted = np.empty_like(res)
+                unsorted[order] = res
+                res = unsorted
+            result[(stat, window)] = res
+
+    return result
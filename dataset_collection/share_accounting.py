@@ -0,0 +1,175 @@
+"""
+Market totals from share accounting, an alternative to accrual.py.
+
+Morpho keeps total supply / borrow shares and converts them to assets with
+a share price that grows with the accrued interest. Every loan side event
+carries both its assets and shares, so
+
+    supply_shares = cumulative sum of supply +shares / withdraw -shares
+    borrow_shares = cumulative sum of borrow +shares / repay, liquidation -shares
+    share price   = assets / shares of the last event of that side
+    total         = shares * share price
+
+No interest rate is evaluated: the share prices already contain it. A
+side's price is only refreshed by an event of that side, so a total lags
+the interest accrued since the last such event. Liquidations without
+repaid shares convert the repaid assets with the current borrow share
+price. Bad debt socialized in a liquidation is not in the raw events and
+not accounted for.
+
+    python share_accounting.py eth_wbtc_usdc eth_cbbtc_usdc
+
+compares the share totals with the accrual totals on real market files.
+"""
+import numpy as np
+import pandas as pd
+
+from accrual import TYPE_CODES, encode_types, tx_starts, compute_market_totals
+
+SUPPLY_SIDE = {TYPE_CODES["MarketSupply"]: 1.0, TYPE_CODES["MarketWithdraw"]: -1.0}
+BORROW_SIDE = {
+    TYPE_CODES["MarketBorrow"]: 1.0,
+    TYPE_CODES["MarketRepay"]: -1.0,
+    TYPE_CODES["MarketLiquidation"]: -1.0,
+}
+
+# state a market ends with, to continue from in the next run
+INITIAL_SHARES = {
+    "supply_shares": 0.0,
+    "borrow_shares": 0.0,
+    "supply_share_price": np.nan,
+    "borrow_share_price": np.nan,
+}
+
+
+def _signs(type_codes, side):
+    signs = np.zeros(len(type_codes))
+    for code, sign in side.items():
+        signs[type_codes == code] = sign
+    return signs
+
+
+def last_share_price(amounts, shares, on_side, price0=np.nan):
+    """assets / shares of the last event of a side up to every row (price0 before the first one)."""
+    has_price = on_side & (shares > 0) & (amounts > 0)
+    price = np.full(len(amounts), np.nan)
+    price[has_price] = amounts[has_price] / shares[has_price]
+    return pd.Series(price).ffill().fillna(price0).to_numpy()
+
+
+def share_totals(type_codes, amounts, shares, initial=None):
+    """
+    Per row total supply / borrow after it and the share state at the end.
+    Liquidations without shares are converted with the borrow share price
+    before them.
+    """
+    initial = INITIAL_SHARES if initial is None else initial
+    amounts = np.abs(np.asarray(amounts, dtype=np.float64))
+    shares = np.abs(np.nan_to_num(np.asarray(shares, dtype=np.float64)))
+
+    supply_signs = _signs(type_codes, SUPPLY_SIDE)
+    borrow_signs = _signs(type_codes, BORROW_SIDE)
+    supply_price = last_share_price(amounts, shares, supply_signs != 0, initial["supply_share_price"])
+    borrow_price = last_share_price(amounts, shares, borrow_signs != 0, initial["borrow_share_price"])
+
+    borrow_shares = shares.copy()
+    missing = (type_codes == TYPE_CODES["MarketLiquidation"]) & (borrow_shares == 0)
+    if missing.any():
+        borrow_shares[missing] = np.nan_to_num(amounts[missing] / borrow_price[missing])
+
+    supply_shares = initial["supply_shares"] + np.cumsum(supply_signs * shares)
+    borrow_shares = initial["borrow_shares"] + np.cumsum(borrow_signs * borrow_shares)
+    total_supply = np.nan_to_num(supply_shares * supply_price)
+    total_borrow = np.nan_to_num(borrow_shares * borrow_price)
+
+    final = dict(initial)
+    if len(type_codes):
+        final = {
+            "supply_shares": float(supply_shares[-1]),
+            "borrow_shares": float(borrow_shares[-1]),
+            "supply_share_price": float(supply_price[-1]),
+            "borrow_share_price": float(borrow_price[-1]),
+        }
+    return total_supply, total_borrow, final
+
+
+def compute_share_totals(hashes, types, amounts, shares, initial=None):
+    """
+    Same output as accrual.compute_market_totals, (starts, supply_before,
+    borrow_before, supply_after, borrow_after), plus the final share state.
+    Events must be sorted by (timestamp, hash); initial is the share state
+    of a previous run (INITIAL_SHARES keys).
+    """
+    starts = tx_starts(hashes)
+    type_codes = encode_types(types)
+    total_supply, total_borrow, final = share_totals(type_codes, amounts, shares, initial)
+    if len(starts) == 0:
+        empty = np.zeros(0)
+        return starts, empty, empty, empty, empty, final
+
+    ends = np.append(starts[1:], len(type_codes)) - 1
+    supply_after = total_supply[ends]
+    borrow_after = total_borrow[ends]
+    # before a transaction is after the previous one
+    initial = INITIAL_SHARES if initial is None else initial
+    supply0 = np.nan_to_num(initial["supply_shares"] * initial["supply_share_price"])
+    borrow0 = np.nan_to_num(initial["borrow_shares"] * initial["borrow_share_price"])
+    supply_before = np.concatenate([[supply0], supply_after[:-1]])
+    borrow_before = np.concatenate([[borrow0], borrow_after[:-1]])
+    return starts, supply_before, borrow_before, supply_after, borrow_after, final
+
+
+def reconcile_totals(df, irm_history):
+    """
+    Accrual and share totals after every transaction of an events frame
+    (needs timestamp, hash, type, assets_units, shares_units) and their
+    relative differences.
+    """
+    df = df.sort_values(["timestamp", "hash"], kind="stable")
+    amounts = np.abs(df["assets_units"].to_numpy(dtype=np.float64))
+    starts, _, _, accrual_supply, accrual_borrow = compute_market_totals(
+        df["timestamp"].values, df["hash"].values, df["type"].values, amounts, irm_history,
+    )
+    _, _, _, share_supply, share_borrow, _ = compute_share_totals(
+        df["hash"].values, df["type"].values, amounts, df["shares_units"].to_numpy(dtype=np.float64),
+    )
+    res = pd.DataFrame({
+        "hash": df["hash"].values[starts],
+        "timestamp": df["timestamp"].values[starts],
+        "accrual_supply": accrual_supply,
+        "share_supply": share_supply,
+        "accrual_borrow": accrual_borrow,
+        "share_borrow": share_borrow,
+    })
+    with np.errstate(divide="ignore", invalid="ignore"):
+        res["supply_diff"] = (res["accrual_supply"] - res["share_supply"]) / res["share_supply"].abs()
+        res["borrow_diff"] = (res["accrual_borrow"] - res["share_borrow"]) / res["share_borrow"].abs()
+    return res
+
+
+if __name__ == "__main__":
+    import sys
+    from metadata import MetadataStore
+    from amounts import add_amount_units, RAW_DTYPES
+    from irm import rate_at_target_history
+
+    from config import DATA_PATH, COMMON_PATH
+
+    store = MetadataStore(COMMON_PATH)
+    markets_meta, assets_meta = store.markets, store.assets
+
+    for name in sys.argv[1:]:
+        df = pd.read_csv(f"{DATA_PATH}/markets_raw/{name}.csv", dtype=RAW_DTYPES)
+        if "shares" not in df.columns:
+            print(f"{name}: raw events have no shares, collect them again")
+            continue
+        market_meta = markets_meta[df["market_address"].unique()[0]]
+        df = add_amount_units(
+            df, market_meta,
+            assets_meta.get(market_meta["collateral_asset_address"]),
+            assets_meta.get(market_meta["loan_asset_address"]),
+        )
+        res = reconcile_totals(df, rate_at_target_history(market_meta))
+        for col in ["supply_diff", "borrow_diff"]:
+            diff = res[col].replace([np.inf, -np.inf], np.nan).abs()
+            print(f"{name} {col}: median {diff.median():.3e}, p99 {diff.quantile(0.99):.3e}, max {diff.max():.3e}, last {res[col].iloc[-1]:.3e}")
@@ -0,0 +1,219 @@
+"""
+Utilization spike episodes of every market, detected on its enriched events
+with detect_market_spikes (users_clusterization/util_libs/spikes_utils.py).
+
+    markets_enriched/{m}.csv -> markets_spikes/{m}.csv -> all_spikes_dataset.csv
+
+Both steps go through BuildCache. The spikes of a market are fingerprinted
+by its enriched csv, the source of spikes_utils.py and of this module, and
+SPIKE_PARAMS (the detection thresholds and the active period cut);
+all_spikes_dataset.csv by the per-market files. Rebuilding the enriched
+events of a market (new raw events, new enrichment code or parameters)
+changes their hash, so only the spikes of that market and the combined
+dataset become stale. build_positions_dataset.ipynb reads the combined one.
+
+    python spikes_dataset.py                               # every enriched market
+    python spikes_dataset.py --markets eth_wbtc_usdc eth_cbbtc_usdc --workers 4
+"""
+import os
+import sys
+import traceback
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
+import pandas as pd
+from tqdm import tqdm
+
+from build_cache import BuildCache
+from config import DATA_PATH
+
+SPIKES_UTILS_FILE = os.path.join(
+    os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "users_clusterization", "util_libs", "spikes_utils.py"
+)
+sys.path.append(os.path.dirname(SPIKES_UTILS_FILE))
+from spikes_utils import detect_market_spikes
+
+ENRICHED_PATH = DATA_PATH + "/markets_enriched"
+SPIKES_PATH = DATA_PATH + "/markets_spikes"
+SPIKES_DATASET = DATA_PATH + "/all_spikes_dataset.csv"
+
+# as in utilization_spikes.ipynb, the thresholds are detect_market_spikes arguments
+SPIKE_PARAMS = {
+    "start_date": "2025-01-01",
+    "baseline_window_hours": 24,
+    "spike_util_threshold": 0.90,
+    "min_spike_delta": 0.03,
+    "recovery_buffer": 0.02,
+    "max_followup_events": 200,
+    "actions_limit": 100000,
+    "min_actions_in_spike": 2,
+    # events outside the period the market borrowed more than this share of its peak are dropped
+    "active_borrow_share": 0.02,
+    # markets ending with less borrowed than this get no spikes
+    "min_total_borrow": 10000,
+}
+DETECT_ARGS = [
+    "start_date", "baseline_window_hours", "spike_util_threshold", "min_spike_delta",
+    "recovery_buffer", "max_followup_events", "actions_limit", "min_actions_in_spike",
+]
+EVENT_COLUMNS = [
+    "timestamp", "datetime", "hash", "type", "user_address", "market_address",
+    "utilization_before", "utilization_after", "total_borrow_before", "total_borrow_after",
+    "total_supply_before", "total_supply_after", "collateral_price", "loan_asset_price",
+    "debt_before", "supply_before",
+]
+SPIKE_COLUMNS = [
+    "market_name", "market_address", "max_total_supply", "market_total_events", "market_n_users",
+    "market_n_spikes", "spike_index", "spike_trigger_datetime", "spike_recovery_datetime",
+    "spike_duration_seconds", "spike_magnitude_util_delta", "peak_utilization", "trigger_event_types",
+    "total_borrow_before", "total_supply_before", "utilization_before", "collateral_price",
+    "loan_asset_price", "debt_before", "supply_before", "n_total_events_in_spike", "n_repay_events_in_spike",
+]
+CODE = [SPIKES_UTILS_FILE, os.path.abspath(__file__)]
+
+
+def market_spikes(df, name, params=SPIKE_PARAMS):
+    """One row per spike episode of a market's enriched events (columns SPIKE_COLUMNS)."""
+    df = df.sort_values("timestamp")
+    active = df["total_borrow_after"] > df["total_borrow_after"].max() * params["active_borrow_share"]
+    df = df[(df["timestamp"] > df.loc[active, "timestamp"].min()) & (df["timestamp"] < df.loc[active, "timestamp"].max())]
+    if df.empty or df["total_borrow_after"].iloc[-1] < params["min_total_borrow"]:
+        return pd.DataFrame(columns=SPIKE_COLUMNS)
+
+    spikes = detect_market_spikes(df.reset_index(drop=True), **{k: params[k] for k in DETECT_ARGS})
+    market = {
+        "market_name": name,
+        "market_address": df["market_address"].iloc[0],
+        "max_total_supply": df["total_supply_after"].max(),
+        "market_total_events": len(df),
+        "market_n_users": df["user_address"].nunique(),
+        "market_n_spikes": len(spikes),
+    }
+    rows = []
+    for index, spike in enumerate(spikes):
+        state = spike["market_state"]
+        actions = spike["actions_df"]
+        rows.append({
+            **market,
+            "spike_index": index,
+            "spike_trigger_datetime": spike["trigger_datetime"],
+            "spike_recovery_datetime": spike["recovery_datetime"],
+            "spike_duration_seconds": spike["recovery_time_seconds"],
+            "spike_magnitude_util_delta": spike["spike_magnitudes"]["utilization_delta"],
+            "peak_utilization": spike["spike_magnitudes"]["peak_utilization"],
+            "trigger_event_types": spike["trigger_event_types"],
+            "total_borrow_before": state["total_borrow"],
+            "total_supply_before": state["total_supply"],
+            "utilization_before": state["utilization_before"],
+            "collateral_price": state["collateral_price"],
+            "loan_asset_price": state["loan_asset_price"],
+            "debt_before": state["debt_before"],
+            "supply_before": state["supply_before"],
+            "n_total_events_in_spike": len(actions),
+            "n_repay_events_in_spike": int((actions["type"] == "MarketRepay").sum()),
+        })
+    return pd.DataFrame(rows, columns=SPIKE_COLUMNS)
+
+
+def build_market_spikes(name, enriched_path=ENRICHED_PATH, spikes_path=SPIKES_PATH, params=SPIKE_PARAMS):
+    """Write spikes_path/{name}.csv from the enriched events, returns the number of spikes."""
+    df = pd.read_csv(f"{enriched_path}/{name}.csv", usecols=lambda c: c in EVENT_COLUMNS)
+    spikes = market_spikes(df, name, params)
+    os.makedirs(spikes_path, exist_ok=True)
+    spikes.to_csv(f"{spikes_path}/{name}.csv", index=False)
+    return len(spikes)
+
+
+def spikes_job(name, cache, enriched_path=ENRICHED_PATH, spikes_path=SPIKES_PATH, params=SPIKE_PARAMS, force=False):
+    """BuildCache record of a market's spikes, None if they are up to date with its enriched events."""
+    enriched_file = f"{enriched_path}/{name}.csv"
+    fingerprint = cache.fingerprint([enriched_file], CODE, params)
+    outputs = [f"{spikes_path}/{name}.csv"]
+    if not force and not cache.is_stale(outputs, fingerprint):
+        return None
+    return (outputs, fingerprint, [enriched_file], params)
+
+
+def build_spikes_dataset(cache, spikes_path=SPIKES_PATH, output=SPIKES_DATASET, force=False):
+    """Concatenate the per-market spikes into output if one of them changed, returns True if it was rebuilt."""
+    if not os.path.isdir(spikes_path):
+        return False
+    inputs = [f"{spikes_path}/{file}" for file in sorted(os.listdir(spikes_path)) if file.endswith(".csv")]
+    fingerprint = cache.fingerprint(inputs, CODE)
+    if not force and not cache.is_stale([output], fingerprint):
+        return False
+    frames = [pd.read_csv(path) for path in inputs]
+    frames = [df for df in frames if len(df)]
+    dataset = pd.concat(frames, ignore_index=True) if frames else pd.DataFrame(columns=SPIKE_COLUMNS)
+    dataset.to_csv(output, index=False)
+    cache.record([output], fingerprint, inputs)
+    return True
+
+
+def run_spikes(names, workers=1, force=False, params=SPIKE_PARAMS, enriched_path=ENRICHED_PATH,
+               spikes_path=SPIKES_PATH, output=SPIKES_DATASET, cache=None):
+    """
+    Rebuild the stale market spikes, in `workers` processes when workers > 1,
+    then the combined dataset. Returns {name: "built" | "fresh" | "failed"}.
+    """
+    cache = BuildCache() if cache is None else cache
+    status = {}
+    jobs = {}
+    for name in names:
+        try:
+            job = spikes_job(name, cache, enriched_path, spikes_path, params, force)
+        except Exception as e:
+            print(f"{name}: failed to prepare inputs: {e!r}")
+            status[name] = "failed"
+            continue
+        if job is None:
+            status[name] = "fresh"
+        else:
+            jobs[name] = job
+
+    def on_done(name, error):
+        if error is None:
+            cache.record(*jobs[name])
+            cache.save()
+            status[name] = "built"
+        else:
+            print(f"{name}: failed: {error!r}")
+            status[name] = "failed"
+
+    if workers <= 1:
+        for name in tqdm(jobs):
+            try:
+                build_market_spikes(name, enriched_path, spikes_path, params)
+                on_done(name, None)
+            except Exception as e:
+                traceback.print_exc()
+                on_done(name, e)
+    else:
+        with ProcessPoolExecutor(max_workers=workers) as executor:
+            futures = {executor.submit(build_market_spikes, name, enriched_path, spikes_path, params): name for name in jobs}
+            for future in tqdm(as_completed(futures), total=len(futures)):
+                try:
+                    future.result()
+                    on_done(futures[future], None)
+                except Exception as e:
+                    on_done(futures[future], e)
+
+    if build_spikes_dataset(cache, spikes_path, output, force):
+        print(f"{output} rebuilt")
+    cache.save()
+    print(f"spikes built {sum(st == 'built' for st in status.values())}, up to date {sum(st == 'fresh' for st in status.values())}, failed {sum(st == 'failed' for st in status.values())}")
+    return status
+
+
+if __name__ == "__main__":
+    import argparse
+
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--markets', nargs='+', default=None, help='Markets to detect spikes in (every enriched market by default)')
+    parser.add_argument('--workers', type=int, default=1, help='Markets processed in parallel processes')
+    parser.add_argument('--force', action='store_true', help='Rebuild spikes even if they are up to date')
+    args = parser.parse_args()
+
+    names = args.markets or sorted(file[:-4] for file in os.listdir(ENRICHED_PATH) if file.endswith(".csv"))
+    status = run_spikes(names, workers=args.workers, force=args.force)
+    if any(st == "failed" for st in status.values()):
+        sys.exit(1)
@@ -0,0 +1,345 @@
+"""
+Synthetic Morpho market event streams in the markets_raw schema, with the
+markets_meta / assets_meta entries the enrichment needs.
+
+    raw_df, markets_meta, assets_meta = generate_market(100_000, seed=1)
+    write_market("synthetic_1m", 1_000_000, data_path)   # chunked, for the big sizes
+    generate_market(10_000, loan_asset="WETH")            # loan asset priced ~2500 USD
+
+Transactions are drawn from TX_TEMPLATES: single actions, open / close
+bundles (collateral + borrow, repay + collateral withdraw), leveraged loops
+(several collateral + borrow pairs in one tx) and liquidations. Activity
+follows a daily cycle plus spike episodes, during which event intensity
+jumps, the collateral price falls and the mix moves to withdrawals, repays
+and liquidations. Users have skewed (zipf) activity. Amounts are lognormal,
+rescaled per chunk so the market grows with a plausible utilization; they
+are not checked against positions, so a user may repay more than it owes.
+Shares are the assets divided by a supply / borrow index growing at a
+constant rate. The loan asset is a stablecoin by default; a non-unit loan
+price (WETH) is used for some sizes so that unit mistakes do not hide
+behind a price of 1.
+"""
+import os
+import json
+import hashlib
+import numpy as np
+import pandas as pd
+
+from manifest import record_file
+from config import DATA_PATH
+
+
+SIZES = {
+    "10k": 10_000,
+    "100k": 100_000,
+    "1m": 1_000_000,
+    "10m": 10_000_000,
+}
+# loan asset of the sizes that do not use USDC
+SIZE_LOAN_ASSETS = {
+    "100k": "WETH",
+    "10m": "WETH",
+}
+# symbol -> starting USD price
+LOAN_ASSETS = {
+    "USDC": 1.0,
+    "WETH": 2_500.0,
+}
+
+# (event types of the tx, weight in normal hours, weight in spike hours)
+TX_TEMPLATES = [
+    (("MarketSupply",), 0.18, 0.06),  # first, the opening deposit uses it
+    (("MarketWithdraw",), 0.12, 0.30),
+    (("MarketSupplyCollateral",), 0.08, 0.06),
+    (("MarketWithdrawCollateral",), 0.06, 0.03),
+    (("MarketBorrow",), 0.12, 0.04),
+    (("MarketRepay",), 0.12, 0.20),
+    (("MarketSupplyCollateral", "MarketBorrow"), 0.14, 0.03),
+    (("MarketRepay", "MarketWithdrawCollateral"), 0.10, 0.10),
+    (("MarketSupplyCollateral", "MarketBorrow") * 3, 0.05, 0.01),
+    (("MarketLiquidation",), 0.03, 0.17),
+]
+LENDER_TYPES = ("MarketSupply", "MarketWithdraw")
+TYPE_NAMES = sorted({name for types, _, _ in TX_TEMPLATES for name in types})
+# share of the supplied assets withdrawn again within a chunk, and the
+# range the borrowed / net supplied ratio of a chunk is drawn from
+WITHDRAW_SHARE = 0.85
+UTILIZATION_RANGE = (0.6, 0.92)
+
+LOAN_DECIMALS = 6
+COLLATERAL_DECIMALS = 8
+EVENTS_PER_DAY = 3000
+SUPPLY_APR = 0.04
+BORROW_APR = 0.05
+# rate_at_target of ~4% APR in wad per second
+RATE_AT_TARGET_WAD = int(0.04 / (365 * 86400) * 1e18)
+
+RAW_COLUMNS = [
+    "hash", "type", "timestamp", "user_address", "assets", "assets_usd", "shares",
+    "liquidated_assets", "liquidated_assets_usd", "market", "datetime", "market_address",
+]
+
+
+def _address(rng, n, length=40):
+    raw = rng.integers(0, 256, size=(n, length // 2), dtype=np.uint8)
+    return np.array(["0x" + row.tobytes().hex() for row in raw], dtype=object)
+
+
+def _zipf_weights(n, a=0.8):
+    w = 1.0 / np.arange(1, n + 1) ** a
+    return w / w.sum()
+
+
+class MarketTimeline:
+    """Hourly intensity, spike flags and prices shared by all chunks of a market."""
+
+    def __init__(self, n_events, seed=0, start_timestamp=1_704_067_200, days=None, loan_asset="USDC"):
+        rng = np.random.default_rng(seed)
+        days = days or int(np.clip(n_events / EVENTS_PER_DAY, 7, 730))
+        n_hours = days * 24
+        self.hours = start_timestamp + 3600 * np.arange(n_hours, dtype=np.int64)
+
+        hour_of_day = np.arange(n_hours) % 24
+        intensity = 1 + 0.4 * np.sin(2 * np.pi * (hour_of_day - 8) / 24)
+        spike = np.zeros(n_hours, dtype=bool)
+        for start in rng.integers(0, n_hours, size=max(days // 20, 1)):
+            length = int(rng.integers(2, 13))
+            spike[start:start + length] = True
+            intensity[start:start + length] *= rng.uniform(5, 15)
+        self.spike = spike
+
+        # collateral price: GBM, falling during spikes
+        log_returns = rng.normal(0, 0.006, n_hours) - 0.01 * spike
+        self.collateral_price = 60_000 * np.exp(np.cumsum(log_returns))
+        noise = rng.normal(0, 1e-4, n_hours)
+        if LOAN_ASSETS[loan_asset] == 1:
+            self.loan_price = 1 + noise
+        else:
+            # ~0.4% hourly volatility
+            self.loan_price = LOAN_ASSETS[loan_asset] * np.exp(np.cumsum(40 * noise))
+        self.loan_asset = loan_asset
+
+        weights = np.array([w for _, w, _ in TX_TEMPLATES])
+        mean_events = np.dot([len(t) for t, _, _ in TX_TEMPLATES], weights) / weights.sum()
+        n_tx = int(n_events / mean_events)
+        self.tx_per_hour = rng.multinomial(n_tx, intensity / intensity.sum())
+        self.n_users = max(50, n_events // 40)
+        self.seed = seed
+
+
+def _balance_flows(usd, types, utilization):
+    """
+    Rescale withdraw / repay (or borrow) sizes so that the chunk adds net
+    supply and net debt at the given ratio, instead of a random walk.
+    """
+    usd = usd.copy()
+    total = {name: usd[types == name].sum() for name in TYPE_NAMES}
+    if total["MarketSupply"] == 0:
+        return usd
+    if total["MarketWithdraw"] > 0:
+        usd[types == "MarketWithdraw"] *= WITHDRAW_SHARE * total["MarketSupply"] / total["MarketWithdraw"]
+    net_borrow = utilization * (1 - WITHDRAW_SHARE) * total["MarketSupply"]
+    repaid = max(total["MarketBorrow"] - net_borrow, 0.3 * total["MarketBorrow"])
+    if total["MarketBorrow"] > 0:
+        usd[types == "MarketBorrow"] *= (net_borrow + repaid) / total["MarketBorrow"]
+    if total["MarketRepay"] > 0:
+        usd[types == "MarketRepay"] *= max(repaid - total["MarketLiquidation"], 0) / total["MarketRepay"]
+    return usd
+
+
+def generate_events(timeline, hour_lo, hour_hi, tx_offset, seed):
+    """Raw events of the transactions in hours [hour_lo, hour_hi), sorted by time."""
+    rng = np.random.default_rng(seed)
+    counts = timeline.tx_per_hour[hour_lo:hour_hi]
+    tx_hour = np.repeat(np.arange(hour_lo, hour_hi), counts)
+    n_tx = len(tx_hour)
+    tx_time = timeline.hours[tx_hour] + rng.integers(0, 3600, n_tx)
+    order = np.argsort(tx_time, kind="stable")
+    tx_hour, tx_time = tx_hour[order], tx_time[order]
+
+    # template of every transaction, spike hours use the spike mix
+    normal_p = np.array([w for _, w, _ in TX_TEMPLATES])
+    spike_p = np.array([w for _, _, w in TX_TEMPLATES])
+    in_spike = timeline.spike[tx_hour]
+    template = np.where(
+        in_spike,
+        rng.choice(len(TX_TEMPLATES), n_tx, p=spike_p / spike_p.sum()),
+        rng.choice(len(TX_TEMPLATES), n_tx, p=normal_p / normal_p.sum()),
+    )
+    if tx_offset == 0 and n_tx:
+        # the market opens with a vault deposit
+        template[0] = 0
+    lengths = np.array([len(t) for t, _, _ in TX_TEMPLATES])
+    flat_types = np.array([name for t, _, _ in TX_TEMPLATES for name in t], dtype=object)
+    template_start = np.concatenate([[0], np.cumsum(lengths)[:-1]])
+
+    tx_len = lengths[template]
+    tx = np.repeat(np.arange(n_tx), tx_len)
+    pos = np.arange(len(tx)) - np.repeat(np.cumsum(tx_len) - tx_len, tx_len)
+    types = flat_types[template_start[template[tx]] + pos]
+    n = len(tx)
+
+    # lenders and borrowers are separate pools with zipf activity
+    user_rng = np.random.default_rng(timeline.seed)
+    lenders = _address(user_rng, timeline.n_users // 3 + 1)
+    borrowers = _address(user_rng, timeline.n_users)
+    is_lender_tx = np.isin(flat_types[template_start[template]], LENDER_TYPES)
+    tx_user = np.where(
+        is_lender_tx,
+        lenders[rng.choice(len(lenders), n_tx, p=_zipf_weights(len(lenders)))],
+        borrowers[rng.choice(len(borrowers), n_tx, p=_zipf_weights(len(borrowers)))],
+    )
+
+    hour = tx_hour[tx]
+    price = timeline.collateral_price[hour]
+    loan_price = timeline.loan_price[hour]
+    # loan side size of the transaction, loops shrink geometrically
+    tx_usd = rng.lognormal(8.5, 1.5, n_tx)
+    usd = tx_usd[tx] * 0.7 ** (pos // 2)
+    is_supply_side = np.isin(types, LENDER_TYPES)
+    is_collateral = np.isin(types, ["MarketSupplyCollateral", "MarketWithdrawCollateral"])
+    ltv = rng.uniform(0.4, 0.8, n)
+    usd[is_collateral] /= ltv[is_collateral]
+    is_liquidation = types == "MarketLiquidation"
+    usd[is_liquidation] = rng.lognormal(7.5, 1.2, is_liquidation.sum())
+    usd = _balance_flows(usd, types, rng.uniform(*UTILIZATION_RANGE))
+    if tx_offset == 0 and n_tx:
+        usd[0] = (1 - WITHDRAW_SHARE) * usd[types == "MarketSupply"].sum()
+
+    units = np.where(is_collateral, usd / price, usd / loan_price)
+    decimals = np.where(is_collateral, COLLATERAL_DECIMALS, LOAN_DECIMALS)
+    assets = np.round(units * 10.0 ** decimals).astype(np.int64)
+
+    years = (tx_time[tx] - timeline.hours[0]) / (365 * 86400)
+    index = np.where(is_supply_side, np.exp(SUPPLY_APR * years), np.exp(BORROW_APR * years))
+    shares = np.where(is_collateral, np.nan, assets * 1e6 / index)
+
+    seized_usd = usd * rng.uniform(1.03, 1.15, n)
+    liquidated_assets = np.where(is_liquidation, np.round(seized_usd / price * 10.0 ** COLLATERAL_DECIMALS), 0).astype(np.int64)
+    liquidated_assets_usd = np.where(is_liquidation, seized_usd, 0.0)
+
+    tx_hash = np.array([f"0x{timeline.seed:08x}{t:056x}" for t in range(tx_offset, tx_offset + n_tx)], dtype=object)
+    timestamps = tx_time[tx]
+    return pd.DataFrame({
+        "hash": tx_hash[tx],
+        "type": types,
+        "timestamp": timestamps,
+        "user_address": tx_user[tx],
+        "assets": assets,
+        "assets_usd": usd,
+        "shares": shares,
+        "liquidated_assets": liquidated_assets,
+        "liquidated_assets_usd": liquidated_assets_usd,
+        "datetime": pd.to_datetime(timestamps, unit="s").strftime("%Y-%m-%d %H:%M:%S"),
+    })
+
+
+def market_address(name):
+    return "0x" + hashlib.sha256(name.encode()).hexdigest()
+
+
+def market_metadata(name, timeline):
+    """({market_address: market_meta}, {asset_address: asset_meta}) of a synthetic market."""
+    digest = hashlib.sha256(name.encode()).hexdigest()
+    collateral_address = "0x" + digest[:38] + "c0"
+    loan_address = "0x" + digest[:38] + "10"
+    hours = [int(h) for h in timeline.hours]
+    market_meta = {
+        "address": market_address(name),
+        "lltv": "860000000000000000",
+        "oracle_address": "0x" + digest[-40:],
+        "creation_datetime": hours[0],
+        "network": "synthetic",
+        "loan_asset_address": loan_address,
+        "loan_asset_symbol": timeline.loan_asset,
+        "loan_asset_decimals": LOAN_DECIMALS,
+        "collateral_asset_address": collateral_address,
+        "collateral_asset_symbol": "cbBTC",
+        "collateral_asset_decimals": COLLATERAL_DECIMALS,
+        "rate_at_target": {str(h): RATE_AT_TARGET_WAD for h in hours[::24]},
+    }
+    assets_meta = {
+        collateral_address: {
+            "asset_assress": collateral_address,
+            "decimals": COLLATERAL_DECIMALS,
+            "symbol": "cbBTC",
+            "historical_price": [[h, float(p)] for h, p in zip(hours, timeline.collateral_price)],
+        },
+        loan_address: {
+            "asset_assress": loan_address,
+            "decimals": LOAN_DECIMALS,
+            "symbol": timeline.loan_asset,
+            "historical_price": [[h, float(p)] for h, p in zip(hours, timeline.loan_price)],
+        },
+    }
+    return {market_meta["address"]: market_meta}, assets_meta
+
+
+def iter_market_chunks(name, n_events, seed=0, chunk_hours=24 * 30, loan_asset="USDC"):
+    """Yields raw event frames of consecutive hour ranges, ~n_events in total."""
+    timeline = MarketTimeline(n_events, seed, loan_asset=loan_asset)
+    address = market_address(name)
+    tx_offset = 0
+    for k, hour_lo in enumerate(range(0, len(timeline.hours), chunk_hours)):
+        hour_hi = min(hour_lo + chunk_hours, len(timeline.hours))
+        df = generate_events(timeline, hour_lo, hour_hi, tx_offset, seed * 100_003 + k)
+        tx_offset += int(timeline.tx_per_hour[hour_lo:hour_hi].sum())
+        df["market"] = name
+        df["market_address"] = address
+        yield df[RAW_COLUMNS]
+
+
+def generate_market(n_events, seed=0, name="synthetic", loan_asset="USDC"):
+    """(raw_df, markets_meta, assets_meta) of a synthetic market in memory."""
+    raw_df = pd.concat(list(iter_market_chunks(name, n_events, seed, loan_asset=loan_asset)), ignore_index=True)
+    markets_meta, assets_meta = market_metadata(name, MarketTimeline(n_events, seed, loan_asset=loan_asset))
+    return raw_df, markets_meta, assets_meta
+
+
+def _update_json(path, entries):
+    data = {}
+    if os.path.exists(path):
+        with open(path, "r") as f:
+            data = json.load(f)
+    data.update(entries)
+    with open(path, "w") as f:
+        json.dump(data, f)
+
+
+def write_market(name, n_events, data_path=DATA_PATH, seed=0, loan_asset="USDC"):
+    """
+    Write markets_raw/{name}.csv chunk by chunk and add the market and its
+    assets to common/markets_meta.json / assets_meta.json under data_path.
+    The raw file is indexed in data_path's manifest.json.
+    Returns the number of events written.
+    """
+    os.makedirs(f"{data_path}/markets_raw", exist_ok=True)
+    os.makedirs(f"{data_path}/common", exist_ok=True)
+    raw_file = f"{data_path}/markets_raw/{name}.csv"
+    n_written = 0
+    for k, df in enumerate(iter_market_chunks(name, n_events, seed, loan_asset=loan_asset)):
+        df.to_csv(raw_file, mode="w" if k == 0 else "a", header=k == 0, index=False)
+        n_written += len(df)
+    # written in chunks, so the manifest reads the address and timestamps back
+    record_file(raw_file, manifest_path=f"{data_path}/manifest.json")
+
+    markets_meta, assets_meta = market_metadata(name, MarketTimeline(n_events, seed, loan_asset=loan_asset))
+    _update_json(f"{data_path}/common/markets_meta.json", markets_meta)
+    _update_json(f"{data_path}/common/assets_meta.json", assets_meta)
+    if not os.path.exists(f"{data_path}/common/vaults_meta.json"):
+        _update_json(f"{data_path}/common/vaults_meta.json", {})
+    return n_written
+
+
+if __name__ == "__main__":
+    import argparse
+
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--sizes', nargs='+', default=list(SIZES), choices=list(SIZES), help='Market sizes to generate')
+    parser.add_argument('--data-path', default=DATA_PATH, help='Data directory the markets are written to')
+    parser.add_argument('--seed', type=int, default=0)
+    args = parser.parse_args()
+
+    for size in args.sizes:
+        n = write_market(f"synthetic_{size}", SIZES[size], args.data_path, args.seed, SIZE_LOAN_ASSETS.get(size, "USDC"))
+        print(f"synthetic_{size}: {n} events written")
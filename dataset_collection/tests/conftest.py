@@ -0,0 +1,21 @@
+import os
+import sys
+
+import pytest
+
+# the modules of dataset_collection are imported by name, as the scripts do
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from synthetic_markets import generate_market
+
+
+@pytest.fixture(scope="session")
+def synthetic_market():
+    """(raw_df, market_meta, collateral_meta, loan_meta) of a small market with a WETH priced loan asset."""
+    # a loan price far from 1 shows unit mistakes that a stablecoin hides
+    raw_df, markets_meta, assets_meta = generate_market(4000, seed=3, name="test_market", loan_asset="WETH")
+    market_meta = next(iter(markets_meta.values()))
+    return (
+        raw_df, market_meta,
+        assets_meta[market_meta["collateral_asset_address"]], assets_meta[market_meta["loan_asset_address"]],
+    )
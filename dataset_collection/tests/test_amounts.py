@@ -0,0 +1,29 @@
+import io
+
+import numpy as np
+import pandas as pd
+
+from amounts import add_amount_units, raw_amounts, RAW_DTYPES
+
+MARKET_META = {"address": "0xmarket", "collateral_asset_decimals": 18, "loan_asset_decimals": 6}
+RAW_CSV = """type,assets,shares,liquidated_assets
+MarketSupplyCollateral,123456789012345678901234,,0
+MarketBorrow,9007199254740993,9007199254740993000000,0
+MarketLiquidation,5,,1
+"""
+
+
+def test_raw_amounts_keep_every_digit():
+    assert raw_amounts(pd.Series(["9007199254740993", None])).dtype == "Int64"
+    big = raw_amounts(pd.Series(["123456789012345678901234", "-1", ""]))
+    assert big.tolist() == [123456789012345678901234, -1, None]
+
+
+def test_units_are_scaled_from_exact_integers():
+    df = add_amount_units(pd.read_csv(io.StringIO(RAW_CSV), dtype=RAW_DTYPES), MARKET_META)
+    # written back unchanged, no float64 on the way
+    out = pd.read_csv(io.StringIO(df.to_csv(index=False)), dtype=str)
+    assert out["assets"].tolist() == ["123456789012345678901234", "9007199254740993", "5"]
+    assert out["shares"].tolist()[1] == "9007199254740993000000"
+    np.testing.assert_allclose(df["assets_units"], [123456.78901234568, 9007199254.740993, 5e-06])
+    np.testing.assert_allclose(df["liquidated_assets_units"], [0, 0, 1e-18])
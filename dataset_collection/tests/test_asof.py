@@ -0,0 +1,35 @@
+import numpy as np
+import pandas as pd
+import pytest
+
+from asof import asof_columns
+
+
+def _closest_value(df, timestamp, column, direction):
+    # one search per timestamp, the lookup asof_columns replaces
+    ts = df["timestamp"].values
+    if direction == "backward":
+        idx = np.searchsorted(ts, timestamp, side="right") - 1
+        return np.nan if idx < 0 else df[column].iloc[idx]
+    idx = np.searchsorted(ts, timestamp, side="left")
+    return np.nan if idx == len(ts) else df[column].iloc[idx]
+
+
+@pytest.mark.parametrize("direction", ["backward", "forward"])
+def test_asof_columns_matches_per_timestamp_lookup(direction):
+    rng = np.random.default_rng(0)
+    df = pd.DataFrame({
+        "timestamp": np.sort(rng.choice(10_000, 300, replace=False)),
+        "a": rng.normal(size=300),
+        "b": rng.normal(size=300),
+    })
+    left = rng.integers(-100, 10_100, 1000)
+
+    a, b = asof_columns(df, left, ["a", "b"], direction=direction)
+    single = asof_columns(df, left, "a", direction=direction)
+
+    expected_a = np.array([_closest_value(df, t, "a", direction) for t in left])
+    expected_b = np.array([_closest_value(df, t, "b", direction) for t in left])
+    np.testing.assert_array_equal(a, expected_a)
+    np.testing.assert_array_equal(b, expected_b)
+    np.testing.assert_array_equal(single, expected_a)
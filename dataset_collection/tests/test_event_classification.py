@@ -0,0 +1,8 @@
+from amounts import add_amount_units
+from event_classification import check_equivalence
+
+
+def test_vectorized_classifier_matches_classify_event(synthetic_market):
+    raw_df, market_meta, collateral_meta, loan_meta = synthetic_market
+    df = add_amount_units(raw_df, market_meta, collateral_meta, loan_meta)
+    assert check_equivalence(df) == 0
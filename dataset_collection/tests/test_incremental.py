@@ -0,0 +1,68 @@
+import io
+
+import numpy as np
+import pandas as pd
+import pytest
+
+from compute_market_metrics_changes_df import enrich_events, CONTEXT_WINDOW
+from incremental import context_start
+from irm import rate_at_target_history
+
+
+def _csv_round_trip(df):
+    # continued runs read their context back from the enriched csv
+    return pd.read_csv(io.StringIO(df.to_csv(index=False)))
+
+
+def _enrich_in_runs(raw_df, market_meta, collateral_meta, loan_meta, cuts, accounting="accrual"):
+    rates = rate_at_target_history(market_meta)
+    written = None
+    state = None
+    for lo, hi in zip([0] + cuts, cuts + [len(raw_df)]):
+        context = None
+        if state is not None:
+            k = context_start(written["timestamp"].values, state["last_timestamp"], CONTEXT_WINDOW)
+            context = written.iloc[k:].reset_index(drop=True)
+            written = written.iloc[:k]
+        res, state = enrich_events(
+            raw_df.iloc[lo:hi].reset_index(drop=True), market_meta, collateral_meta, loan_meta, rates,
+            state=state, context=context, accounting=accounting,
+        )
+        res = _csv_round_trip(res)
+        written = res if written is None else pd.concat([written, res], ignore_index=True)
+    return written
+
+
+def _timestamp_cuts(raw_df, fractions):
+    # runs end between two timestamps, as chunk_ends and appended raw files do
+    timestamps = raw_df["timestamp"].values
+    return [int(np.searchsorted(timestamps, timestamps[int(f * len(raw_df))], side="right")) for f in fractions]
+
+
+@pytest.mark.parametrize("accounting", ["accrual", "shares"])
+def test_continued_runs_match_full_build(synthetic_market, accounting):
+    raw_df, market_meta, collateral_meta, loan_meta = synthetic_market
+    cuts = _timestamp_cuts(raw_df, [0.3, 0.31, 0.7])
+    full = _enrich_in_runs(raw_df, market_meta, collateral_meta, loan_meta, [], accounting)
+    runs = _enrich_in_runs(raw_df, market_meta, collateral_meta, loan_meta, cuts, accounting)
+
+    assert list(runs.columns) == list(full.columns)
+    key = ["timestamp", "hash", "user_address", "type", "assets"]
+    full = full.sort_values(key).reset_index(drop=True)
+    runs = runs.sort_values(key).reset_index(drop=True)
+    for column in full.columns:
+        if full[column].dtype.kind == "f":
+            np.testing.assert_allclose(runs[column], full[column], rtol=1e-9, atol=1e-12, err_msg=column)
+        else:
+            assert (runs[column].astype(str) == full[column].astype(str)).all(), column
+
+
+def test_ltv_and_health_factor_use_loan_price(synthetic_market):
+    raw_df, market_meta, collateral_meta, loan_meta = synthetic_market
+    res = _enrich_in_runs(raw_df, market_meta, collateral_meta, loan_meta, [])
+    lltv = int(market_meta["lltv"]) / 10**18
+    borrowers = res[(res["collateral_value_after"] > 0) & (res["debt_after"] > 0)]
+    assert len(borrowers) > 0
+    np.testing.assert_allclose(borrowers["ltv_after"], borrowers["debt_after"] / borrowers["collateral_value_after"])
+    hf = (borrowers["collateral_value_after"] * lltv / borrowers["debt_after"]).clip(0, 1000)
+    np.testing.assert_allclose(borrowers["health_factor_after"], hf)
@@ -0,0 +1,31 @@
+import time
+import threading
+
+from pipeline import run_graph
+
+
+def test_group_limit_leaves_threads_for_other_tasks():
+    lock = threading.Lock()
+    running = {"metrics": 0, "max_metrics": 0}
+    fetch_started = {}
+
+    def build():
+        with lock:
+            running["metrics"] += 1
+            running["max_metrics"] = max(running["max_metrics"], running["metrics"])
+        time.sleep(0.05)
+        with lock:
+            running["metrics"] -= 1
+
+    def fetch(name):
+        fetch_started[name] = time.time()
+
+    start = time.time()
+    tasks = [{"name": f"metrics:{i}", "fn": build, "group": "metrics"} for i in range(6)]
+    tasks += [{"name": f"fetch:{i}", "fn": fetch, "kwargs": {"name": i}} for i in range(4)]
+    status, _, _ = run_graph(tasks, max_workers=3, limits={"metrics": 1})
+
+    assert all(st == "done" for st in status.values())
+    assert running["max_metrics"] == 1
+    # the fetches did not wait for the queued builds
+    assert max(fetch_started.values()) - start < 0.05 * 3
@@ -0,0 +1,16 @@
+import sys
+
+from profiling import StageProfiler
+
+
+def test_close_stops_the_sampler_without_a_report(tmp_path):
+    profiler = StageProfiler("market", reports_path=str(tmp_path), sample=True)
+    with profiler.stage("enrich_events"):
+        sum(range(1000))
+    profile = profiler.close()
+    assert sys.getprofile() is None
+    assert profile is not None and (tmp_path / profile.split("/")[-1]).exists()
+    assert not (tmp_path / "market.json").exists()
+    # a second build in the same process can profile again
+    StageProfiler("next", reports_path=str(tmp_path), sample=True).save()
+    assert sys.getprofile() is None
@@ -0,0 +1,21 @@
+import numpy as np
+
+from rolling import rolling_time_stats, window_bounds
+
+
+def test_median_matches_brute_force():
+    rng = np.random.default_rng(0)
+    n = 500
+    timestamps = np.sort(rng.integers(0, n * 30, n))
+    # repeated values and NaNs exercise the lazy removal
+    values = np.round(rng.normal(size=n), 1)
+    values[rng.random(n) < 0.1] = np.nan
+    for gap in (None, 60):
+        stats = rolling_time_stats(timestamps, values, [300, 3600], stats=["median"], gap=gap)
+        for window in (300, 3600):
+            lo, hi = window_bounds(timestamps, window, gap)
+            expected = [
+                np.median(w[~np.isnan(w)]) if (~np.isnan(w)).any() else np.nan
+                for w in (values[a:b] for a, b in zip(lo, hi))
+            ]
+            np.testing.assert_array_equal(stats[("median", window)], expected)
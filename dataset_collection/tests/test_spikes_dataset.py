@@ -0,0 +1,60 @@
+import numpy as np
+import pandas as pd
+
+from build_cache import BuildCache
+from spikes_dataset import SPIKE_PARAMS, run_spikes
+
+
+def _enriched_events(spike_starts, n=300):
+    # utilization at 0.8, jumping to 0.95 for 5 events at every spike start
+    start = int(pd.Timestamp("2025-02-01").timestamp())
+    util = np.full(n, 0.8)
+    for i in spike_starts:
+        util[i:i + 5] = 0.95
+    return pd.DataFrame({
+        "timestamp": start + 600 * np.arange(n),
+        "hash": [f"0x{i:064x}" for i in range(n)],
+        "type": ["MarketBorrow" if u > 0.9 else "MarketRepay" for u in util],
+        "user_address": [f"0xuser{i % 7}" for i in range(n)],
+        "market_address": "0xmarket",
+        "utilization_before": np.concatenate([[0.8], util[:-1]]),
+        "utilization_after": util,
+        "total_borrow_after": 1e6,
+        "total_supply_after": 1e6 / util,
+    })
+
+
+def _run(tmp_path, params=SPIKE_PARAMS):
+    cache = BuildCache(str(tmp_path / "cache.json"))
+    status = run_spikes(
+        ["m"], params=params, enriched_path=str(tmp_path / "enriched"), spikes_path=str(tmp_path / "spikes"),
+        output=str(tmp_path / "all_spikes.csv"), cache=cache,
+    )
+    return status["m"], pd.read_csv(tmp_path / "all_spikes.csv")
+
+
+def test_spikes_are_rebuilt_only_when_their_inputs_change(tmp_path):
+    (tmp_path / "enriched").mkdir()
+    enriched_file = tmp_path / "enriched" / "m.csv"
+    _enriched_events([100]).to_csv(enriched_file, index=False)
+
+    status, spikes = _run(tmp_path)
+    assert status == "built"
+    assert len(spikes) == 1 and spikes["market_name"].iloc[0] == "m"
+
+    # nothing changed
+    written = (tmp_path / "all_spikes.csv").stat().st_mtime_ns
+    status, _ = _run(tmp_path)
+    assert status == "fresh"
+    assert (tmp_path / "all_spikes.csv").stat().st_mtime_ns == written
+
+    # rebuilt enriched events make the spikes and the combined dataset stale
+    _enriched_events([100, 200]).to_csv(enriched_file, index=False)
+    status, spikes = _run(tmp_path)
+    assert status == "built"
+    assert len(spikes) == 2
+
+    # so does a detection threshold
+    status, spikes = _run(tmp_path, {**SPIKE_PARAMS, "min_spike_delta": 0.2})
+    assert status == "built"
+    assert len(spikes) == 0
@@ -0,0 +1,85 @@
+import numpy as np
+
+from amounts import add_amount_units
+from accrual import TYPE_CODES
+from user_positions import (
+    compute_position_states, partitioned_position_states, final_states, DEBT_EPSILON, COLLATERAL_EPSILON,
+)
+
+# type -> (position, sign), the per-row rules add_user_ltv applied before the kernel
+DELTAS = {
+    "MarketSupplyCollateral": (0, 1), "MarketWithdrawCollateral": (0, -1),
+    "MarketBorrow": (1, 1), "MarketRepay": (1, -1),
+    "MarketSupply": (2, 1), "MarketWithdraw": (2, -1),
+}
+
+
+def _sorted_events(synthetic_market):
+    raw_df, market_meta, collateral_meta, loan_meta = synthetic_market
+    df = add_amount_units(raw_df, market_meta, collateral_meta, loan_meta)
+    df = df[df["user_address"].notna()].sort_values(["user_address", "timestamp", "hash"]).reset_index(drop=True)
+    return df["user_address"].values, df["hash"].values, df["type"].values, np.abs(df["assets_units"].values.astype(float))
+
+
+def test_partitioned_states_match_single_process(synthetic_market):
+    users, hashes, types, amounts = _sorted_events(synthetic_market)
+    single = partitioned_position_states(users, hashes, types, amounts, n_jobs=1)
+    for n_jobs in (2, 3):
+        parallel = partitioned_position_states(users, hashes, types, amounts, n_jobs=n_jobs)
+        assert len(parallel) == len(single)
+        for a, b in zip(single, parallel):
+            np.testing.assert_array_equal(a, b)
+
+
+def _reference_states(users, hashes, types, amounts):
+    """(collateral, debt, supply) before / after every transaction, one row at a time."""
+    before, after = [], []
+    position = None
+    for i in range(len(users)):
+        if i == 0 or users[i] != users[i - 1]:
+            position = [0.0, 0.0, 0.0]
+        if i == 0 or users[i] != users[i - 1] or hashes[i] != hashes[i - 1]:
+            before.append(list(position))
+            after.append(None)
+        if types[i] in DELTAS:
+            k, sign = DELTAS[types[i]]
+            position[k] += sign * amounts[i]
+        if abs(position[1]) < DEBT_EPSILON:
+            position[1] = 0.0
+        if abs(position[0]) < COLLATERAL_EPSILON:
+            position[0] = 0.0
+        after[-1] = list(position)
+    return np.array(before), np.array(after)
+
+
+def test_kernel_matches_row_by_row_positions(synthetic_market):
+    users, hashes, types, amounts = _sorted_events(synthetic_market)
+    starts, _, coll_before, debt_before, supply_before, coll_after, debt_after, supply_after, type_mask = (
+        compute_position_states(users, hashes, types, amounts)
+    )
+    before, after = _reference_states(users, hashes, types, amounts)
+    np.testing.assert_array_equal(np.column_stack([coll_before, debt_before, supply_before]), before)
+    np.testing.assert_array_equal(np.column_stack([coll_after, debt_after, supply_after]), after)
+    assert all(type_mask[t] & (1 << TYPE_CODES[types[starts[t]]]) for t in range(len(starts)))
+
+
+def test_initial_states_continue_positions(synthetic_market):
+    users, hashes, types, amounts = _sorted_events(synthetic_market)
+    full = compute_position_states(users, hashes, types, amounts)
+    # split every user's history in two at the same transaction boundary
+    starts = full[0]
+    cut = {}
+    for row in starts:
+        cut.setdefault(users[row], []).append(row)
+    first = np.zeros(len(users), dtype=bool)
+    for user, rows in cut.items():
+        if len(rows) > 1:
+            end = rows[len(rows) // 2]
+            first[rows[0]:end] = True
+    head = compute_position_states(users[first], hashes[first], types[first], amounts[first])
+    states = final_states(users[first][head[0]], head[1], head[5], head[6], head[7])
+    tail = compute_position_states(users[~first], hashes[~first], types[~first], amounts[~first], initial_states=states)
+
+    tail_tx = np.isin(starts, np.flatnonzero(~first))
+    for k in range(2, 8):
+        np.testing.assert_allclose(tail[k], full[k][tail_tx], rtol=1e-12, atol=1e-9)
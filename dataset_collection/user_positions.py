@@ -0,0 +1,173 @@
+"""
+Per-user position state for add_user_ltv in one sorted pass.
+
+Events are sorted by (user, timestamp, hash); a transaction is a run of
+rows with the same user and hash. For every transaction the kernel returns
+the user's collateral / debt / supply before and after it, plus a bitmask
+of the event types it contains (bit TYPE_CODES[type]). Users are
+independent, so big markets can be split between processes by a hash of
+the user address.
+"""
+import numpy as np
+import pandas as pd
+from concurrent.futures import ProcessPoolExecutor
+
+from accrual import TYPE_CODES, encode_types
+from jit import njit, NUMBA
+
+DEBT_EPSILON = 1e-6
+COLLATERAL_EPSILON = 1e-11
+
+
+def type_names(type_mask):
+    """Event type names present in a transaction bitmask."""
+    return [name for name, code in TYPE_CODES.items() if type_mask & (1 << code)]
+
+
+def transaction_starts(users, hashes):
+    """First row of every (user, hash) run and whether it starts a new user."""
+    users = np.asarray(users)
+    hashes = np.asarray(hashes)
+    if len(users) == 0:
+        return np.zeros(0, dtype=np.int64), np.zeros(0, dtype=bool)
+    new_user = np.ones(len(users), dtype=bool)
+    new_user[1:] = users[1:] != users[:-1]
+    new_tx = new_user.copy()
+    new_tx[1:] |= hashes[1:] != hashes[:-1]
+    starts = np.flatnonzero(new_tx)
+    return starts, new_user[starts]
+
+
+@njit(cache=True)
+def position_state_kernel(starts, new_user, type_codes, amounts, init_coll, init_debt, init_supply):
+    n = len(type_codes)
+    n_tx = len(starts)
+    coll_before = np.zeros(n_tx)
+    debt_before = np.zeros(n_tx)
+    supply_before = np.zeros(n_tx)
+    coll_after = np.zeros(n_tx)
+    debt_after = np.zeros(n_tx)
+    supply_after = np.zeros(n_tx)
+    type_mask = np.zeros(n_tx, dtype=np.int64)
+
+    collateral = 0.0
+    debt = 0.0
+    supply = 0.0
+    for t in range(n_tx):
+        if new_user[t]:
+            collateral = init_coll[t]
+            debt = init_debt[t]
+            supply = init_supply[t]
+        coll_before[t] = collateral
+        debt_before[t] = debt
+        supply_before[t] = supply
+
+        end = starts[t + 1] if t + 1 < n_tx else n
+        mask = 0
+        for i in range(starts[t], end):
+            code = type_codes[i]
+            amount = amounts[i]
+            mask |= 1 << code
+            if code == 6:
+                collateral += amount
+            elif code == 7:
+                collateral -= amount
+            elif code == 3:
+                debt += amount
+            elif code == 4:
+                debt -= amount
+            elif code == 1:
+                supply += amount
+            elif code == 2:
+                supply -= amount
+
+            if abs(debt) < DEBT_EPSILON:
+                debt = 0.0
+            if abs(collateral) < COLLATERAL_EPSILON:
+                collateral = 0.0
+
+        coll_after[t] = collateral
+        debt_after[t] = debt
+        supply_after[t] = supply
+        type_mask[t] = mask
+
+    return coll_before, debt_before, supply_before, coll_after, debt_after, supply_after, type_mask
+
+
+def initial_state_arrays(tx_users, initial_states):
+    """Per transaction (collateral, debt, supply) a user starts from, zeros for unknown users."""
+    init = np.zeros((3, len(tx_users)))
+    if initial_states:
+        for t, user in enumerate(tx_users):
+            state = initial_states.get(user)
+            if state is not None:
+                init[:, t] = state[:3]
+    return init
+
+
+def compute_position_states(users, hashes, types, amounts, initial_states=None):
+    """
+    Array entry point, rows must be sorted by (user, timestamp, hash).
+    Returns (starts, new_user, coll_before, debt_before, supply_before,
+    coll_after, debt_after, supply_after, type_mask), one value per transaction.
+    initial_states ({user: (collateral, debt, supply)}) continues the
+    positions of a previous run.
+    """
+    starts, new_user = transaction_starts(users, hashes)
+    type_codes = encode_types(types)
+    amounts = np.asarray(amounts, dtype=np.float64)
+    init_coll, init_debt, init_supply = initial_state_arrays(np.asarray(users)[starts], initial_states)
+    if NUMBA:
+        res = position_state_kernel(starts, new_user, type_codes, amounts, init_coll, init_debt, init_supply)
+    else:
+        res = position_state_kernel(
+            starts.tolist(), new_user.tolist(), type_codes.tolist(), amounts.tolist(),
+            init_coll.tolist(), init_debt.tolist(), init_supply.tolist(),
+        )
+    return (starts, new_user) + tuple(np.asarray(a) for a in res)
+
+
+def _partition_states(args):
+    users, hashes, types, amounts, initial_states = args
+    return compute_position_states(users, hashes, types, amounts, initial_states)
+
+
+def partitioned_position_states(users, hashes, types, amounts, n_jobs=1, initial_states=None):
+    """
+    compute_position_states over n_jobs user-hash partitions in parallel,
+    results are merged back into the transaction order of the full input.
+    """
+    users = np.asarray(users)
+    if n_jobs <= 1 or len(users) == 0:
+        return compute_position_states(users, hashes, types, amounts, initial_states)
+
+    hashes = np.asarray(hashes)
+    types = np.asarray(types)
+    amounts = np.asarray(amounts, dtype=np.float64)
+    partition = pd.util.hash_array(users.astype(str)) % n_jobs
+    rows = [np.flatnonzero(partition == p) for p in range(n_jobs)]
+    rows = [r for r in rows if len(r) > 0]
+    with ProcessPoolExecutor(max_workers=len(rows)) as executor:
+        parts = list(executor.map(_partition_states, [
+            (users[r], hashes[r], types[r], amounts[r], initial_states) for r in rows
+        ]))
+
+    # transactions of the full input start at the same rows, in row order
+    tx_rows = np.concatenate([r[part[0]] for r, part in zip(rows, parts)])
+    order = np.argsort(tx_rows, kind="stable")
+    merged = [tx_rows[order]]
+    for k in range(1, len(parts[0])):
+        merged.append(np.concatenate([part[k] for part in parts])[order])
+    return tuple(merged)
+
+
+def final_states(tx_users, new_user, coll_after, debt_after, supply_after):
+    """{user: [collateral, debt, supply]} after the last transaction of every user."""
+    last_tx = np.ones(len(new_user), dtype=bool)
+    last_tx[:-1] = new_user[1:]
+    return {
+        user: [float(c), float(d), float(s)]
+        for user, c, d, s in zip(
+            np.asarray(tx_users)[last_tx], coll_after[last_tx], debt_after[last_tx], supply_after[last_tx]
+        )
+    }